@@ -1,17 +1,58 @@
-from libs.install_lib import is_package_installed, install_package
+import os
+from libs.install_lib import ensure_wheel_installed
 
-if not is_package_installed("gradio_codeextend"):
-    install_package("./libs/gradio_codeextend-0.0.1-py3-none-any.whl")
+# 只在wheel变化或包缺失时安装，正常启动只需要一次find_spec和一次标记文件读取
+ensure_wheel_installed("gradio_codeextend", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         "libs", "gradio_codeextend-0.0.1-py3-none-any.whl"))
 
 import gradio as gr
 from blocks.Interface import interface
+from core.metrics import render_latest, start_metrics_server
 
 
-def main():
+def build_blocks() -> gr.Blocks:
     with gr.Blocks() as app:
         interface.create()
+        # 关闭或刷新页面时停止该会话还在进行的模型请求和代码运行
+        app.unload(interface.cancel_session)
+
+    # LLM相关handler都是异步的，流式输出时不占用工作线程，因此可以放开每个事件的并发上限
+    # 设置为none表示不限制，同步handler（如运行代码）仍受Gradio线程池大小限制
+    concurrency_limit = os.getenv("AI_CODELAB_CONCURRENCY_LIMIT", "none")
+    app.queue(default_concurrency_limit=None if concurrency_limit == "none" else int(concurrency_limit))
+    return app
+
+
+def create_app():
+    """
+    ASGI应用工厂，用于多进程部署：
+        uvicorn app:create_app --factory --workers N
+    界面状态按会话保存在 gr.State 中，各工作进程之间不共享任何全局状态；
+    负载均衡需要开启会话粘滞，保证同一会话的请求落在同一个工作进程上。
+    安装了 prometheus_client 时，在 /metrics 暴露Prometheus指标（见 core.metrics）。
+    """
+    from fastapi import FastAPI, Response
+
+    api = FastAPI()
 
-    app.launch()
+    # 需要在挂载Gradio之前注册，否则会被挂载在 / 的Gradio应用接管
+    @api.get("/metrics", include_in_schema=False)
+    def metrics():
+        latest = render_latest()
+        if latest is None:
+            return Response("prometheus_client is not installed\n", status_code=404, media_type="text/plain")
+        body, content_type = latest
+        return Response(body, media_type=content_type)
+
+    return gr.mount_gradio_app(api, build_blocks(), path="/")
+
+
+def main():
+    # 直接运行时没有可以挂载 /metrics 的FastAPI应用，需要指标时在单独的端口上提供
+    metrics_port = os.getenv("AI_CODELAB_METRICS_PORT")
+    if metrics_port:
+        start_metrics_server(int(metrics_port))
+    build_blocks().launch()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,168 @@
+"""
+基准测试用的本地模拟服务（只依赖标准库）
+
+同一个HTTP服务同时提供：
+    POST /v1/chat/completions  OpenAI兼容的流式接口（SSE），首字延迟、输出速度和故障比例可配置
+    POST /run_code/            模拟代码运行服务，固定延迟后返回 {"stdout", "error"}
+    POST /run_code/stream/     run_code 的SSE版本，见 CodeRunnerClient.astream_code
+
+服务在独立进程中运行，不与被测代码争用CPU和GIL，被测进程的CPU时间只包含客户端自身的开销。
+"""
+import asyncio
+import http
+import json
+import multiprocessing
+import random
+import time
+from typing import NamedTuple, Optional, Tuple
+
+
+class MockConfig(NamedTuple):
+    """
+    ttft: 收到请求到发送第一个token的时间（秒）
+    tokens_per_second: 首字之后的输出速度
+    tokens: 每个响应的token数（每个token一个SSE事件）
+    failure_rate: 直接返回500的请求比例，用于测试路由切换
+    disconnect_rate: 输出一半后断开连接的请求比例
+    run_latency: /run_code/ 的处理时间（秒）
+    seed: 随机数种子，便于复现故障注入
+    """
+    ttft: float = 0.2
+    tokens_per_second: float = 50.0
+    tokens: int = 200
+    failure_rate: float = 0.0
+    disconnect_rate: float = 0.0
+    run_latency: float = 0.05
+    seed: Optional[int] = None
+
+
+class _MockHandler:
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个连接，支持keep-alive，客户端连接池可以复用连接"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                if not await self.dispatch(method, path, body, writer):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter) -> bool:
+        """Returns: 连接是否可以继续使用"""
+        path = path.split("?", 1)[0]
+        if method == "POST" and path.endswith("/chat/completions"):
+            return await self.chat_completions(json.loads(body or b"{}"), writer)
+        if method == "POST" and path == "/run_code/":
+            await asyncio.sleep(self.config.run_latency)
+            payload = json.loads(body or b"{}")
+            await self.send_json(writer, 200, {"stdout": f"ran {len(payload.get('code', ''))} chars\n", "error": ""})
+            return True
+        if method == "POST" and path == "/run_code/stream/":
+            return await self.run_code_stream(json.loads(body or b"{}"), writer)
+        await self.send_json(writer, 404, {"error": "not found"})
+        return True
+
+    @staticmethod
+    async def send_json(writer: asyncio.StreamWriter, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+
+    @staticmethod
+    async def send_event(writer: asyncio.StreamWriter, event: str):
+        data = event.encode("utf-8")
+        writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+        await writer.drain()
+
+    @staticmethod
+    async def start_stream(writer: asyncio.StreamWriter):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Transfer-Encoding: chunked\r\n\r\n")
+        await writer.drain()
+
+    async def chat_completions(self, request: dict, writer: asyncio.StreamWriter) -> bool:
+        config = self.config
+        if self.random.random() < config.failure_rate:
+            await self.send_json(writer, 500, {"error": {"message": "injected failure", "type": "server_error"}})
+            return True
+        disconnect_at = config.tokens // 2 if self.random.random() < config.disconnect_rate else None
+        model = request.get("model", "mock")
+
+        def chunk(delta: dict, finish_reason: Optional[str] = None) -> str:
+            return "data: " + json.dumps({
+                "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }) + "\n\n"
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await self.start_stream(writer)
+        await self.send_event(writer, chunk({"role": "assistant", "content": ""}))
+        interval = 1.0 / config.tokens_per_second
+        for i in range(config.tokens):
+            # 按绝对时间发送，避免sleep误差累积
+            await asyncio.sleep(max(0.0, start + config.ttft + i * interval - loop.time()))
+            if i == disconnect_at:
+                writer.transport.abort()
+                return False
+            await self.send_event(writer, chunk({"content": f"tok{i} "}))
+        await self.send_event(writer, chunk({}, "stop") + "data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    async def run_code_stream(self, request: dict, writer: asyncio.StreamWriter) -> bool:
+        await self.start_stream(writer)
+        stdout = f"ran {len(request.get('code', ''))} chars\n"
+        await asyncio.sleep(self.config.run_latency)
+        await self.send_event(writer, f"event: stdout\ndata: {json.dumps({'text': stdout})}\n\n")
+        await self.send_event(writer, f"event: result\ndata: {json.dumps({'stdout': stdout, 'error': ''})}\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+
+def _serve(config: MockConfig, conn):
+    async def main():
+        handler = _MockHandler(config)
+        server = await asyncio.start_server(handler.handle, "127.0.0.1", 0, backlog=1024)
+        conn.send(server.sockets[0].getsockname()[1])
+        conn.close()
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def start_mock_server(config: MockConfig) -> Tuple[multiprocessing.Process, str]:
+    """
+    在独立进程中启动模拟服务
+    Args:
+        config: 模拟服务的配置
+    Returns:
+        tuple: (服务进程, 服务地址，例如 http://127.0.0.1:12345)，用完后调用 process.terminate()
+    """
+    context = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_serve, args=(config, child_conn), daemon=True)
+    process.start()
+    port = parent_conn.recv()
+    return process, f"http://127.0.0.1:{port}"
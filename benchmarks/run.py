@@ -0,0 +1,105 @@
+"""
+离线基准测试入口，不需要API密钥和代码运行服务：
+
+    python -m benchmarks.run --scenarios chat,handler,run_code --concurrency 1,8,32 --output bench.json
+
+结果写入JSON文件，包含代码版本（git提交）和模拟服务配置，可以在不同版本之间对比。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# 以 python benchmarks/run.py 运行时也能导入项目模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_servers import MockConfig, start_mock_server
+from benchmarks.scenarios import SCENARIOS
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _handler_overhead(results: list) -> list:
+    """handler与chat在相同并发数下的平均总耗时之差，即handler自身（提示词构建、累计文本等）的开销"""
+    chat = {r["concurrency"]: r for r in results if r["scenario"] == "chat" and r["total_seconds"]}
+    overhead = []
+    for r in results:
+        if r["scenario"] == "handler" and r["total_seconds"] and r["concurrency"] in chat:
+            base = chat[r["concurrency"]]
+            overhead.append({
+                "concurrency": r["concurrency"],
+                "total_ms": (r["total_seconds"]["mean"] - base["total_seconds"]["mean"]) * 1000,
+                "cpu_ms_per_token": (r["cpu_ms_per_token"] or 0) - (base["cpu_ms_per_token"] or 0),
+            })
+    return overhead
+
+
+async def run(scenarios: list, concurrency_levels: list, requests: int, base_url: str) -> list:
+    results = []
+    for name in scenarios:
+        for concurrency in concurrency_levels:
+            result = await SCENARIOS[name](base_url, concurrency, max(requests, concurrency))
+            print(json.dumps({k: v for k, v in result.items() if k != "error_examples"}, ensure_ascii=False),
+                  file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI-CodeLab 离线基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔的场景：" + ",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32", help="逗号分隔的并发数")
+    parser.add_argument("--requests", type=int, default=64, help="每个并发数下的请求数（不少于并发数）")
+    parser.add_argument("--ttft", type=float, default=MockConfig.ttft, help="模拟首字延迟（秒）")
+    parser.add_argument("--tps", type=float, default=MockConfig.tokens_per_second, help="模拟输出速度（token/秒）")
+    parser.add_argument("--tokens", type=int, default=MockConfig.tokens, help="每个响应的token数")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="直接返回500的请求比例")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="输出中途断开的请求比例")
+    parser.add_argument("--run-latency", type=float, default=MockConfig.run_latency, help="模拟运行服务的延迟（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="故障注入的随机数种子")
+    parser.add_argument("--output", default="", help="结果JSON文件路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(sorted(unknown))}")
+    config = MockConfig(ttft=args.ttft, tokens_per_second=args.tps, tokens=args.tokens,
+                        failure_rate=args.failure_rate, disconnect_rate=args.disconnect_rate,
+                        run_latency=args.run_latency, seed=args.seed)
+
+    process, base_url = start_mock_server(config)
+    try:
+        results = asyncio.run(run(scenarios, [int(c) for c in args.concurrency.split(",")], args.requests, base_url))
+    finally:
+        process.terminate()
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "mock_config": config._asdict(),
+        "results": results,
+        "handler_overhead": _handler_overhead(results),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""
+基准测试场景，每个场景在给定的并发数下发出一批请求，返回一条可以写入JSON的结果
+
+    chat:     ChatClient.astream_chat 的TTFT、输出速度和每个token的CPU开销
+    handler:  Interface中代码解释handler的端到端耗时，与chat对比得到handler自身的开销，
+              以及按帧刷新后每个请求的界面更新次数和发送的字符数
+    run_code: arun_code（远程后端）的延迟和吞吐量
+    normalization: 同一段代码以不同格式重复请求代码解释和运行，规范化缓存键带来的命中率提升
+"""
+import asyncio
+import contextvars
+import itertools
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows下没有resource模块，不统计内存峰值
+    resource = None
+
+_counter = itertools.count()
+
+# handler场景中当前请求收到的模型片段数，handler按帧产出，产出次数少于token数
+_request_tokens = contextvars.ContextVar("request_tokens", default=None)
+
+
+def summarize(values: List[float]) -> Optional[dict]:
+    """计算 mean/p50/p95/max，没有样本时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "mean": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    # Linux下ru_maxrss的单位是KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_chat_client(base_url: str):
+    """创建指向模拟服务的ChatClient，使用独立的连接池、路由器和限流器，并关闭响应缓存"""
+    from core.llm.chat import ChatClient
+    from core.llm.client_pool import ClientRegistry
+    from core.llm.ratelimit import RateLimiter
+    from core.llm.router import ProviderRouter
+
+    os.environ.setdefault("GITEE_API_KEY", "benchmark")
+    os.environ.setdefault("DASHSCOPE_API_KEY", "benchmark")
+    client = ChatClient(registry=ClientRegistry(), router=ProviderRouter(), limiter=RateLimiter())
+    client.cache_enabled = False
+    for provider in ("gitee", "aliyuncs"):
+        client.providers[provider]["base_url"] = f"{base_url}/v1"
+    return client
+
+
+async def _run_batch(concurrency: int, requests: int,
+                     request: Callable[[], Awaitable[dict]]) -> Dict[str, object]:
+    """以给定并发数执行requests次request，汇总各次返回的指标"""
+    semaphore = asyncio.Semaphore(concurrency)
+    samples, errors = [], []
+
+    async def one():
+        async with semaphore:
+            try:
+                samples.append(await request())
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return {
+        "samples": samples,
+        "errors": len(errors),
+        "error_examples": sorted(set(errors))[:3],
+        "wall_seconds": time.perf_counter() - wall_start,
+        "cpu_seconds": time.process_time() - cpu_start,
+    }
+
+
+def _stream_report(name: str, concurrency: int, batch: dict) -> dict:
+    samples = batch["samples"]
+    tokens = sum(sample["tokens"] for sample in samples)
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": len(samples) + batch["errors"],
+        "errors": batch["errors"],
+        "error_examples": batch["error_examples"],
+        "wall_seconds": batch["wall_seconds"],
+        "ttft_seconds": summarize([sample["ttft"] for sample in samples if sample["ttft"] is not None]),
+        "total_seconds": summarize([sample["total"] for sample in samples]),
+        "tokens_per_second": summarize([sample["tokens"] / sample["stream_seconds"]
+                                        for sample in samples if sample["stream_seconds"] > 0]),
+        "total_tokens": tokens,
+        "frames_per_request": summarize([sample["frames"] for sample in samples]),
+        "chars_sent_per_request": summarize([sample["chars"] for sample in samples]),
+        "cpu_ms_per_token": batch["cpu_seconds"] * 1000 / tokens if tokens else None,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+async def _measure_stream(stream) -> dict:
+    """
+    消费一个异步流，记录首个片段时间、产出次数、产出的字符总数（不做差量时需要发送的量）和总耗时
+    tokens在handler场景中由 _count_tokens 统计，其他场景等于产出次数
+    """
+    start = time.perf_counter()
+    first = None
+    frames = chars = 0
+    async for value in stream:
+        if first is None:
+            first = time.perf_counter()
+        frames += 1
+        chars += len(value) if isinstance(value, str) else 0
+    end = time.perf_counter()
+    return {
+        "ttft": first - start if first is not None else None,
+        "total": end - start,
+        "tokens": frames,
+        "frames": frames,
+        "chars": chars,
+        "stream_seconds": end - first if first is not None else 0.0,
+    }
+
+
+def _count_tokens(client):
+    """包装ChatClient.astream_chat，把收到的片段数记到当前请求的 _request_tokens 中"""
+    original = client.astream_chat
+
+    async def astream_chat(*args, **kwargs):
+        counter = _request_tokens.get()
+        async for delta in original(*args, **kwargs):
+            if counter is not None:
+                counter[0] += 1
+            yield delta
+
+    client.astream_chat = astream_chat
+    return client
+
+
+async def bench_chat(base_url: str, concurrency: int, requests: int, model: str = "qwen-turbo") -> dict:
+    client = make_chat_client(base_url)
+    provider = "aliyuncs"
+
+    async def request():
+        # 每个请求的内容不同，避免任何一层缓存命中
+        context = [{"role": "user", "content": f"benchmark request {next(_counter)}"}]
+        return await _measure_stream(client.astream_chat(provider, model, context))
+
+    try:
+        return _stream_report("chat", concurrency, await _run_batch(concurrency, requests, request))
+    finally:
+        await client.registry.aclose()
+
+
+async def bench_handler(base_url: str, concurrency: int, requests: int, model: str = "qwen-turbo") -> dict:
+    """
+    通过 Interface._handle_code_explain 发出同样的请求。
+    handler按帧产出累计文本，tokens按模型片段数统计，和chat场景的结果可以直接对比；
+    frames_per_request和chars_sent_per_request反映界面的刷新次数和重新发送的文本量
+    """
+    from blocks.Interface import interface, new_session_state
+
+    interface._chat_client = _count_tokens(make_chat_client(base_url))
+    state = new_session_state()
+    state.update({"language": "Python", "model": model})
+
+    async def request():
+        code = f"def f():\n    return {next(_counter)}\n"
+        counter = [0]
+        _request_tokens.set(counter)
+        sample = await _measure_stream(interface._handle_code_explain(code, state))
+        sample["tokens"] = counter[0]
+        return sample
+
+    try:
+        return _stream_report("handler", concurrency, await _run_batch(concurrency, requests, request))
+    finally:
+        await interface._chat_client.registry.aclose()
+
+
+async def bench_run_code(base_url: str, concurrency: int, requests: int, language: str = "Python") -> dict:
+    from core.code_execution import run_code
+    from core.code_execution.backends import RemoteBackend
+    from core.code_execution.run_code import CodeRunnerClient
+
+    client = CodeRunnerClient(post_url=f"{base_url}/run_code/", pool_maxsize=max(concurrency, 1))
+    original_backend = run_code.execution_backend
+    run_code.execution_backend = RemoteBackend(client)
+
+    async def request():
+        code = f"print({next(_counter)})\n"
+        start = time.perf_counter()
+        await run_code.arun_code(language, code)
+        return {"latency": time.perf_counter() - start}
+
+    try:
+        batch = await _run_batch(concurrency, requests, request)
+    finally:
+        run_code.execution_backend = original_backend
+        await client.aclose()
+    samples = batch["samples"]
+    return {
+        "scenario": "run_code",
+        "concurrency": concurrency,
+        "requests": len(samples) + batch["errors"],
+        "errors": batch["errors"],
+        "error_examples": batch["error_examples"],
+        "wall_seconds": batch["wall_seconds"],
+        "latency_seconds": summarize([sample["latency"] for sample in samples]),
+        "requests_per_second": len(samples) / batch["wall_seconds"] if batch["wall_seconds"] else None,
+        "cpu_ms_per_request": batch["cpu_seconds"] * 1000 / len(samples) if samples else None,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _cosmetic_variants(code: str) -> List[str]:
+    """同一段Python代码的几种格式变化：原样、行尾空白、空行、注释、缩进"""
+    return [
+        code,
+        code.replace("\n", "  \n"),
+        "\n" + code.replace("\n", "\n\n"),
+        "# 计算并输出结果\n" + code,
+        code.replace("    ", "  "),
+    ]
+
+
+async def bench_normalization(base_url: str, concurrency: int, requests: int, model: str = "qwen-turbo") -> dict:
+    """
+    每个请求是一段不同的代码，依次以 _cosmetic_variants 的各种格式请求代码解释和运行（远程后端），
+    使用独立的内存缓存；exact_hit_rate 为不做规范化时的命中率，normalization_gain 为规范化带来的提升
+    """
+    from blocks.Interface import interface, new_session_state
+    from core.canonical import normalization_stats
+    from core.code_execution import run_code
+    from core.code_execution.backends import RemoteBackend
+    from core.code_execution.cache import ExecutionCache
+    from core.code_execution.run_code import CodeRunnerClient
+    from core.llm.cache import ResponseCache
+
+    chat_client = make_chat_client(base_url)
+    chat_client.cache_enabled = True
+    chat_client._cache = ResponseCache(db_path="")
+    interface._chat_client = chat_client
+    state = new_session_state()
+    state.update({"language": "Python", "model": model})
+
+    runner = CodeRunnerClient(post_url=f"{base_url}/run_code/", pool_maxsize=max(concurrency, 1))
+    original_backend, original_cache = run_code.execution_backend, run_code.execution_cache
+    run_code.execution_backend = RemoteBackend(runner)
+    run_code.execution_cache = ExecutionCache()
+    normalization_stats.reset()
+
+    async def request():
+        index = next(_counter)
+        code = f"def add(x):\n    return x + {index}\n\n\nprint(add({index}))\n"
+        for variant in _cosmetic_variants(code):
+            async for _ in interface._handle_code_explain(variant, state):
+                pass
+            await run_code.arun_code("Python", variant)
+        return {}
+
+    try:
+        batch = await _run_batch(concurrency, requests, request)
+    finally:
+        run_code.execution_backend, run_code.execution_cache = original_backend, original_cache
+        await runner.aclose()
+        await chat_client.registry.aclose()
+    return {
+        "scenario": "normalization",
+        "concurrency": concurrency,
+        "requests": len(batch["samples"]) + batch["errors"],
+        "errors": batch["errors"],
+        "error_examples": batch["error_examples"],
+        "wall_seconds": batch["wall_seconds"],
+        "variants_per_request": len(_cosmetic_variants("")),
+        **normalization_stats.stats(),
+    }
+
+
+SCENARIOS = {
+    "chat": bench_chat,
+    "handler": bench_handler,
+    "run_code": bench_run_code,
+    "normalization": bench_normalization,
+}
@@ -1,12 +1,35 @@
-from cProfile import label
 import re
+import time
+from contextlib import asynccontextmanager, contextmanager
 import gradio as gr
-from pydantic.v1.utils import get_model
+from core.admission import PRIORITY_BATCH, PRIORITY_INTERACTIVE, AdmissionRejected, admission_controller
+from core.cancellation import REASON_NAVIGATION, REASON_UNLOAD, cancellation_registry, latest_wins
 from core.llm.augment import generate_prompt
-from core.llm.chat import ChatUI
-from core.llm.chat import ChatClient
+from core.llm.stream import CodeBlockExtractor, FrameScheduler, StreamAccumulator, aframes, frame_policy
 from gradio_codeextend import CodeExtend as gr_CodeExtend
-from core.code_execution.run_code import run_code
+from core.llm.prompts import estimate_tokens, prompt_registry
+from core.metrics import POSTPROCESS_SECONDS, instrument_handler, timed
+
+
+# 测试结果表格的列
+TESTCASE_TABLE_HEADERS = ["测试", "结果", "耗时(ms)", "输出"]
+
+# 流式handler按输出框登记，同一会话的同一个输出框只保留最新的请求（见 core.cancellation）
+SLOT_LLM_TEXT = "llm_text_output_box"
+SLOT_LLM_CODE = "llm_code_output_box"
+SLOT_COMPARE = "compare_output_boxes"
+SLOT_TESTCASE = "testcase_output_box"
+SLOT_CODE_EXECUTE = "code_execute_output_box"
+
+
+def new_session_state() -> dict:
+    """
+    创建一个新会话的初始状态，作为 gr.State 的初始值，每个会话各自持有一份副本。
+
+    Returns:
+        dict: {"feature": 左侧导航栏选择的功能, "language": 选择的编程语言, "model": 选择的模型}，未选择时为空字符串。
+    """
+    return {"feature": "", "language": "", "model": ""}
 
 
 class Interface:
@@ -84,6 +107,8 @@ class Interface:
             "qwen-plus": "aliyuncs",
             "qwen-turbo": "aliyuncs",
         }
+        # 所有handler共享同一个ChatClient，底层连接池由进程级注册表复用，第一次使用时才创建（见 _chat_client）
+        self._chat = None
 
         # 控件
         self.btn_config = None
@@ -106,20 +131,28 @@ class Interface:
         self.btn_code_explain = None
         self.btn_code_comment = None
 
-        # 存储当前界面状态
-        self.selected_feature = ""
-        self.selected_language = ""
-        self.selected_model = ""
+        # 多模型对比控件
+        self.compare_model_selector = None
+        self.compare_policy_selector = None
+        self.btn_compare = None
+        self.compare_output_boxes = []  # 与 _model_list 一一对应
+        self.compare_stats_box = None
+
+        # 当前界面状态按会话保存在 gr.State 中（见 new_session_state），
+        # Interface 本身不保存任何用户状态，可被所有会话和多个工作进程共享
+        self.session_state = None
 
         # 测试用例生成相关控件（初始隐藏）
         self.testcase_button = None
         self.testcase_output_box = None
+        self.testcase_result_table = None
         self.import_button = None
         self.spinner_html = None
 
     # ---------------- 公有接口-----------------#
     def create(self):
         with gr.Blocks() as block:
+            self.session_state = gr.State(new_session_state())
             gr.HTML(
                 """
                 <style>
@@ -184,6 +217,17 @@ class Interface:
                 self.btn_code_comment = gr.Button(visible=False, value="生成注释", variant="primary")
                 self.btn_code_augment = gr.Button(visible=False, value="代码增强", variant="primary")
 
+            # 多模型对比：把编辑器中的代码同时发给多个模型，并排显示各模型的流式输出
+            with gr.Accordion("⚖️ 多模型对比", open=False):
+                with gr.Row():
+                    self.compare_model_selector = gr.CheckboxGroup(label="参与对比的模型", choices=self._model_list)
+                    self.compare_policy_selector = gr.Radio(label="对比策略", choices=["全部完成", "最先完成"],
+                                                            value="全部完成")
+                    self.btn_compare = gr.Button(value="开始对比", variant="primary")
+                with gr.Row():
+                    self.compare_output_boxes = [gr.Markdown(visible=False) for _ in self._model_list]
+                self.compare_stats_box = gr.Markdown()
+
             # 测试用例生成区域（默认隐藏）
             with gr.Column(visible=False) as testcase_column:  # 由原来的 gr.Row 改为 gr.Column，命名由 testcase_row 改为 testcase_column
 
@@ -196,25 +240,32 @@ class Interface:
                 with gr.Row():
                     self.testcase_output_box = gr.Markdown(label="生成的测试用例")
 
+                with gr.Row():
+                    self.testcase_result_table = gr.Dataframe(headers=TESTCASE_TABLE_HEADERS, label="测试结果",
+                                                              interactive=False, wrap=True, visible=False)
+
             # 绑定“生成测试用例”按钮事件，返回大模型结果
             self.testcase_button.click(
                 fn=self._handle_testcase_generation,
                 inputs=[self.editor, self.model_selector, self.lang_selector],
                 outputs=self.testcase_output_box,
+                trigger_mode="multiple",
             )
             # 绑定“导入”按钮事件：将测试用例中的代码提取到代码编辑器中，并运行~
             self.import_button.click(
                 fn=self._handle_import_testcase,
-                inputs=self.testcase_output_box,
-                outputs=[self.editor, self.code_execute_output_box]
+                inputs=[self.testcase_output_box, self.session_state],
+                outputs=[self.editor, self.code_execute_output_box, self.testcase_result_table],
+                trigger_mode="multiple",
             )
 
 
             for radio in self.nav_radio_components:
                 radio.select(
                     fn=self._handle_nav_selection,
-                    inputs=radio,
-                    outputs=[*self.nav_radio_components, testcase_column, self.llm_text_output_box, self.llm_code_output_box],
+                    inputs=[radio, self.session_state],
+                    outputs=[*self.nav_radio_components, testcase_column, self.llm_text_output_box, self.llm_code_output_box,
+                             self.session_state],
                 )
 
             self.nav_radio_components[0].select(
@@ -280,75 +331,126 @@ class Interface:
 
             self.lang_selector.change(
                 fn=self._handle_lang_selection,
-                inputs=self.lang_selector,
-                outputs=[self.editor, self.llm_code_input_box, self.llm_code_output_box, self.run_button],
+                inputs=[self.lang_selector, self.session_state],
+                outputs=[self.editor, self.llm_code_input_box, self.llm_code_output_box, self.run_button,
+                         self.session_state],
             )
             self.model_selector.change(
                 fn=self._handle_model_selection,
-                inputs=self.model_selector,
+                inputs=[self.model_selector, self.session_state],
+                outputs=self.session_state,
             )
 
             self.run_button.click(
                 fn=self._handle_code_run_button_click,
-                inputs=self.editor,
-                outputs=self.code_execute_output_box
+                inputs=[self.editor, self.session_state],
+                outputs=self.code_execute_output_box,
+                trigger_mode="multiple",
             )
 
             self.btn_code_generate.click(
                 fn=self._handle_generate_code,
-                inputs=[self.llm_text_input_box, self.llm_code_input_box],
-                outputs=self.llm_code_output_box
+                inputs=[self.llm_text_input_box, self.llm_code_input_box, self.session_state],
+                outputs=self.llm_code_output_box,
+                trigger_mode="multiple",
             )
             self.btn_code_explain.click(
                 fn=self._handle_code_explain,
-                inputs=self.llm_code_input_box,
+                inputs=[self.llm_code_input_box, self.session_state],
                 outputs=self.llm_text_output_box,
+                trigger_mode="multiple",
             )
             self.btn_code_comment.click(
                 fn=self._handle_code_comment,
-                inputs=self.llm_code_input_box,
+                inputs=[self.llm_code_input_box, self.session_state],
                 outputs=self.llm_code_output_box,
+                trigger_mode="multiple",
             )
             self.btn_code_augment.click(
                 fn=self._handle_code_augment,
-                inputs=self.editor,
+                inputs=[self.editor, self.session_state],
                 outputs=self.llm_text_output_box,
+                trigger_mode="multiple",
+            )
+            self.btn_compare.click(
+                fn=self._handle_model_compare,
+                inputs=[self.editor, self.compare_model_selector, self.compare_policy_selector, self.session_state],
+                outputs=[*self.compare_output_boxes, self.compare_stats_box],
+                trigger_mode="multiple",
             )
 
-    def get_feature(self) -> str:
+    @staticmethod
+    def get_feature(state: dict) -> str:
         """
         获取用户当前在左侧导航栏选择的功能名称（与界面上的文本相同，是中文）。
 
+        Args:
+            state: 当前会话的状态（session_state 的值）。
+
         Returns:
             str: 当前选择的功能名称。
             未选择功能时，返回空字符串。
         """
-        return self.selected_feature
+        return state["feature"]
 
-    def get_language(self) -> str:
+    @staticmethod
+    def get_language(state: dict) -> str:
         """
         获取用户当前选择的编程语言名称（与界面上的文本相同）。
 
+        Args:
+            state: 当前会话的状态（session_state 的值）。
+
         Returns:
             str: 当前选择的编程语言名称。
             未选择编程语言时，返回空字符串。
         """
-        return self.selected_language
+        return state["language"]
 
-    def get_model(self) -> str:
+    @staticmethod
+    def get_model(state: dict) -> str:
         """
         获取用户当前选择的模型名称（与界面上的文本相同）。
 
+        Args:
+            state: 当前会话的状态（session_state 的值）。
+
         Returns:
             str: 当前选择的模型名称。
             未选择模型时，返回空字符串。
         """
-        return self.selected_model
+        return state["model"]
+
+    def cancel_session(self, request: gr.Request):
+        """
+        取消会话中所有还在进行的请求，作为 Blocks.unload 的handler在用户关闭或刷新页面时调用。
+
+        Args:
+            request: Gradio注入的请求对象，用于获取会话标识。
+        """
+        if request is not None and request.session_hash:
+            cancellation_registry.cancel(request.session_hash, REASON_UNLOAD)
 
     # ----------------私有方法-----------------#
-    def _handle_nav_selection(self, selected_item: str):  # 导航栏按钮选中事件的handler
-        """处理导航选择事件：选中一个时自动取消其他分类的选择"""
-        self.selected_feature = selected_item
+    @property
+    def _chat_client(self):
+        """共享的ChatClient，openai等依赖在第一次使用时才导入，不计入启动时间"""
+        if self._chat is None:
+            from core.llm.chat import ChatClient
+            self._chat = ChatClient()
+        return self._chat
+
+    @_chat_client.setter
+    def _chat_client(self, client):
+        self._chat = client
+
+    @instrument_handler
+    def _handle_nav_selection(self, selected_item: str, state: dict,
+                              request: gr.Request = None):  # 导航栏按钮选中事件的handler
+        """处理导航选择事件：选中一个时自动取消其他分类的选择，并停止两个模型输出框中还在进行的请求"""
+        if request is not None and request.session_hash:
+            cancellation_registry.cancel(request.session_hash, REASON_NAVIGATION, slots=(SLOT_LLM_TEXT, SLOT_LLM_CODE))
+        state["feature"] = selected_item
         radio_components_update = []
         for category, items in self._nav_items.items():
             if selected_item in items:
@@ -367,201 +469,450 @@ class Interface:
         radio_components_update.append(testcase_update)
         radio_components_update.append(gr.update(value="")) # llm_text_output_box
         radio_components_update.append(gr.update(value="")) # llm_code_output_box
+        radio_components_update.append(state)
         return radio_components_update
 
-    def _handle_lang_selection(self, selected_item: str):
-        self.selected_language = selected_item
+    @instrument_handler
+    def _handle_lang_selection(self, selected_item: str, state: dict):
+        state["language"] = selected_item
 
         code_update = gr.update(language=self._lang_map[selected_item])
 
-        if self.get_language() in self._lang_support_execution:
+        if self.get_language(state) in self._lang_support_execution:
             run_btn_update = gr.update(interactive=True, value="运行代码")
         else:
             run_btn_update = gr.update(interactive=False, value="该语言暂不支持在线运行")
 
-        return code_update, code_update, code_update, run_btn_update
+        return code_update, code_update, code_update, run_btn_update, state
 
-    def _handle_model_selection(self, selected_item: str):
-        self.selected_model = selected_item
+    @instrument_handler
+    def _handle_model_selection(self, selected_item: str, state: dict):
+        state["model"] = selected_item
+        return state
 
-    def _handle_generate_code(self, user_input, code_input):
+    @instrument_handler
+    @latest_wins(SLOT_LLM_CODE)
+    async def _handle_generate_code(self, user_input, code_input, state, request: gr.Request = None):
         """
         处理生成代码按钮的点击事件，根据导航栏选择不同的生成逻辑
         :param user_input: Textbox 中的用户输入的自然语言描述
         :param code_input: Code 中的待补全代码
-        :return: 生成的代码
+        :param state: 当前会话的状态
+        :param request: Gradio注入的请求对象，同一会话再次生成时取消上一次的请求
+        :return: 生成器，流式输出目前为止生成的代码
         """
-        prompt = ""
-        method = interface.get_feature()
-        lang_selection = interface.get_language()
+        method = self.get_feature(state)
+        lang_selection = self.get_language(state)
         if lang_selection == "":
             raise gr.Error("请选择编程语言")
-        model_selection = interface.get_model()
+        model_selection = self.get_model(state)
         if model_selection == "":
             raise gr.Error("请选择模型")
 
 
-        if method == "从描述生成":
-            if user_input == "":
-                raise gr.Error("输入为空!")
-            prompt = f"以下是自然语言描述:\n" \
-                     f"{user_input}\n" \
-                     f"根据上述描述，生成相应的{lang_selection}代码，并且使用特定的标记包裹代码部分。\n" \
-                     f"请确保代码被标记为代码块，并且其外部标记如下:\n" \
-                     f"<code> ... </code>"
-
-        elif method == "代码补全":
-            if code_input == "":
-                raise gr.Error("输入的代码为空!")
-            prompt = f"以下是自然语言描述:\n" \
-                     f"{user_input}\n" \
-                     f"以下是待补全的代码:\n" \
-                     f"{code_input}\n" \
-                     f"根据上述描述和待补全的代码，生成完整的{lang_selection}代码，并且使用特定的标记包裹代码部分。\n" \
-                     f"请确保代码被标记为代码块，并且其外部标记如下:\n" \
-                     f"<code> ... </code>"
-
-        # 调用 ChatClient 进行流式生成
-        chat_client = ChatClient()
-        context = [{"role": "user", "content": prompt}]
+        if method == "从描述生成" and user_input == "":
+            raise gr.Error("输入为空!")
+        if method == "代码补全" and code_input == "":
+            raise gr.Error("输入的代码为空!")
 
-        response = ""
-        for chunk in chat_client.stream_chat(self._model_provider_map[model_selection], model_selection, context):
-            response += chunk
+        async with self._admission(PRIORITY_BATCH, models=[model_selection]) as ticket:
+            async for position in ticket.wait():
+                yield self._queue_notice(position)
 
-        # 提取 <code> 和 </code> 标签之间的部分作为最终返回值
-        start_index = response.find("<code>") + len("<code>")
-        end_index = response.find("</code>", start_index)
+            if method == "代码补全":
+                prompt = prompt_registry.render("generate.complete", language=lang_selection, description=user_input,
+                                                code=code_input)
+            else:
+                prompt = prompt_registry.render("generate.describe", language=lang_selection, description=user_input)
 
-        # 如果找到了 <code> 和 </code>，返回其中的内容
-        if start_index != -1 and end_index != -1:
-            final_code = response[start_index:end_index]
-        else:
-            final_code = response  # 如果没有找到，返回原始响应（可能需要处理错误情况）
+            # 调用 ChatClient 进行流式生成
+            chat_client = self._chat_client
+            context = [{"role": "user", "content": prompt}]
 
-        return final_code
+            stream = chat_client.astream_chat(self._model_provider_map[model_selection], model_selection, context,
+                                              feature="generate")
+            async for code in self._stream_code_block(stream, "generate", lang_selection):
+                yield code
 
-    def _handle_code_explain(self, code):
-        lang_selection = interface.get_language()
+    @instrument_handler
+    @latest_wins(SLOT_LLM_TEXT)
+    async def _handle_code_explain(self, code, state, request: gr.Request = None):
+        lang_selection = self.get_language(state)
         if lang_selection == "":
             raise gr.Error("请选择编程语言")
-        model_selection = interface.get_model()
+        model_selection = self.get_model(state)
         if model_selection == "":
             raise gr.Error("请选择模型")
         if code == "":
             raise gr.Error("输入的代码为空!")
 
-        prompt = f"请解释以下{lang_selection}代码：\n\n{code}"
-
-        # 调用 ChatClient 进行流式生成
-        chat_client = ChatClient()
-        context = [{"role": "user", "content": prompt}]
-
-        response = ""
-        for chunk in chat_client.stream_chat(self._model_provider_map[model_selection], model_selection, context):
-            response += chunk
-            yield response
-
-    def _handle_code_comment(self, code):
-        lang_selection = interface.get_language()
+        async with self._admission(PRIORITY_INTERACTIVE, models=[model_selection]) as ticket:
+            async for position in ticket.wait():
+                yield self._queue_notice(position)
+
+            # 代码过长时按函数/类切分，各部分并发解释后再汇总
+            from core.llm.chunking import split_code
+            chunks = split_code(code, lang_selection)
+            if len(chunks) > 1:
+                async for text in self._map_reduce_explain(chunks, lang_selection, model_selection):
+                    yield text
+                return
+
+            prompt = prompt_registry.render("explain", language=lang_selection, code=code)
+            # 缓存键使用代码的规范化指纹，只改了空白、注释或缩进的代码直接命中缓存
+            cache_prompt = prompt_registry.render_canonical("explain", language=lang_selection, code=code)
+
+            # 调用 ChatClient 进行流式生成
+            chat_client = self._chat_client
+            context = [{"role": "user", "content": prompt}]
+
+            accumulator = StreamAccumulator()
+            stream = chat_client.astream_chat(self._model_provider_map[model_selection], model_selection, context,
+                                              feature="explain",
+                                              cache_context=[{"role": "user", "content": cache_prompt}])
+            # 按帧刷新Markdown，而不是每个token都重新发送和渲染完整文本
+            async for _ in accumulator.aconsume(aframes(stream, frame_policy("markdown"))):
+                yield accumulator.text
+
+    @instrument_handler
+    @latest_wins(SLOT_LLM_CODE)
+    async def _handle_code_comment(self, code, state, request: gr.Request = None):
+        lang_selection = self.get_language(state)
         if lang_selection == "":
             raise gr.Error("请选择编程语言")
-        model_selection = interface.get_model()
+        model_selection = self.get_model(state)
         if model_selection == "":
             raise gr.Error("请选择模型")
         if code == "":
             raise gr.Error("输入的代码为空!")
 
-        prompt = f"以下是一段{lang_selection}代码，请为其生成符合开发规范的注释，注释内容应包括：\n" \
-                 f"1. 每个函数的说明文档，描述其功能及输入输出参数，以下是一个格式示例：\n" \
-                 f"\"\"\"\n" \
-                 f"Gradio接口函数，处理用户输入并返回流式响应\n" \
-                 f"Args:\n" \
-                 f"    model: 选择的模型名称\n" \
-                 f"    user_input: 用户输入的文本\n" \
-                 f"Returns:\n" \
-                 f"    Generator[str, None, None]: 生成器，用于流式输出响应\n" \
-                 f"\"\"\"\n" \
-                 f"2. 对于代码中的关键逻辑或复杂部分，添加必要的行内注释\n"\
-                 f"注意保持用户给定的代码不变，并且使用特定的标记包裹代码部分。\n" \
-                 f"请确保代码被标记为代码块，并且其外部标记如下:\n" \
-                 f"<code> ... </code>\n" \
-                 f"以下是用户给出的代码：\n" \
-                 f"{code}"\
-
-        # 调用 ChatClient 进行流式生成
-        chat_client = ChatClient()
-        context = [{"role": "user", "content": prompt}]
-
-        response = ""
-        for chunk in chat_client.stream_chat(self._model_provider_map[model_selection], model_selection, context):
-            response += chunk
-
-        # 提取 <code> 和 </code> 标签之间的部分作为最终返回值
-        start_index = response.find("<code>") + len("<code>")
-        end_index = response.find("</code>", start_index)
-
-        # 如果找到了 <code> 和 </code>，返回其中的内容
-        if start_index != -1 and end_index != -1:
-            final_code = response[start_index:end_index]
-        else:
-            final_code = response  # 如果没有找到，返回原始响应（可能需要处理错误情况）
-
-        return final_code
-
-    def _handle_code_augment(self, code):
-        lang_selection = interface.get_language()
+        async with self._admission(PRIORITY_INTERACTIVE, models=[model_selection]) as ticket:
+            async for position in ticket.wait():
+                yield self._queue_notice(position)
+
+            # 代码过长时按函数/类切分，各部分并发生成注释后按原顺序拼接
+            from core.llm.chunking import split_code
+            chunks = split_code(code, lang_selection)
+            if len(chunks) > 1:
+                async for text in self._map_reduce_comment(chunks, lang_selection, model_selection):
+                    yield text
+                return
+
+            prompt = prompt_registry.render("comment", language=lang_selection, code=code)
+
+            # 调用 ChatClient 进行流式生成
+            chat_client = self._chat_client
+            context = [{"role": "user", "content": prompt}]
+
+            stream = chat_client.astream_chat(self._model_provider_map[model_selection], model_selection, context,
+                                              feature="comment")
+            async for code in self._stream_code_block(stream, "comment", lang_selection):
+                yield code
+
+    @instrument_handler
+    @latest_wins(SLOT_LLM_TEXT)
+    async def _handle_code_augment(self, code, state, request: gr.Request = None):
+        lang_selection = self.get_language(state)
         if lang_selection == "":
             raise gr.Error("请选择编程语言")
-        model_selection = interface.get_model()
+        model_selection = self.get_model(state)
         if model_selection == "":
             raise gr.Error("请选择模型")
         if code == "":
             raise gr.Error("输入的代码为空!")
 
-        chat_client = ChatClient()
-
-        prompt = generate_prompt(self.get_feature(), lang_selection, code)
+        chat_client = self._chat_client
 
         # 根据模型自动选择提供商
         provider = self._model_provider_map.get(model_selection)
         if not provider:
             raise ValueError(f"不支持的模型: {model_selection}")
 
-        context = [{"role": "user", "content": prompt}]
-        response = ""
-        for chunk in chat_client.stream_chat(provider, model_selection, context):
-            response += chunk
-            yield response
-
-    def _handle_code_run_button_click(self, code):
-        lang_selection = interface.get_language()
+        async with self._admission(PRIORITY_BATCH, models=[model_selection]) as ticket:
+            async for position in ticket.wait():
+                yield self._queue_notice(position)
+
+            # 代码过长时按函数/类切分，各部分并发分析后按原顺序合并
+            from core.llm.chunking import split_code
+            chunks = split_code(code, lang_selection)
+            if len(chunks) > 1:
+                prompts = [generate_prompt(self.get_feature(state), lang_selection, chunk.text, chunk.start_line)
+                           for chunk in chunks]
+                async for sections in self._map_chunks(chunks, prompts, model_selection, "augment"):
+                    yield self._render_sections(chunks, sections)
+                return
+
+            prompt = generate_prompt(self.get_feature(state), lang_selection, code)
+            cache_prompt = generate_prompt(self.get_feature(state), lang_selection, code, canonical=True)
+
+            context = [{"role": "user", "content": prompt}]
+            accumulator = StreamAccumulator()
+            stream = chat_client.astream_chat(provider, model_selection, context, feature="augment",
+                                              cache_context=[{"role": "user", "content": cache_prompt}])
+            async for _ in accumulator.aconsume(aframes(stream, frame_policy("markdown"))):
+                yield accumulator.text
+
+    @instrument_handler
+    @latest_wins(SLOT_COMPARE)
+    async def _handle_model_compare(self, code, models, policy, state, request: gr.Request = None):
+        """
+        多模型对比：当前功能为“错误修复”或“代码优化”时使用对应的增强提示词，否则请求代码解释，
+        同时发送给所有选中的模型并排流式显示，最后给出本次各模型的首字延迟和输出速度
+        :param code: 编辑器中的代码
+        :param models: 选中的模型列表
+        :param policy: "全部完成" 或 "最先完成"
+        :param state: 当前会话的状态
+        :param request: Gradio注入的请求对象，同一会话再次对比时取消上一次的请求
+        :return: 异步生成器，依次输出各模型的输出框和统计表
+        """
+        lang_selection = self.get_language(state)
         if lang_selection == "":
             raise gr.Error("请选择编程语言")
-
+        if not models:
+            raise gr.Error("请选择参与对比的模型")
         if code == "":
             raise gr.Error("输入的代码为空!")
 
-        result = run_code(lang_selection, code)
-
-        # 如果有错误，直接返回错误信息
-        if result.get('error'):
-            return result['error']
-
-        # 如果有标准输出且不是空字符串，返回标准输出
-        if result.get('stdout') not in (None, ''):
-            return result['stdout']
+        task = self.get_feature(state)
+        feature = "augment" if task in ("错误修复", "代码优化") else "explain"
+        if feature == "augment":
+            prompt = generate_prompt(task, lang_selection, code)
+        else:
+            prompt = prompt_registry.render("explain", language=lang_selection, code=code)
+
+        texts = {model: StreamAccumulator() for model in models}
+        status = {model: "生成中..." for model in models}
+        timings = {model: {"start": time.monotonic(), "ttft": None, "end": None, "tokens": 0} for model in models}
+
+        def render():
+            updates = []
+            for model in self._model_list:
+                if model in texts:
+                    updates.append(gr.update(visible=True, value=f"#### {model}（{status[model]}）\n\n{texts[model].text}"))
+                else:
+                    updates.append(gr.update(visible=False, value=""))
+            rows = ["| 模型 | 首字延迟(s) | 输出速度(tokens/s) |", "| --- | --- | --- |"]
+            for model, timing in timings.items():
+                ttft = f"{timing['ttft']:.2f}" if timing["ttft"] is not None else "-"
+                tps = "-"
+                if timing["end"] is not None and timing["ttft"] is not None:
+                    # 输出速度按首字之后的生成时间计算，瞬间完成（如命中缓存）时没有意义
+                    elapsed = timing["end"] - timing["start"] - timing["ttft"]
+                    if elapsed > 0:
+                        tps = f"{timing['tokens'] / elapsed:.1f}"
+                rows.append(f"| {model} | {ttft} | {tps} |")
+            updates.append("\n".join(rows))
+            return updates
+
+        async with self._admission(PRIORITY_BATCH, models=models) as ticket:
+            async for position in ticket.wait():
+                yield [gr.update() for _ in self._model_list] + [self._queue_notice(position)]
+
+            yield render()
+            # 所有输出框一起按帧刷新，某个模型完成时立即刷新
+            scheduler = FrameScheduler(frame_policy("markdown"))
+            targets = [(self._model_provider_map[model], model) for model in models]
+            context = [{"role": "user", "content": prompt}]
+            fan_out_policy = "first" if policy == "最先完成" else "all"
+            async for event in self._chat_client.afan_out(targets, context, policy=fan_out_policy, feature=feature):
+                timing = timings[event.model]
+                if event.delta:
+                    if timing["ttft"] is None:
+                        timing["ttft"] = time.monotonic() - timing["start"]
+                    texts[event.model].append(event.delta)
+                if event.done:
+                    timing["end"] = time.monotonic()
+                    # 片段数不等于token数，完成时按完整文本估算一次token数
+                    timing["tokens"] = estimate_tokens(texts[event.model].text)
+                    status[event.model] = f"失败：{event.error}" if event.error else "已完成"
+                    scheduler.flushed()
+                    yield render()
+                elif scheduler.add(len(event.delta)):
+                    yield render()
+
+            # “最先完成”策略下其余模型已被取消
+            for model in models:
+                if timings[model]["end"] is None:
+                    status[model] = "已取消"
+            yield render()
+
+    @asynccontextmanager
+    async def _admission(self, priority, models=(), language=None):
+        """
+        申请准入：占用所选模型及其提供商（或代码运行语言）的并发名额，排队期间通过 ticket.wait() 获取排队位置
+        队列已满、模型限流等待超时、本地运行队列已满时转换为 gr.Error，直接在界面上提示用户
+        :param priority: PRIORITY_INTERACTIVE 或 PRIORITY_BATCH
+        :param models: 本次请求使用的模型
+        :param language: 运行代码时的编程语言
+        """
+        lanes = [("model", model) for model in models]
+        lanes += [("provider", self._model_provider_map[model]) for model in models if model in self._model_provider_map]
+        if language:
+            lanes.append(("language", language))
+        with self._rejections_as_errors():
+            async with admission_controller.ticket(priority, lanes) as ticket:
+                yield ticket
+
+    @staticmethod
+    @contextmanager
+    def _rejections_as_errors():
+        """把准入被拒绝、模型限流等待超时、本地运行队列已满转换为 gr.Error，直接在界面上提示用户"""
+        try:
+            yield
+        except Exception as e:
+            # 限流器和本地运行后端按需导入，出错时才需要它们的异常类型
+            from core.code_execution.backends import QueueFullError
+            from core.llm.ratelimit import RateLimitExceeded
+            if isinstance(e, (AdmissionRejected, RateLimitExceeded, QueueFullError)):
+                raise gr.Error(str(e)) from e
+            raise
+
+    @staticmethod
+    def _queue_notice(position):
+        if position:
+            return f"⏳ 排队中，前面还有 {position} 个请求..."
+        return "⏳ 排队中，即将开始..."
+
+    async def _map_chunks(self, chunks, prompts, model_selection, feature):
+        """
+        并发请求各分块，每完成一个分块输出一次目前的结果列表（未完成的分块为None）
+        :param chunks: split_code 返回的分块
+        :param prompts: 每个分块对应的提示词
+        :param model_selection: 模型名称
+        :param feature: 功能名称，用于缓存
+        :return: 异步生成器
+        """
+        from core.llm.chunking import amap_chunks
+
+        results = [None] * len(chunks)
+        async for index, text in amap_chunks(self._chat_client, self._model_provider_map[model_selection],
+                                             model_selection, prompts, feature=feature):
+            results[index] = text
+            yield results
+
+    @staticmethod
+    def _render_sections(chunks, sections):
+        """把各分块的结果按原顺序渲染为Markdown，未完成的分块显示为生成中"""
+        parts = []
+        for chunk, section in zip(chunks, sections):
+            parts.append(f"### 第{chunk.start_line}-{chunk.end_line}行\n\n{section if section is not None else '生成中...'}")
+        return "\n\n".join(parts)
+
+    async def _map_reduce_explain(self, chunks, lang_selection, model_selection):
+        """大文件的代码解释：各分块并发解释，全部完成后再流式生成整体总结"""
+        prompts = [
+            prompt_registry.render("explain.chunk", language=lang_selection, start_line=chunk.start_line,
+                                   end_line=chunk.end_line, total=len(chunks), index=index + 1, code=chunk.text)
+            for index, chunk in enumerate(chunks)
+        ]
+        body = ""
+        async for sections in self._map_chunks(chunks, prompts, model_selection, "explain"):
+            body = self._render_sections(chunks, sections)
+            yield body
 
-        return None
+        prompt = prompt_registry.render("explain.summary", language=lang_selection, body=body)
+        context = [{"role": "user", "content": prompt}]
+        accumulator = StreamAccumulator()
+        stream = self._chat_client.astream_chat(self._model_provider_map[model_selection], model_selection, context,
+                                                feature="explain")
+        async for _ in accumulator.aconsume(aframes(stream, frame_policy("markdown"))):
+            yield f"## 整体总结\n\n{accumulator.text}\n\n## 分部分解释\n\n{body}"
+
+    async def _map_reduce_comment(self, chunks, lang_selection, model_selection):
+        """大文件的注释生成：各分块并发生成注释，按原顺序拼接，尚未完成的分块先显示原代码"""
+        prompts = [prompt_registry.render("comment", language=lang_selection, code=chunk.text) for chunk in chunks]
+        async for sections in self._map_chunks(chunks, prompts, model_selection, "comment"):
+            with timed(POSTPROCESS_SECONDS, feature="comment", language=lang_selection):
+                parts = []
+                for chunk, section in zip(chunks, sections):
+                    commented = chunk.text if section is None else self._extract_code_block(section, chunk.text)
+                    if chunk.text.endswith("\n") and not commented.endswith("\n"):
+                        commented += "\n"
+                    parts.append(commented)
+                merged = "".join(parts)
+            yield merged
+
+    @staticmethod
+    def _extract_code_block(response, default):
+        """从完整响应中提取 <code> ... </code> 包裹的代码，没有标记时返回default"""
+        extractor = CodeBlockExtractor()
+        extractor.feed(response)
+        extractor.finish()
+        return extractor.code if extractor.opened else default
+
+    async def _stream_code_block(self, stream, feature, language):
+        """
+        从大模型的流式响应中实时提取 <code> ... </code> 包裹的代码，每有新增代码就输出一次目前的完整代码
+        :param stream: astream_chat 返回的异步增量流
+        :param feature: 功能名称，用于后处理耗时指标
+        :param language: 编程语言，用于后处理耗时指标
+        :return: 异步生成器，按代码输出框的分帧策略合并增量后输出
+        """
+        extractor = CodeBlockExtractor()
+        accumulator = StreamAccumulator()
+        # 只统计提取代码本身的耗时，不包括等待模型输出的时间
+        elapsed = 0.0
+        try:
+            async for delta in accumulator.aconsume(aframes(stream, frame_policy("code"))):
+                start = time.perf_counter()
+                new_code = extractor.feed(delta)
+                elapsed += time.perf_counter() - start
+                if new_code:
+                    yield extractor.code
+
+            if extractor.opened:
+                extractor.finish()
+                yield extractor.code
+            else:
+                yield accumulator.text  # 如果没有找到标记，返回原始响应（可能需要处理错误情况）
+        finally:
+            POSTPROCESS_SECONDS.labels(feature, language).observe(elapsed)
+
+    @instrument_handler
+    @latest_wins(SLOT_CODE_EXECUTE)
+    async def _handle_code_run_button_click(self, code, state, request: gr.Request = None):
+        lang_selection = self.get_language(state)
+        if lang_selection == "":
+            raise gr.Error("请选择编程语言")
 
-    def merge_chunk(self, accumulated: str, new_chunk: str) -> str:
-        max_overlap = 0
-        for i in range(1, min(len(accumulated), len(new_chunk)) + 1):
-            if accumulated.endswith(new_chunk[:i]):
-                max_overlap = i
-        return accumulated + new_chunk[max_overlap:]
+        if code == "":
+            raise gr.Error("输入的代码为空!")
 
-    def _handle_testcase_generation(self, code, model, language):
+        async with self._admission(PRIORITY_INTERACTIVE, language=lang_selection) as ticket:
+            async for position in ticket.wait():
+                yield self._queue_notice(position)
+
+            # 代码运行模块在第一次运行代码时才导入，不计入启动时间
+            from core.code_execution.output import TailBuffer
+            from core.code_execution.run_code import astream_code
+
+            # 程序运行期间实时显示输出，只保留最后一部分，输出很多时不会占用过多内存
+            output = TailBuffer()
+            result = {}
+            has_stderr = False
+
+            async def texts():
+                nonlocal has_stderr
+                async for event in astream_code(lang_selection, code):
+                    if event.kind == "result":
+                        result.update(event.result)
+                        return
+                    has_stderr = has_stderr or event.kind == "stderr"
+                    yield event.text
+
+            # 程序输出很快时按帧合并，避免每读到一段输出都重新发送整个输出框
+            async for text in aframes(texts(), frame_policy("text")):
+                output.append(text)
+                yield output.text
+            error = result.get('error')
+            # 编译错误、超时等没有通过stderr输出的错误信息追加到最后
+            if error and not has_stderr:
+                output.append(error if not len(output) else f"\n{error}")
+            yield output.text or None
+
+    @instrument_handler
+    @latest_wins(SLOT_TESTCASE)
+    async def _handle_testcase_generation(self, code, model, language, request: gr.Request = None):
         """
         使用大模型生成测试用例：
         根据用户选择的编程语言和大模型，将代码发送给大模型，
@@ -586,38 +937,72 @@ class Interface:
         )
         yield spinner_html
 
-        prompt = (
-            f"你是一位专业的软件测试工程师。请根据下面给出的{language}代码"
-            f"编写测试用例（函数），覆盖主要功能和可能的边界情况；"
-            f"仅输出测试的函数，供用户调用，不要额外解释。如果需要可以使用assert等测试函数"
-            f"\n目标代码: \n{code}"
-            f"最后把一定要输出测试用例、目标代码、调用测试用例的命令和通过测试的提醒！确保让用户可以直接运行"
-            f"所有都要用中文注释，但是通过的提醒需要用英文"
-        )
-        from core.llm.chat import ChatUI
-        chat_ui = ChatUI()
-        generator = chat_ui.gradio_interface(model, prompt)
-        result = ""
-        for chunk in generator:
-            result = self.merge_chunk(result, chunk)
-
-        yield result
-
-    def _handle_import_testcase(self, testcase_content: str):
+        async with self._admission(PRIORITY_BATCH, models=[model]) as ticket:
+            async for position in ticket.wait():
+                yield self._queue_notice(position)
+
+            prompt = prompt_registry.render("testcase", language=language, code=code)
+            cache_prompt = prompt_registry.render_canonical("testcase", language=language, code=code)
+            provider = self._model_provider_map.get(model)
+            if not provider:
+                raise ValueError(f"不支持的模型: {model}")
+
+            # 直接消费增量片段，完整文本在结束时拼接一次
+            context = [{"role": "user", "content": prompt}]
+            accumulator = StreamAccumulator()
+            stream = self._chat_client.astream_chat(provider, model, context, feature="testcase",
+                                                    cache_context=[{"role": "user", "content": cache_prompt}])
+            async for _ in accumulator.aconsume(stream):
+                pass
+
+            yield accumulator.text
+
+    @instrument_handler
+    @latest_wins(SLOT_CODE_EXECUTE)
+    async def _handle_import_testcase(self, testcase_content: str, state: dict, request: gr.Request = None):
         """
         处理“导入”按钮点击事件：
          - 从Markdown文本中提取代码块内容（如果有用 ``` 包裹），
          - 否则直接复制全部内容，
-         - 更新代码编辑器的内容。
+         - 更新代码编辑器的内容，
+         - 拆分为独立的测试并发运行，每个测试完成后更新结果表格。
         """
         code_blocks = re.findall(r"```(?:\w*\n)?(.*?)```", testcase_content, re.DOTALL)
         if code_blocks:
             code = "\n".join(code_blocks).strip()
         else:
             code = testcase_content.strip()
-        # 自动运行代码
-        output = self._handle_code_run_button_click(code)
-        # 返回两个更新：更新编辑器内容，更新并显示“代码输出”框
-        return gr.update(value=code), gr.update(visible=True, value=output)
+
+        lang_selection = self.get_language(state)
+        if lang_selection == "":
+            raise gr.Error("请选择编程语言")
+        if code == "":
+            raise gr.Error("输入的代码为空!")
+
+        from core.code_execution.testsuite import arun_tests, split_tests
+        cases = split_tests(code, lang_selection)
+        # 表格先列出所有测试，运行完成的行按完成顺序更新
+        rows = {case.name: [case.name, "⏳ 运行中", "", ""] for case in cases}
+        yield (gr.update(value=code), gr.update(visible=True, value=f"共 {len(cases)} 个测试，运行中..."),
+               gr.update(visible=True, value=list(rows.values())))
+
+        @asynccontextmanager
+        async def admit():
+            # 每个测试单独占用语言通道的名额，一次导入并发运行的测试数不会超过通道的上限
+            async with admission_controller.ticket(PRIORITY_BATCH, [("language", lang_selection)]) as ticket:
+                async for _ in ticket.wait():
+                    pass
+                yield
+
+        passed = finished = 0
+        # 队列已满等情况下整次导入直接提示错误，不会显示为一批失败的测试
+        with self._rejections_as_errors():
+            async for result in arun_tests(lang_selection, cases, admit=admit):
+                finished += 1
+                passed += result.passed
+                rows[result.name] = [result.name, "✅ 通过" if result.passed else "❌ 失败",
+                                     f"{result.duration * 1000:.0f}", result.output]
+                summary = f"已完成 {finished}/{len(cases)}，通过 {passed}，失败 {finished - passed}"
+                yield gr.update(), gr.update(visible=True, value=summary), gr.update(value=list(rows.values()))
 
 interface = Interface()
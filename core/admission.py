@@ -0,0 +1,238 @@
+"""
+准入控制：按模型、提供商和代码运行语言分别限制并发，超出上限的请求在有界队列中按优先级排队
+
+每个 (类别, 名称) 是一条独立的通道（如 model:qwen-turbo、provider:gitee、language:python），
+慢模型占满自己的通道时不会影响其他模型和代码运行。队列已满时立即拒绝，而不是让用户无限等待。
+
+通道上限通过环境变量 AI_CODELAB_ADMISSION_LIMITS 配置，逗号分隔，键为类别（该类别的默认值）或 类别:名称：
+    AI_CODELAB_ADMISSION_LIMITS="model=8,provider=16,language=4,model:DeepSeek-R1-Distill-Qwen-32B=2"
+每条通道的队列长度由 AI_CODELAB_ADMISSION_QUEUE 配置（默认32）。
+
+所有通道只在Gradio的事件循环中使用，不需要加锁。
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import AsyncGenerator, Dict, Iterable, List, Optional, Tuple
+
+from core.metrics import ADMISSION_WAIT_SECONDS
+
+# 优先级，数值越小越先出队
+PRIORITY_INTERACTIVE = 0  # 解释、注释、运行代码等短小的交互请求
+PRIORITY_BATCH = 1  # 代码生成、增强、多模型对比、测试用例生成等长时间生成
+
+# 排队时检查位置变化的间隔（秒）
+POSITION_POLL_INTERVAL = 0.5
+
+DEFAULT_LIMITS = {
+    "model": 8,
+    "provider": 16,
+    "language": os.cpu_count() or 4,
+    # 推理模型单次生成时间很长，单独限制，避免占满提供商的并发
+    "model:DeepSeek-R1-Distill-Qwen-32B": 4,
+}
+
+# 获取通道的顺序：按类别再按名称，所有请求顺序一致，同时占用多条通道时不会互相等待形成死锁
+_KIND_ORDER = {"model": 0, "provider": 1, "language": 2}
+
+
+class AdmissionRejected(Exception):
+    """通道队列已满，请求被拒绝"""
+
+
+def _parse_limits(value: str) -> Dict[str, int]:
+    limits = {}
+    for item in value.split(","):
+        if item.strip():
+            key, _, limit = item.partition("=")
+            limits[key.strip()] = int(limit)
+    return limits
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "future")
+
+    def __init__(self, priority: int, seq: int, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionLane:
+    """
+    一条准入通道：最多limit个请求同时执行，最多max_queue个请求排队
+    释放时直接把名额交给优先级最高（同优先级先到先得）的等待者
+    """
+
+    def __init__(self, kind: str, name: str, limit: int, max_queue: int):
+        self.kind = kind
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.rejected = 0
+        self._queue: List[_Waiter] = []
+
+    @property
+    def key(self) -> str:
+        return f"{self.kind}:{self.name}"
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def saturated(self) -> bool:
+        """没有空闲名额且队列已满"""
+        return self.active >= self.limit and len(self._queue) >= self.max_queue
+
+    def try_acquire(self) -> bool:
+        if self.active < self.limit and not self._queue:
+            self.active += 1
+            return True
+        return False
+
+    def enqueue(self, waiter: _Waiter):
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(f"{self.name} 当前排队的请求已满（{self.max_queue}个），请稍后再试")
+        heapq.heappush(self._queue, waiter)
+
+    def position(self, waiter: _Waiter) -> int:
+        """排在waiter前面的请求数"""
+        return sum(1 for other in self._queue if other < waiter)
+
+    def remove(self, waiter: _Waiter):
+        if waiter in self._queue:
+            self._queue.remove(waiter)
+            heapq.heapify(self._queue)
+
+    def release(self):
+        while self._queue:
+            waiter = heapq.heappop(self._queue)
+            if not waiter.future.done():
+                waiter.future.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionTicket:
+    """
+    一个请求的准入凭证，需要在 async with 中使用，退出时释放已占用的名额或撤回排队：
+
+        ticket = admission_controller.ticket(PRIORITY_INTERACTIVE, [("model", model), ("provider", provider)])
+        async with ticket:
+            async for position in ticket.wait():
+                ...  # 向用户展示排队位置
+            ...  # 获得全部名额后执行请求
+    """
+
+    def __init__(self, controller: "AdmissionController", lanes: List[AdmissionLane], priority: int):
+        self._controller = controller
+        self._lanes = lanes
+        self._priority = priority
+        self._held: List[AdmissionLane] = []
+        self._pending: Optional[Tuple[AdmissionLane, _Waiter]] = None
+
+    async def __aenter__(self) -> "AdmissionTicket":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._pending is not None:
+            lane, waiter = self._pending
+            self._pending = None
+            if waiter.future.done() and not waiter.future.cancelled():
+                lane.release()  # 名额已经转交给本请求
+            else:
+                lane.remove(waiter)
+                waiter.future.cancel()
+        while self._held:
+            self._held.pop().release()
+
+    async def wait(self) -> AsyncGenerator[int, None]:
+        """
+        依次获取各通道的名额，排队期间位置变化时输出排在前面的请求数，全部获取后结束
+        Raises:
+            AdmissionRejected: 某条通道的队列已满
+        """
+        loop = asyncio.get_running_loop()
+        for lane in self._lanes[len(self._held):]:
+            if lane.try_acquire():
+                self._held.append(lane)
+                continue
+            waiter = _Waiter(self._priority, self._controller.next_seq(), loop.create_future())
+            lane.enqueue(waiter)
+            self._pending = (lane, waiter)
+            start = time.perf_counter()
+            last_position = None
+            while not waiter.future.done():
+                position = lane.position(waiter)
+                if position != last_position:
+                    last_position = position
+                    yield position
+                await asyncio.wait({waiter.future}, timeout=POSITION_POLL_INTERVAL)
+            self._pending = None
+            self._held.append(lane)
+            ADMISSION_WAIT_SECONDS.labels(lane.kind, lane.name).observe(time.perf_counter() - start)
+
+
+class AdmissionController:
+    """
+    管理所有准入通道，通道在第一次使用时按配置创建
+    """
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None, max_queue: Optional[int] = None):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits if limits is not None else _parse_limits(os.getenv("AI_CODELAB_ADMISSION_LIMITS", "")))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("AI_CODELAB_ADMISSION_QUEUE", "32"))
+        self._lanes: Dict[Tuple[str, str], AdmissionLane] = {}
+        self._seq = itertools.count()
+
+    def next_seq(self) -> int:
+        return next(self._seq)
+
+    def lane(self, kind: str, name: str) -> AdmissionLane:
+        key = (kind, name)
+        if key not in self._lanes:
+            limit = self.limits.get(f"{kind}:{name}", self.limits.get(kind, 1))
+            self._lanes[key] = AdmissionLane(kind, name, limit, self.max_queue)
+        return self._lanes[key]
+
+    def ticket(self, priority: int, lanes: Iterable[Tuple[str, str]]) -> AdmissionTicket:
+        """
+        为一个请求创建准入凭证
+        Args:
+            priority: PRIORITY_INTERACTIVE 或 PRIORITY_BATCH
+            lanes: 需要占用的通道 [(类别, 名称), ...]，重复的通道只占用一次
+        Returns:
+            AdmissionTicket: 准入凭证
+        Raises:
+            AdmissionRejected: 某条通道既没有空闲名额，队列也已满，请求被立即拒绝
+        """
+        keys = sorted(set(lanes), key=lambda key: (_KIND_ORDER.get(key[0], len(_KIND_ORDER)), key))
+        resolved = [self.lane(kind, name) for kind, name in keys]
+        for lane in resolved:
+            if lane.saturated():
+                lane.rejected += 1
+                raise AdmissionRejected(f"{lane.name} 当前排队的请求已满（{lane.max_queue}个），请稍后再试")
+        return AdmissionTicket(self, resolved, priority)
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        各通道的当前状态
+        Returns:
+            dict: {"类别:名称": {"active", "limit", "queued", "max_queue", "rejected"}}
+        """
+        return {
+            lane.key: {"active": lane.active, "limit": lane.limit, "queued": lane.queued,
+                       "max_queue": lane.max_queue, "rejected": lane.rejected}
+            for lane in self._lanes.values()
+        }
+
+
+# 进程内共享的默认准入控制器
+admission_controller = AdmissionController()
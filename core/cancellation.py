@@ -0,0 +1,197 @@
+"""
+协作式取消：同一会话的同一个输出框只保留最新的请求（last request wins）
+
+用户再次点击按钮、切换功能或关闭页面时，旧请求不应继续占用模型配额、连接和运行槽位。
+流式handler用 latest_wins(slot) 装饰，按 (会话, 输出框) 登记；新的请求登记时取消旧请求，
+导航切换和页面关闭通过 cancellation_registry.cancel 取消会话中的请求。
+
+取消时向handler当前等待的位置抛出 CancelledError，沿调用链依次执行各层的finally：
+关闭模型的流式响应（见 ChatClient.astream_chat）、释放限流和准入名额、杀死正在运行的代码（见 LocalBackend）。
+Gradio事件的 cancels= 和客户端断开连接时Gradio会直接取消handler，走的是同一条清理路径。
+"""
+import asyncio
+import functools
+import inspect
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from core.metrics import HANDLER_CANCELLED
+
+# 取消原因
+REASON_SUPERSEDED = "superseded"  # 同一输出框有了更新的请求
+REASON_NAVIGATION = "navigation"  # 切换了功能
+REASON_UNLOAD = "unload"  # 关闭或刷新了页面
+REASON_EVENT = "event"  # Gradio取消了事件（cancels= 或客户端断开）
+
+
+class CancelToken:
+    """
+    一次请求的取消标记，可以在任意线程中调用cancel（同步的导航handler运行在Gradio的工作线程中）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str) -> bool:
+        """
+        Returns:
+            bool: 是否是第一次取消
+        """
+        with self._lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            loop, event = self._loop, self._event
+        if event is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(event.set)
+        return True
+
+    async def wait(self):
+        """等待直到被取消"""
+        with self._lock:
+            if self._event is None:
+                self._loop = asyncio.get_running_loop()
+                self._event = asyncio.Event()
+            if self.reason is not None:
+                return
+        await self._event.wait()
+
+
+class CancellationRegistry:
+    """
+    按 (会话, 输出框) 登记正在进行的请求
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Dict[Tuple[str, str], CancelToken] = {}
+
+    def claim(self, session: str, slot: str) -> CancelToken:
+        """登记一个新请求，并取消同一会话、同一输出框中的旧请求"""
+        token = CancelToken()
+        with self._lock:
+            previous = self._tokens.get((session, slot))
+            self._tokens[(session, slot)] = token
+        if previous is not None and previous.cancel(REASON_SUPERSEDED):
+            HANDLER_CANCELLED.labels(slot, REASON_SUPERSEDED).inc()
+        return token
+
+    def release(self, session: str, slot: str, token: CancelToken):
+        """请求结束时注销，已被更新的请求替换时不做任何事"""
+        with self._lock:
+            if self._tokens.get((session, slot)) is token:
+                del self._tokens[(session, slot)]
+
+    def cancel(self, session: str, reason: str, slots: Optional[Iterable[str]] = None) -> int:
+        """
+        取消会话中的请求
+        Args:
+            session: 会话标识（gr.Request.session_hash）
+            reason: 取消原因，如 REASON_NAVIGATION
+            slots: 只取消这些输出框中的请求，None表示全部
+        Returns:
+            int: 被取消的请求数
+        """
+        slots = set(slots) if slots is not None else None
+        with self._lock:
+            keys = [key for key in self._tokens if key[0] == session and (slots is None or key[1] in slots)]
+            tokens = [(key[1], self._tokens.pop(key)) for key in keys]
+        count = 0
+        for slot, token in tokens:
+            if token.cancel(reason):
+                HANDLER_CANCELLED.labels(slot, reason).inc()
+                count += 1
+        return count
+
+    def active(self) -> int:
+        """正在进行的请求数"""
+        with self._lock:
+            return len(self._tokens)
+
+
+# 进程内共享的默认取消登记表
+cancellation_registry = CancellationRegistry()
+
+
+def latest_wins(slot: str, registry: Optional[CancellationRegistry] = None):
+    """
+    装饰异步生成器handler：同一会话的同一个输出框只保留最新的请求
+
+    会话从名为 request 的参数（gr.Request）中获取，没有传入时（如基准测试直接调用handler）不做登记。
+    handler在单独的任务中运行，被取消时取消该任务，在handler当前等待的位置抛出 CancelledError，
+    各层finally执行完毕后静默结束，输出框保持已经输出的内容。
+    Args:
+        slot: 输出框名称
+        registry: 默认为 cancellation_registry
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            request = signature.bind_partial(*args, **kwargs).arguments.get("request")
+            session = getattr(request, "session_hash", None)
+            if session is None:
+                async for value in fn(*args, **kwargs):
+                    yield value
+                return
+
+            owner = registry or cancellation_registry
+            token = owner.claim(session, slot)
+            # handler在一个长期运行的任务中逐步执行，各步之间保留handler设置的contextvars；
+            # 每次取值时才推进一步，与直接迭代handler的节奏相同
+            demand: "asyncio.Queue[None]" = asyncio.Queue()
+            outbox: "asyncio.Queue[Tuple[str, object]]" = asyncio.Queue()
+
+            async def pump():
+                iterator = fn(*args, **kwargs)
+                try:
+                    while True:
+                        await demand.get()
+                        try:
+                            value = await iterator.__anext__()
+                        except StopAsyncIteration:
+                            outbox.put_nowait(("end", None))
+                            return
+                        outbox.put_nowait(("value", value))
+                except BaseException as e:
+                    outbox.put_nowait(("error", e))
+                    raise
+                finally:
+                    await iterator.aclose()
+
+            pump_task = asyncio.ensure_future(pump())
+            # 被取消时在handler当前等待的位置抛出 CancelledError
+            watcher = asyncio.ensure_future(token.wait())
+            watcher.add_done_callback(lambda _: pump_task.cancel())
+            try:
+                while True:
+                    demand.put_nowait(None)
+                    kind, value = await outbox.get()
+                    if kind == "end":
+                        return
+                    if kind == "error":
+                        if token.cancelled and isinstance(value, asyncio.CancelledError):
+                            return
+                        raise value
+                    yield value
+            except asyncio.CancelledError:
+                if token.cancel(REASON_EVENT):
+                    HANDLER_CANCELLED.labels(slot, REASON_EVENT).inc()
+                raise
+            finally:
+                watcher.cancel()
+                pump_task.cancel()
+                await asyncio.gather(pump_task, return_exceptions=True)
+                owner.release(session, slot, token)
+
+        return wrapper
+
+    return decorator
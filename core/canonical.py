@@ -0,0 +1,303 @@
+"""
+代码规范化：按语言把代码转换为与格式无关的规范形式，计算用作缓存键的指纹
+
+只有行尾空白、空行、注释或缩进不同的代码得到相同的指纹，大模型响应和运行结果可以直接复用：
+    Python:       ast.dump（不含位置信息），无法解析时退回到空白规范化
+    C/C++/Java/Go/Rust/JavaScript/TypeScript:
+                  去掉注释后的token流，token之间的空白只在可能影响词法的位置保留一个空格；
+                  C/C++的预处理指令、Go和JavaScript/TypeScript（自动插入分号）中的换行保留
+    其他语言:     统一换行符，去掉行尾空白和首尾空行
+
+keep_lines=True 时指纹还包含代码的行结构（Python为每个语法节点所在的行号），
+适用于响应中会引用行号的请求（如代码增强），此时只有缩进、行尾空白和注释内容的差异会被忽略。
+
+规范化不会改变程序的含义，但打印自身行号或源码的程序（如 __LINE__、inspect.getsource）
+在格式变化后输出会不同，这类代码应带上 codelab: no-cache 标记（见 core.code_execution.cache）。
+"""
+import ast
+import functools
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from core.metrics import CACHE_LOOKUPS
+
+
+def normalize_whitespace(code: str) -> str:
+    """统一换行符，去掉每行行尾空白和首尾空行"""
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+class _Syntax(NamedTuple):
+    """C系语言的词法差异"""
+    string: str = r'"(?:\\.|[^"\\\n])*"'
+    char: str = r"'(?:\\.|[^\\'\n])+'"
+    # 在普通字符串之前尝试的字面量（原始字符串、文本块、模板字符串等）
+    literals: Tuple[str, ...] = ()
+    # 有语义、需要保留的注释（如Go的 //go: 指令）
+    kept_comment: Optional[str] = None
+    nested_comments: bool = False
+    preprocessor: bool = False
+    # 换行会影响语义（自动插入分号）
+    newlines: bool = False
+    regex_literals: bool = False
+
+
+_JS_SYNTAX = _Syntax(
+    char=r"'(?:\\.|[^\\'\n])*'",
+    literals=(r"`(?:\\.|[^\\`])*`",),
+    kept_comment=r"///\s*<",
+    newlines=True,
+    regex_literals=True,
+)
+
+_SYNTAX: Dict[str, _Syntax] = {
+    "C": _Syntax(preprocessor=True),
+    "C++": _Syntax(preprocessor=True, literals=(r'(?:u8|[uUL])?R"([^()\\\s]{0,16})\(.*?\)\1"',)),
+    "Java": _Syntax(literals=(r'"""(?:\\.|[^\\])*?"""',)),
+    "Go": _Syntax(literals=(r"`[^`]*`",), kept_comment=r"//(?:go:|line |export |extern |\s*\+build)", newlines=True),
+    "Rust": _Syntax(
+        string=r'"(?:\\.|[^"\\])*"',
+        char=r"'(?:\\(?:u\{[0-9A-Fa-f]{1,6}\}|x[0-9A-Fa-f]{2}|.)|[^\\'\n])'",
+        literals=(r'b?r(#*)".*?"\1',),
+        nested_comments=True,
+    ),
+    "JavaScript": _JS_SYNTAX,
+    "TypeScript": _JS_SYNTAX,
+}
+
+_WHITESPACE = re.compile(r"[ \t\f\v\r\n]+")
+_LINE_CONTINUATION = re.compile(r"\\\r?\n")
+_NUMBER = re.compile(r"\.?[0-9](?:[0-9A-Za-z_.]|'(?=[0-9A-Za-z])|(?<=[eEpP])[+-])*")
+_WORD = re.compile(r"(?:[^\W\d]|\$)[\w$]*")
+_JS_REGEX = re.compile(r"/(?:\\.|\[(?:\\.|[^\]\\\n])*\]|[^/\\\n\[])+/[A-Za-z]*")
+# 相邻时可能组成多字符运算符或注释的符号（如 - -、/ *、< <），括号和分隔符不会
+_JOINING = set("+-*/%<>=!&|^~:.?#@")
+# 这些关键字之后的 / 是正则表达式字面量的开始，而不是除号
+_REGEX_KEYWORDS = {"return", "typeof", "instanceof", "in", "of", "new", "delete", "void", "throw", "case", "do",
+                   "else", "yield", "await"}
+
+
+@functools.lru_cache(maxsize=None)
+def _compile(pattern: str) -> "re.Pattern":
+    return re.compile(pattern, re.DOTALL)
+
+
+def _needs_space(prev_kind: str, prev_text: str, kind: str, text: str) -> bool:
+    """两个token之间原本有空白时，去掉空白是否可能改变词法（如 a b、- -、L "x"）"""
+    if prev_kind == "punct" and kind == "punct":
+        return prev_text in _JOINING and text in _JOINING
+    if prev_kind != "punct" and kind != "punct":
+        return True
+    # 数字和成员访问的点相邻时可能被当作一个token（如 1 .5）
+    return prev_text == "." or text == "."
+
+
+def _canonical_tokens(code: str, syntax: _Syntax, keep_lines: bool) -> str:
+    literals = [_compile(pattern) for pattern in syntax.literals]
+    string, char = _compile(syntax.string), _compile(syntax.char)
+    kept_comment = _compile(syntax.kept_comment) if syntax.kept_comment else None
+
+    def token_at(i: int, prev_kind: Optional[str], prev_text: str) -> Tuple[str, int]:
+        """位置i处的token，返回 (类别 literal/word/punct, 结束位置)"""
+        c = code[i]
+        if kept_comment is not None and kept_comment.match(code, i):
+            end = code.find("\n", i)
+            return "literal", len(code) if end < 0 else end
+        for pattern in literals:
+            match = pattern.match(code, i)
+            if match is not None:
+                return "literal", match.end()
+        match = None
+        if c == '"':
+            match = string.match(code, i)
+        elif c == "'":
+            match = char.match(code, i)
+        elif c == "/" and syntax.regex_literals and (
+                prev_kind is None or (prev_kind == "punct" and prev_text not in ")]}") or prev_text in _REGEX_KEYWORDS):
+            match = _JS_REGEX.match(code, i)
+        if match is not None:
+            return "literal", match.end()
+        match = _NUMBER.match(code, i) or _WORD.match(code, i)
+        if match is not None:
+            return "word", match.end()
+        return "punct", i + 1
+
+    out = []
+    prev_kind, prev_text = None, ""
+    gap = False  # 上一个token之后是否有空白或注释
+    gap_lines = 0  # 空白和注释中的换行数
+    line_start = True  # 上一个换行之后还没有token
+    directive = directive_ended = False  # 是否在预处理指令中，指令是否刚刚结束
+    i, n = 0, len(code)
+    while i < n:
+        match = _WHITESPACE.match(code, i)
+        if match is None and directive:
+            match = _LINE_CONTINUATION.match(code, i)  # 指令的续行不结束指令
+            if match is not None:
+                gap, gap_lines, i = True, gap_lines + 1, match.end()
+                continue
+        if match is not None:
+            newlines = match.group().count("\n")
+            gap, gap_lines, i = True, gap_lines + newlines, match.end()
+            if newlines:
+                line_start = True
+                directive_ended = directive_ended or directive
+                directive = False
+            continue
+        if code.startswith("//", i) and not (kept_comment is not None and kept_comment.match(code, i)):
+            end = code.find("\n", i)
+            gap, i = True, n if end < 0 else end
+            continue
+        if code.startswith("/*", i):
+            end = _block_comment_end(code, i, syntax.nested_comments)
+            gap, gap_lines, i = True, gap_lines + code.count("\n", i, end), end
+            continue
+
+        kind, end = token_at(i, prev_kind, prev_text)
+        text = code[i:end]
+        starts_directive = syntax.preprocessor and line_start and text == "#"
+        if keep_lines and gap_lines:
+            out.append("\n" * gap_lines)
+        elif out and (directive_ended or starts_directive or (syntax.newlines and gap_lines)):
+            out.append("\n")
+        # 预处理指令中宏名与左括号之间的空白决定是否为函数式宏
+        elif out and gap and (_needs_space(prev_kind, prev_text, kind, text)
+                              or (directive and prev_kind == "word" and text == "(")):
+            out.append(" ")
+        out.append(text)
+        directive = directive or starts_directive
+        prev_kind, prev_text = kind, text
+        gap, gap_lines, line_start, directive_ended = False, 0, False, False
+        i = end
+    return "".join(out)
+
+
+def _block_comment_end(code: str, start: int, nested: bool) -> int:
+    """块注释结束后的位置，没有结束标记时到代码末尾"""
+    if not nested:
+        end = code.find("*/", start + 2)
+        return len(code) if end < 0 else end + 2
+    depth, i = 0, start
+    while i < len(code):
+        if code.startswith("/*", i):
+            depth, i = depth + 1, i + 2
+        elif code.startswith("*/", i):
+            depth, i = depth - 1, i + 2
+            if depth == 0:
+                return i
+        else:
+            i += 1
+    return len(code)
+
+
+def _canonical_python(code: str, keep_lines: bool) -> str:
+    tree = ast.parse(code)
+    dumped = ast.dump(tree)
+    if keep_lines:
+        dumped += "\n" + ",".join(str(getattr(node, "lineno", "")) for node in ast.walk(tree))
+    return dumped
+
+
+def canonicalize(language: str, code: str, keep_lines: bool = False) -> Tuple[str, str]:
+    """
+    把代码转换为规范形式
+    Args:
+        language: 编程语言名称（与界面上的文本相同）
+        code: 代码
+        keep_lines: 是否保留行号信息
+    Returns:
+        tuple: (规范化方式 "ast"、"tokens" 或 "text", 规范形式)
+    """
+    if language == "Python":
+        try:
+            return "ast", _canonical_python(code, keep_lines)
+        except (SyntaxError, ValueError, RecursionError):
+            pass
+    elif language in _SYNTAX:
+        return "tokens", _canonical_tokens(code, _SYNTAX[language], keep_lines)
+    if keep_lines:
+        return "text", "\n".join(line.strip() for line in code.replace("\r\n", "\n").replace("\r", "\n").split("\n"))
+    return "text", normalize_whitespace(code)
+
+
+@functools.lru_cache(maxsize=256)
+def fingerprint(language: str, code: str, keep_lines: bool = False) -> str:
+    """
+    代码的规范化指纹，格式不同但规范形式相同的代码指纹相同
+    Returns:
+        str: sha256十六进制摘要
+    """
+    scheme, canonical = canonicalize(language, code, keep_lines)
+    raw = json.dumps([language, scheme, keep_lines, canonical], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class NormalizationStats:
+    """
+    统计规范化带来的额外缓存命中
+
+    每个规范化缓存键记录查询过的原始输入（原始代码或未规范化的缓存键）的摘要，
+    命中时原始输入没有出现过，说明只有规范化之后才能命中（normalized_hits）。
+    只统计本进程内的查询：进程重启后从磁盘缓存命中的请求按原样命中计算。
+    """
+
+    def __init__(self, max_keys: int = 4096):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._sources: "OrderedDict[str, set]" = OrderedDict()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def record(self, cache: str, key: str, source: str, hit: bool):
+        """
+        记录一次缓存查询
+        Args:
+            cache: 缓存名称，如 "llm"、"execution"
+            key: 规范化后的缓存键
+            source: 原始输入
+            hit: 是否命中
+        """
+        digest = hashlib.blake2b(source.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        with self._lock:
+            stats = self._stats.setdefault(cache, {"lookups": 0, "hits": 0, "normalized_hits": 0})
+            stats["lookups"] += 1
+            sources = self._sources.get(key)
+            normalized = hit and sources is not None and digest not in sources
+            stats["hits"] += hit
+            stats["normalized_hits"] += normalized
+            if sources is None:
+                sources = self._sources[key] = set()
+            sources.add(digest)
+            self._sources.move_to_end(key)
+            while len(self._sources) > self.max_keys:
+                self._sources.popitem(last=False)
+        CACHE_LOOKUPS.labels(cache, "normalized_hit" if normalized else "hit" if hit else "miss").inc()
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        各缓存的命中统计
+        Returns:
+            dict: {缓存名称: {"lookups", "hits", "normalized_hits", "hit_rate", "exact_hit_rate", "normalization_gain"}}，
+            exact_hit_rate 为不做规范化时的命中率，normalization_gain 为规范化带来的命中率提升
+        """
+        with self._lock:
+            result = {}
+            for cache, stats in self._stats.items():
+                lookups = stats["lookups"] or 1
+                result[cache] = dict(stats, hit_rate=stats["hits"] / lookups,
+                                     exact_hit_rate=(stats["hits"] - stats["normalized_hits"]) / lookups,
+                                     normalization_gain=stats["normalized_hits"] / lookups)
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._sources.clear()
+            self._stats.clear()
+
+
+# 进程内共享的默认统计
+normalization_stats = NormalizationStats()
@@ -0,0 +1,259 @@
+"""
+预热的Python工作进程（由 warm_pool.WarmPythonPool 启动，不要直接导入）
+
+启动时预先导入常用模块，然后从标准输入逐行读取JSON请求，每个请求fork一个子进程执行用户代码，
+执行结果以一行JSON写回标准输出。子进程继承已导入的模块，省去解释器启动和导入的时间。
+请求的stream为真时子进程的输出通过管道读取，每读到一段就写回一行 {"event": "stdout"/"stderr", "text": ...}，
+最后仍然写回执行结果。收到SIGUSR1时杀死正在运行的子进程（取消运行）。
+该文件只依赖标准库，以 python -I 独立运行。
+"""
+import builtins
+import codecs
+import io
+import json
+import os
+import resource
+import select
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import traceback
+import types
+
+# 当前运行是否被取消（SIGUSR1），信号通过 _wakeup 管道唤醒等待中的select
+_cancelled = False
+_wakeup = None
+
+
+def _on_cancel(signum, frame):
+    global _cancelled
+    _cancelled = True
+
+
+def _output_stream(fd, unbuffered):
+    if not unbuffered:
+        return open(fd, "w", encoding="utf-8", closefd=False)
+    # 与 python -u 相同：二进制层不缓冲，文本层直接写穿
+    return io.TextIOWrapper(open(fd, "wb", buffering=0, closefd=False), encoding="utf-8", write_through=True)
+
+
+def _run_child(code, workdir, request, pipes):
+    """
+    子进程：重定向输入输出、设置资源限制后执行用户代码，不会返回
+    pipes为 (stdout写端, stderr写端) 时输出到管道，并像 python -u 一样不缓冲；为None时输出到文件
+    """
+    exit_code = 0
+    try:
+        os.setsid()
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        os.close(_wakeup[0])
+        os.close(_wakeup[1])
+        os.chdir(workdir)
+        stdin_fd = os.open(os.devnull, os.O_RDONLY)
+        if pipes is None:
+            stdout_fd = os.open(".stdout", os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            stderr_fd = os.open(".stderr", os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        else:
+            stdout_fd, stderr_fd = pipes
+        os.dup2(stdin_fd, 0)
+        os.dup2(stdout_fd, 1)
+        os.dup2(stderr_fd, 2)
+        sys.stdin = open(0, "r", encoding="utf-8", closefd=False)
+        sys.stdout = _output_stream(1, unbuffered=pipes is not None)
+        sys.stderr = _output_stream(2, unbuffered=pipes is not None)
+
+        cpu_seconds = request["cpu_seconds"]
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+        resource.setrlimit(resource.RLIMIT_FSIZE, (request["output_bytes"], request["output_bytes"]))
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        resource.setrlimit(resource.RLIMIT_AS, (request["memory_bytes"], request["memory_bytes"]))
+
+        sys.argv = ["main.py"]
+        # 用户代码在真正的 __main__ 模块中执行，unittest.main()、pickle等通过sys.modules查找的功能才能正常工作
+        module = types.ModuleType("__main__")
+        module.__file__ = "main.py"
+        module.__builtins__ = builtins
+        sys.modules["__main__"] = module
+        exec(compile(code, "main.py", "exec"), module.__dict__)
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            exit_code = e.code
+        elif e.code is not None:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as e:
+        # 跳过本函数所在的栈帧，只显示用户代码部分
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        exit_code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+
+def _kill_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _drain_wakeup():
+    try:
+        while os.read(_wakeup[0], 64):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def _wait(pid, deadline, pipes=None, on_output=None):
+    """
+    等待子进程结束，返回 (退出状态, 是否超时)
+    pipes为 {文件描述符: "stdout"/"stderr"} 时同时读取管道，读到的数据交给 on_output(kind, data)，
+    on_output返回False时（输出超出限制）杀死进程组
+    """
+    pipes = dict(pipes or {})
+    status, timed_out = None, False
+    pidfd = os.pidfd_open(pid) if hasattr(os, "pidfd_open") else None
+    try:
+        # 子进程退出后还要读完管道中剩余的输出
+        while status is None or pipes:
+            if status is None:
+                finished, result = os.waitpid(pid, os.WNOHANG)
+                if finished:
+                    status = result
+                    # 清理进程组中残留的后台进程，否则它们持有管道，读取无法结束
+                    _kill_group(pid)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or _cancelled:
+                    timed_out = not _cancelled
+                    _kill_group(pid)
+                    status = os.waitpid(pid, 0)[1]
+                    continue
+            waiting = list(pipes) + [_wakeup[0]]
+            if status is None and pidfd is not None:
+                waiting.append(pidfd)
+            timeout = None if status is not None else remaining if pidfd is not None else min(remaining, 0.001)
+            ready, _, _ = select.select(waiting, [], [], timeout)
+            for fd in ready:
+                if fd == _wakeup[0]:
+                    _drain_wakeup()
+                elif fd in pipes:
+                    data = os.read(fd, 65536)
+                    if not data:
+                        os.close(fd)
+                        del pipes[fd]
+                    elif not on_output(pipes[fd], data) and status is None:
+                        _kill_group(pid)
+        return status, timed_out
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+        for fd in pipes:
+            os.close(fd)
+
+
+def _read(path, limit):
+    try:
+        with open(path, "rb") as f:
+            return f.read(limit).decode("utf-8", errors="replace")
+    except FileNotFoundError:
+        return ""
+
+
+def _handle(request, protocol_out):
+    global _cancelled
+    _cancelled = False
+    code = request["code"]
+    workdir = tempfile.mkdtemp(prefix="codelab-warm-")
+    try:
+        # 写出源文件，使异常堆栈能显示对应的代码行
+        with open(os.path.join(workdir, "main.py"), "w", encoding="utf-8") as f:
+            f.write(code)
+        deadline = time.monotonic() + request["wall_seconds"]
+        if not request.get("stream"):
+            pid = os.fork()
+            if pid == 0:
+                _run_child(code, workdir, request, None)
+            status, timed_out = _wait(pid, deadline)
+            return {
+                "returncode": os.waitstatus_to_exitcode(status),
+                "stdout": _read(os.path.join(workdir, ".stdout"), request["output_bytes"]),
+                "stderr": _read(os.path.join(workdir, ".stderr"), request["output_bytes"]),
+                "timed_out": timed_out,
+            }
+
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(stdout_r)
+            os.close(stderr_r)
+            _run_child(code, workdir, request, (stdout_w, stderr_w))
+        os.close(stdout_w)
+        os.close(stderr_w)
+
+        decoders = {kind: codecs.getincrementaldecoder("utf-8")(errors="replace") for kind in ("stdout", "stderr")}
+        collected = {"stdout": [], "stderr": []}
+        received = [0]
+
+        def on_output(kind, data):
+            # 管道不受RLIMIT_FSIZE限制，输出总量超过上限时杀死进程组
+            received[0] += len(data)
+            if received[0] > request["output_bytes"]:
+                return False
+            text = decoders[kind].decode(data)
+            if text:
+                collected[kind].append(text)
+                protocol_out.write(json.dumps({"event": kind, "text": text}) + "\n")
+                protocol_out.flush()
+            return True
+
+        status, timed_out = _wait(pid, deadline, {stdout_r: "stdout", stderr_r: "stderr"}, on_output)
+        returncode = os.waitstatus_to_exitcode(status)
+        if received[0] > request["output_bytes"]:
+            # 与输出到文件时超出RLIMIT_FSIZE的结果一致
+            returncode = -signal.SIGXFSZ
+        return {
+            "returncode": returncode,
+            "stdout": "".join(collected["stdout"]),
+            "stderr": "".join(collected["stderr"]),
+            "timed_out": timed_out,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    for name in sys.argv[1:]:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+    global _wakeup
+    _wakeup = os.pipe()
+    os.set_blocking(_wakeup[0], False)
+    os.set_blocking(_wakeup[1], False)
+    signal.set_wakeup_fd(_wakeup[1])
+    signal.signal(signal.SIGUSR1, _on_cancel)
+
+    # 协议使用原始的标准输入输出，子进程执行前会重定向自己的0/1/2
+    protocol_in = sys.stdin
+    protocol_out = sys.stdout
+    protocol_out.write("ready\n")
+    protocol_out.flush()
+    for line in protocol_in:
+        response = _handle(json.loads(line), protocol_out)
+        protocol_out.write(json.dumps(response) + "\n")
+        protocol_out.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+import asyncio
+import codecs
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Optional
+
+from core.code_execution.build_cache import BuildCache
+from core.code_execution.warm_pool import CANCEL_POLL_INTERVAL, WarmPythonPool
+
+try:
+    import resource
+except ImportError:  # Windows下没有resource模块，不设置资源限制
+    resource = None
+
+# 运行被取消时的结果，等待进程结束时按 CANCEL_POLL_INTERVAL 检查取消
+CANCELLED_RESULT = {"stdout": "", "error": "运行已取消"}
+
+
+class ExecutionEvent(NamedTuple):
+    """
+    流式执行的事件
+    kind: "stdout"、"stderr"（text为新输出的片段）或 "result"（执行结束，result为完整结果，总是最后一个事件）
+    """
+    kind: str
+    text: str = ""
+    result: Optional[dict] = None
+
+
+class ExecutionBackend:
+    """
+    代码执行后端的接口，run/arun 返回与远程运行服务相同结构的结果：{"stdout": str, "error": str}
+    """
+
+    def run(self, language: str, code: str) -> dict:
+        raise NotImplementedError
+
+    async def arun(self, language: str, code: str) -> dict:
+        """默认在线程中调用run，子类可以提供真正的异步实现"""
+        return await asyncio.to_thread(self.run, language, code)
+
+    async def astream(self, language: str, code: str) -> AsyncIterator[ExecutionEvent]:
+        """
+        流式执行，程序运行期间逐步产生输出事件，最后产生一个 "result" 事件
+        默认实现等待arun完成后一次性产生全部输出，子类可以提供真正的流式实现
+        """
+        result = await self.arun(language, code)
+        if result.get("stdout"):
+            yield ExecutionEvent("stdout", result["stdout"])
+        yield ExecutionEvent("result", result=result)
+
+
+class RemoteBackend(ExecutionBackend):
+    """通过HTTP调用远程运行服务（AI_CODELAB_CODE_RUNNER_IP:8000/run_code/）"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def run(self, language: str, code: str) -> dict:
+        return self.client.run_code(language, code)
+
+    async def arun(self, language: str, code: str) -> dict:
+        return await self.client.arun_code(language, code)
+
+    async def astream(self, language: str, code: str) -> AsyncIterator[ExecutionEvent]:
+        async for event in self.client.astream_code(language, code):
+            yield event
+
+
+class LanguageSpec(NamedTuple):
+    """
+    source: 源文件名
+    compile: 编译命令，解释型语言为None
+    run: 运行命令
+    limit_memory: 是否限制虚拟内存（JVM和Go运行时会预留大量虚拟地址空间，不能用RLIMIT_AS限制）
+    """
+    source: str
+    compile: Optional[List[str]]
+    run: List[str]
+    limit_memory: bool = True
+
+
+LANGUAGE_SPECS: Dict[str, LanguageSpec] = {
+    "Python": LanguageSpec("main.py", None, [sys.executable, "-I", "main.py"]),
+    "C": LanguageSpec("main.c", ["gcc", "-O2", "-o", "main", "main.c", "-lm"], ["./main"]),
+    "C++": LanguageSpec("main.cpp", ["g++", "-O2", "-std=c++17", "-o", "main", "main.cpp"], ["./main"]),
+    "Java": LanguageSpec("Main.java", ["javac", "Main.java"], ["java", "-Xmx256m", "-cp", ".", "Main"],
+                         limit_memory=False),
+    "Rust": LanguageSpec("main.rs", ["rustc", "-O", "-o", "main", "main.rs"], ["./main"]),
+    "Go": LanguageSpec("main.go", ["go", "build", "-o", "main", "main.go"], ["./main"], limit_memory=False),
+}
+
+
+class QueueFullError(RuntimeError):
+    """某个语言的等待队列已满"""
+
+
+class LocalBackend(ExecutionBackend):
+    """
+    本地执行后端：在子进程中编译并运行代码，适合单机部署和没有远程运行服务时的测试
+
+    每个语言有独立的工作线程池和有界等待队列，一种语言的大量请求不会占满其他语言的执行槽位。
+    子进程在独立的临时目录和进程组中运行，并通过rlimit限制CPU时间、内存和输出大小，超时后整个进程组被杀死。
+
+    注意：rlimit只能防止资源耗尽，不能隔离文件系统和网络，对外开放时应运行在容器等隔离环境中。
+
+    配置（构造参数优先，其次环境变量）：
+        AI_CODELAB_LOCAL_WORKERS: 每个语言的并发执行数，默认为CPU核数的一半（至少1）
+        AI_CODELAB_LOCAL_QUEUE: 每个语言的最大等待数，默认64
+        AI_CODELAB_LOCAL_CPU_SECONDS: 运行的CPU时间上限（秒），默认10
+        AI_CODELAB_LOCAL_MEMORY_MB: 运行的内存上限（MB），默认512
+        AI_CODELAB_LOCAL_OUTPUT_BYTES: 输出大小上限（字节），默认1MB
+        AI_CODELAB_WARM_POOL: Python是否使用预热解释器池（见 WarmPythonPool），默认在支持fork的系统上开启
+        AI_CODELAB_BUILD_CACHE: 编译型语言是否缓存编译产物（见 BuildCache），默认开启
+    """
+
+    def __init__(self, workers_per_language: Optional[int] = None, max_queue: Optional[int] = None,
+                 cpu_seconds: Optional[int] = None, memory_mb: Optional[int] = None,
+                 output_bytes: Optional[int] = None, compile_seconds: int = 60, warm_python: Optional[bool] = None,
+                 build_cache: Optional[BuildCache] = None):
+        self.workers_per_language = workers_per_language or int(
+            os.getenv("AI_CODELAB_LOCAL_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+        self.max_queue = max_queue or int(os.getenv("AI_CODELAB_LOCAL_QUEUE", 64))
+        self.cpu_seconds = cpu_seconds or int(os.getenv("AI_CODELAB_LOCAL_CPU_SECONDS", 10))
+        self.memory_mb = memory_mb or int(os.getenv("AI_CODELAB_LOCAL_MEMORY_MB", 512))
+        self.output_bytes = output_bytes or int(os.getenv("AI_CODELAB_LOCAL_OUTPUT_BYTES", 1024 * 1024))
+        self.compile_seconds = compile_seconds
+
+        if warm_python is None:
+            warm_python = hasattr(os, "fork") and os.getenv("AI_CODELAB_WARM_POOL", "1") == "1"
+        # 池大小与Python的并发执行数一致，每个执行线程都能拿到一个空闲的工作进程
+        self.warm_pool = WarmPythonPool(self._child_env(tempfile.gettempdir()), size=self.workers_per_language) \
+            if warm_python else None
+        if build_cache is None and os.getenv("AI_CODELAB_BUILD_CACHE", "1") == "1":
+            build_cache = BuildCache()
+        self.build_cache = build_cache
+
+        self._lock = threading.Lock()
+        self._pools: Dict[str, ThreadPoolExecutor] = {}
+        self._pending: Dict[str, int] = {}
+
+    @property
+    def languages(self) -> set:
+        return set(LANGUAGE_SPECS)
+
+    def _submit(self, language: str, code: str, emit: Optional[Callable[[str, str], None]] = None,
+                cancel: Optional[threading.Event] = None):
+        if language not in LANGUAGE_SPECS:
+            raise ValueError(f"Language {language} is not supported")
+        with self._lock:
+            if self._pending.get(language, 0) >= self.workers_per_language + self.max_queue:
+                raise QueueFullError(f"{language} 的运行队列已满，请稍后再试")
+            self._pending[language] = self._pending.get(language, 0) + 1
+            pool = self._pools.get(language)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=self.workers_per_language,
+                                          thread_name_prefix=f"local-runner-{language}")
+                self._pools[language] = pool
+        future = pool.submit(self._execute, language, code, emit, cancel)
+        future.add_done_callback(lambda _: self._release(language))
+        return future
+
+    def _release(self, language: str):
+        with self._lock:
+            self._pending[language] -= 1
+
+    def run(self, language: str, code: str) -> dict:
+        return self._submit(language, code).result()
+
+    async def arun(self, language: str, code: str) -> dict:
+        cancel = threading.Event()
+        future = self._submit(language, code, cancel=cancel)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # 等待者被取消时（用户离开页面、重新提交等），还在排队的任务直接移出队列，正在运行的杀死进程组
+            cancel.set()
+            raise
+
+    async def astream(self, language: str, code: str) -> AsyncIterator[ExecutionEvent]:
+        """通过管道实时读取子进程的输出，执行线程把输出片段转交给事件循环"""
+        loop = asyncio.get_running_loop()
+        events: "asyncio.Queue[Optional[ExecutionEvent]]" = asyncio.Queue()
+
+        def emit(kind: str, text: str):
+            loop.call_soon_threadsafe(events.put_nowait, ExecutionEvent(kind, text))
+
+        cancel = threading.Event()
+        future = self._submit(language, code, emit, cancel)
+        # 回调在所有输出片段之后进入队列，作为结束标记
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(events.put_nowait, None))
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+            yield ExecutionEvent("result", result=future.result())
+        finally:
+            # 调用方提前关闭流或被取消时，不再等待程序运行结束
+            if not future.done():
+                cancel.set()
+                future.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        """各语言正在运行和等待的任务数"""
+        with self._lock:
+            return dict(self._pending)
+
+    def build_stats(self) -> Dict[str, dict]:
+        """各语言编译缓存的命中率和编译耗时，未开启编译缓存时为空"""
+        return self.build_cache.stats() if self.build_cache is not None else {}
+
+    def _execute(self, language: str, code: str, emit: Optional[Callable[[str, str], None]] = None,
+                 cancel: Optional[threading.Event] = None) -> dict:
+        if cancel is not None and cancel.is_set():
+            return dict(CANCELLED_RESULT)
+        # 流式执行和一次性执行都使用预热池，工作进程转发子进程的输出片段
+        if language == "Python" and self.warm_pool is not None:
+            return self._make_result(*self.warm_pool.run(
+                code, self.cpu_seconds, self.memory_mb * 1024 * 1024, self.output_bytes, self.cpu_seconds * 2,
+                emit, cancel), cancel)
+
+        spec = LANGUAGE_SPECS[language]
+        workdir = tempfile.mkdtemp(prefix="codelab-")
+        try:
+            source = spec.source
+            if language == "Java":
+                # Java要求源文件名与public类名一致
+                match = re.search(r"public\s+(?:final\s+)?class\s+(\w+)", code)
+                class_name = match.group(1) if match else "Main"
+                source = f"{class_name}.java"
+                compile_cmd = ["javac", source]
+                run_cmd = ["java", "-Xmx256m", "-cp", ".", class_name]
+            else:
+                compile_cmd, run_cmd = spec.compile, spec.run
+
+            if compile_cmd is None:
+                error = self._compile(code, source, None, workdir)
+            elif self.build_cache is not None:
+                # 相同代码的其他请求可能在等待这次编译，编译本身不随请求取消
+                key = self.build_cache.make_key(language, code, compile_cmd)
+                error = self.build_cache.materialize(
+                    language, key, workdir, lambda build_dir: self._compile(code, source, compile_cmd, build_dir))
+            else:
+                error = self._compile(code, source, compile_cmd, workdir, cancel)
+            if cancel is not None and cancel.is_set():
+                return dict(CANCELLED_RESULT)
+            if error is not None:
+                return {"stdout": "", "error": error}
+
+            if emit is None:
+                returncode, stdout, stderr, timed_out = self._run_limited(
+                    run_cmd, workdir, self.cpu_seconds, limit_memory=spec.limit_memory, limit_output=True,
+                    cancel=cancel)
+                return self._make_result(returncode, stdout, stderr, timed_out, cancel)
+
+            if language == "Python":
+                # 输出到管道时Python默认使用块缓冲，-u使输出立即可见（-I会忽略PYTHONUNBUFFERED）
+                run_cmd = [run_cmd[0], "-u", *run_cmd[1:]]
+            returncode, stdout, stderr, timed_out, overflow = self._run_streaming(
+                run_cmd, workdir, self.cpu_seconds, spec.limit_memory, emit, cancel)
+            if overflow:
+                return {"stdout": stdout, "error": "输出超出限制"}
+            return self._make_result(returncode, stdout, stderr, timed_out, cancel)
+        except FileNotFoundError as e:
+            return {"stdout": "", "error": f"本地缺少{language}的编译/运行环境: {e.filename}"}
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _compile(self, code: str, source: str, compile_cmd: Optional[List[str]], workdir: str,
+                 cancel: Optional[threading.Event] = None) -> Optional[str]:
+        """
+        在workdir中写出源文件并编译
+        Returns:
+            Optional[str]: 编译失败时的错误信息，成功时为None
+        """
+        with open(os.path.join(workdir, source), "w", encoding="utf-8") as f:
+            f.write(code)
+        if compile_cmd is None:
+            return None
+        returncode, stdout, stderr, timed_out = self._run_limited(
+            compile_cmd, workdir, self.compile_seconds, limit_memory=False, limit_output=False, cancel=cancel)
+        # 编译器的输出不属于编译产物，不写入缓存
+        for name in (".stdout", ".stderr"):
+            os.remove(os.path.join(workdir, name))
+        if cancel is not None and cancel.is_set():
+            # 被取消的编译按编译失败处理，不再继续运行
+            return CANCELLED_RESULT["error"]
+        if timed_out:
+            return "编译超时"
+        if returncode != 0:
+            return stderr or stdout or f"编译失败，退出码 {returncode}"
+        return None
+
+    def _make_result(self, returncode: int, stdout: str, stderr: str, timed_out: bool,
+                     cancel: Optional[threading.Event] = None) -> dict:
+        if cancel is not None and cancel.is_set():
+            return {"stdout": stdout, "error": CANCELLED_RESULT["error"]}
+        if timed_out:
+            return {"stdout": stdout, "error": "运行超时"}
+        if returncode < 0:
+            # 实时信号等没有对应的Signals成员，只能显示编号
+            member = signal.Signals._value2member_map_.get(-returncode)
+            name = member.name if member is not None else str(-returncode)
+            reason = {"SIGXCPU": "CPU时间超出限制", "SIGXFSZ": "输出超出限制", "SIGKILL": "进程被终止（可能超出内存限制）"}
+            return {"stdout": stdout, "error": stderr or reason.get(name, f"进程被信号 {name} 终止")}
+        if returncode != 0:
+            return {"stdout": stdout, "error": stderr or f"进程退出码 {returncode}"}
+        return {"stdout": stdout, "error": ""}
+
+    def _preexec(self, cpu_seconds: int, limit_memory: bool, limit_output: bool):
+        def apply_limits():
+            if resource is None:
+                return
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+            resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+            if limit_output:
+                resource.setrlimit(resource.RLIMIT_FSIZE, (self.output_bytes, self.output_bytes))
+            if limit_memory:
+                memory = self.memory_mb * 1024 * 1024
+                resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+        return apply_limits
+
+    def _run_limited(self, cmd: List[str], workdir: str, cpu_seconds: int, limit_memory: bool,
+                     limit_output: bool, cancel: Optional[threading.Event] = None) -> tuple:
+        """
+        在资源限制下运行命令，标准输出和错误先写入文件，再读取不超过上限的部分。
+        limit_output为True时用RLIMIT_FSIZE限制写入大小（编译时不能限制，否则无法写出可执行文件）
+        Returns:
+            tuple: (退出码, stdout, stderr, 是否超时)
+        """
+        stdout_path = os.path.join(workdir, ".stdout")
+        stderr_path = os.path.join(workdir, ".stderr")
+        with open(stdout_path, "wb") as stdout_file, open(stderr_path, "wb") as stderr_file:
+            process = subprocess.Popen(
+                cmd, cwd=workdir, env=self._child_env(workdir), stdin=subprocess.DEVNULL,
+                stdout=stdout_file, stderr=stderr_file,
+                preexec_fn=self._preexec(cpu_seconds, limit_memory, limit_output) if os.name == "posix" else None,
+                start_new_session=True,
+            )
+            # 墙钟时间上限为CPU时间的2倍，防止sleep或等待输入的程序一直占用槽位
+            timed_out = self._wait(process, cpu_seconds * 2, cancel)
+            if timed_out:
+                self._kill_group(process)
+                process.wait()
+        return process.returncode, self._read_limited(stdout_path), self._read_limited(stderr_path), timed_out
+
+    def _run_streaming(self, cmd: List[str], workdir: str, cpu_seconds: int, limit_memory: bool,
+                       emit: Callable[[str, str], None], cancel: Optional[threading.Event] = None) -> tuple:
+        """
+        在资源限制下运行命令，通过管道读取输出并在读到时调用 emit(kind, text)。
+        管道不受RLIMIT_FSIZE限制，输出总量超过上限时直接杀死进程组。
+        C等语言的标准库在输出到管道时会缓冲，程序不主动刷新时输出会成块到达。
+        Returns:
+            tuple: (退出码, stdout, stderr, 是否超时, 是否输出超限)
+        """
+        process = subprocess.Popen(
+            cmd, cwd=workdir, env=self._child_env(workdir), stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            preexec_fn=self._preexec(cpu_seconds, limit_memory, False) if os.name == "posix" else None,
+            start_new_session=True,
+        )
+        lock = threading.Lock()
+        collected = {"stdout": [], "stderr": []}
+        received = [0]
+        overflow = threading.Event()
+
+        def pump(pipe, kind: str):
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            with pipe:
+                while True:
+                    data = os.read(pipe.fileno(), 4096)
+                    if not data:
+                        break
+                    with lock:
+                        received[0] += len(data)
+                        if received[0] > self.output_bytes:
+                            overflow.set()
+                            self._kill_group(process)
+                            break
+                    text = decoder.decode(data)
+                    if text:
+                        collected[kind].append(text)
+                        emit(kind, text)
+
+        readers = [threading.Thread(target=pump, args=(process.stdout, "stdout"), daemon=True),
+                   threading.Thread(target=pump, args=(process.stderr, "stderr"), daemon=True)]
+        for reader in readers:
+            reader.start()
+        timed_out = self._wait(process, cpu_seconds * 2, cancel)
+        # 清理进程组中残留的后台子进程，否则它们持有管道，读取线程无法结束
+        self._kill_group(process)
+        process.wait()
+        for reader in readers:
+            reader.join()
+        return (process.returncode, "".join(collected["stdout"]), "".join(collected["stderr"]),
+                timed_out, overflow.is_set())
+
+    def _wait(self, process: subprocess.Popen, timeout: float, cancel: Optional[threading.Event]) -> bool:
+        """
+        等待进程结束，cancel被设置时立即杀死进程组
+        Returns:
+            bool: 是否超时（超时的进程由调用方杀死）
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return process.poll() is None
+            try:
+                process.wait(timeout=remaining if cancel is None else min(remaining, CANCEL_POLL_INTERVAL))
+                return False
+            except subprocess.TimeoutExpired:
+                if cancel is not None and cancel.is_set():
+                    self._kill_group(process)
+                    process.wait()
+                    return False
+
+    @staticmethod
+    def _kill_group(process: subprocess.Popen):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    @staticmethod
+    def _child_env(workdir: str) -> dict:
+        """子进程只继承运行所需的环境变量，避免API密钥等泄露给用户代码"""
+        home = os.path.expanduser("~")
+        env = {
+            "PATH": os.environ.get("PATH", "/usr/local/bin:/usr/bin:/bin"),
+            "HOME": workdir,
+            "LANG": "C.UTF-8",
+            "PYTHONIOENCODING": "utf-8",
+            "GOCACHE": os.getenv("GOCACHE") or os.path.join(tempfile.gettempdir(), "codelab-go-build"),
+            # rustup通过HOME定位工具链，HOME被替换后需要显式指定
+            "RUSTUP_HOME": os.getenv("RUSTUP_HOME") or os.path.join(home, ".rustup"),
+            "CARGO_HOME": os.getenv("CARGO_HOME") or os.path.join(home, ".cargo"),
+        }
+        for name in ("GOROOT", "JAVA_HOME"):
+            if os.getenv(name):
+                env[name] = os.environ[name]
+        return env
+
+    def _read_limited(self, path: str) -> str:
+        with open(path, "rb") as f:
+            return f.read(self.output_bytes).decode("utf-8", errors="replace")
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.shutdown(wait=False)
+            self._pools.clear()
+        if self.warm_pool is not None:
+            self.warm_pool.close()
@@ -0,0 +1,255 @@
+import contextlib
+import errno
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，只在进程内加锁
+    fcntl = None
+
+
+class BuildCache:
+    """
+    编译产物缓存，键为 (语言, 源码哈希, 编译器版本, 编译命令)
+
+    相同代码再次运行时直接复用编译产物，只需执行；多个相同的编译请求同时到达时只编译一次，
+    其余请求等待并共享结果（包括编译失败的错误信息）。
+    缓存目录按总大小进行LRU淘汰，各语言的命中率和编译耗时可以通过stats获取。
+    多个服务进程可以共用同一个缓存目录：条目通过原子重命名发布，其他进程发布的条目在第一次查询时登记；
+    复制和淘汰通过锁文件互斥，正在被复制的条目不会被删除。编译去重只在进程内进行。
+
+    配置（构造参数优先，其次环境变量）：
+        AI_CODELAB_BUILD_CACHE_DIR: 缓存目录，默认为系统临时目录下的 codelab-build-cache
+        AI_CODELAB_BUILD_CACHE_MAX_BYTES: 缓存总大小上限，默认1GB
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.root = root or os.getenv("AI_CODELAB_BUILD_CACHE_DIR") or os.path.join(
+            tempfile.gettempdir(), "codelab-build-cache")
+        self.max_bytes = max_bytes or int(os.getenv("AI_CODELAB_BUILD_CACHE_MAX_BYTES", 1024 ** 3))
+        self._lock_dir = os.path.join(self.root, ".locks")
+        os.makedirs(self._lock_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[int, float]] = {}  # key -> (大小, 最近使用时间)
+        self._inflight: Dict[str, list] = {}  # key -> [完成事件, 编译错误]
+        self._versions: Dict[str, str] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._stripe_locks = [threading.Lock() for _ in range(256)]  # 没有fcntl时使用
+        self._load_entries()
+
+    def _load_entries(self):
+        for key in os.listdir(self.root):
+            path = os.path.join(self.root, key)
+            if os.path.isdir(path) and not key.startswith("."):
+                self._entries[key] = (self._dir_size(path), os.path.getmtime(path))
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        total = 0
+        for directory, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(directory, name))
+                except OSError:
+                    pass  # 条目正在被其他进程淘汰
+        return total
+
+    def toolchain_version(self, compiler: str) -> str:
+        """获取编译器版本字符串（每个编译器只查询一次），编译器升级后缓存自动失效"""
+        with self._lock:
+            if compiler in self._versions:
+                return self._versions[compiler]
+        flag = "version" if compiler == "go" else "-version" if compiler == "javac" else "--version"
+        try:
+            output = subprocess.run([compiler, flag], capture_output=True, text=True, timeout=10)
+            version = (output.stdout + output.stderr).strip()
+        except (OSError, subprocess.TimeoutExpired):
+            version = ""
+        with self._lock:
+            self._versions[compiler] = version
+        return version
+
+    def make_key(self, language: str, code: str, compile_cmd: List[str]) -> str:
+        raw = json.dumps([language, code, self.toolchain_version(compile_cmd[0]), compile_cmd], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _language_stats(self, language: str) -> Dict[str, float]:
+        if language not in self._stats:
+            self._stats[language] = {"hits": 0, "misses": 0, "deduplicated": 0, "compile_seconds": 0.0}
+        return self._stats[language]
+
+    def materialize(self, language: str, key: str, dest: str,
+                    build: Callable[[str], Optional[str]]) -> Optional[str]:
+        """
+        把编译产物放到dest目录中，缓存未命中时调用build编译
+        Args:
+            language: 编程语言名称
+            key: make_key 的返回值
+            dest: 运行目录，编译产物会被复制到这里
+            build: 编译函数，参数为空的编译目录，成功返回None，失败返回错误信息
+        Returns:
+            Optional[str]: 编译失败时的错误信息，成功时为None
+        """
+        with self._lock:
+            stats = self._language_stats(language)
+            build_state = self._inflight.get(key)
+            hit = owner = False
+            if build_state is None and (key in self._entries or self._adopt(key)):
+                stats["hits"] += 1
+                hit = True
+            elif build_state is None:
+                # 当前请求负责编译，其他相同请求等待 build_state[0]，并从 build_state[1] 读取编译错误
+                build_state = [threading.Event(), None]
+                self._inflight[key] = build_state
+                stats["misses"] += 1
+                owner = True
+            else:
+                stats["deduplicated"] += 1
+
+        if not owner:
+            if not hit:
+                build_state[0].wait()
+                if build_state[1] is not None:
+                    return build_state[1]
+            if self._copy_entry(key, dest):
+                return None
+            # 复制前条目已被淘汰（缓存过小或被其他进程淘汰时可能发生），重新获取
+            return self.materialize(language, key, dest, build)
+
+        build_dir = tempfile.mkdtemp(prefix=".build-", dir=self.root)
+        try:
+            start = time.monotonic()
+            error = build(build_dir)
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._language_stats(language)["compile_seconds"] += elapsed
+            if error is None:
+                # 先从私有的编译目录复制，再发布为缓存条目
+                shutil.copytree(build_dir, dest, dirs_exist_ok=True)
+                self._publish(key, build_dir)
+                self._evict()
+            build_state[1] = error
+            return error
+        except BaseException as e:
+            build_state[1] = f"编译失败: {e}"
+            raise
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            with self._lock:
+                self._inflight.pop(key, None)
+            build_state[0].set()
+
+    def _adopt(self, key: str) -> bool:
+        """在锁内调用：登记其他进程发布的条目（多个服务进程共用同一个缓存目录）"""
+        entry = os.path.join(self.root, key)
+        if not os.path.isdir(entry):
+            return False
+        self._entries[key] = (self._dir_size(entry), time.time())
+        return True
+
+    def _publish(self, key: str, build_dir: str):
+        """把编译目录原子地重命名为缓存条目，条目已存在（其他进程先完成了相同的编译）时直接使用已有的条目"""
+        size = self._dir_size(build_dir)
+        try:
+            os.rename(build_dir, os.path.join(self.root, key))
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+        with self._lock:
+            self._entries[key] = (size, time.time())
+
+    def _copy_entry(self, key: str, dest: str) -> bool:
+        """
+        持有条目的共享锁复制，复制期间条目不会被任何进程淘汰
+        Returns:
+            bool: 条目已被淘汰时返回False
+        """
+        entry = os.path.join(self.root, key)
+        with self._entry_lock(key):
+            if not os.path.isdir(entry):
+                with self._lock:
+                    self._entries.pop(key, None)
+                return False
+            shutil.copytree(entry, dest, dirs_exist_ok=True)
+            now = time.time()
+            os.utime(entry, (now, now))
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = (self._entries[key][0], now)
+        return True
+
+    def _evict(self):
+        with self._lock:
+            total = sum(size for size, _ in self._entries.values())
+            victims = []
+            for key, (size, _) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+                if total <= self.max_bytes:
+                    break
+                victims.append(key)
+                total -= size
+
+        for key in victims:
+            with self._entry_lock(key, exclusive=True) as locked:
+                if not locked:
+                    continue  # 正在被复制，留到下次淘汰
+                # 先重命名再删除，其他进程不会看到删除了一半的条目
+                trash = tempfile.mkdtemp(prefix=".evict-", dir=self.root)
+                try:
+                    os.rename(os.path.join(self.root, key), os.path.join(trash, key))
+                except FileNotFoundError:
+                    pass  # 已被其他进程淘汰
+            shutil.rmtree(trash, ignore_errors=True)
+            with self._lock:
+                self._entries.pop(key, None)
+
+    @contextlib.contextmanager
+    def _entry_lock(self, key: str, exclusive: bool = False):
+        """
+        条目的读写锁，按键的前两位分为256个锁文件，复制时持有共享锁，淘汰时非阻塞地获取排他锁
+        Yields:
+            bool: 是否获得了锁，非阻塞获取排他锁失败时为False
+        """
+        if fcntl is None:
+            lock = self._stripe_locks[int(key[:2], 16)]
+            acquired = lock.acquire(blocking=not exclusive)
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    lock.release()
+            return
+
+        with open(os.path.join(self._lock_dir, f"{key[:2]}.lock"), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB if exclusive else fcntl.LOCK_SH)
+                acquired = True
+            except BlockingIOError:
+                acquired = False
+            # 关闭文件时释放锁
+            yield acquired
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        各语言的缓存统计
+        Returns:
+            dict: {语言: {"hits", "misses", "deduplicated", "hit_rate", "compile_seconds", "avg_compile_seconds"}}
+        """
+        with self._lock:
+            result = {}
+            for language, stats in self._stats.items():
+                item = dict(stats)
+                requests = stats["hits"] + stats["misses"] + stats["deduplicated"]
+                item["hit_rate"] = (stats["hits"] + stats["deduplicated"]) / requests if requests else 0.0
+                item["avg_compile_seconds"] = stats["compile_seconds"] / stats["misses"] if stats["misses"] else 0.0
+                result[language] = item
+            result["_total_bytes"] = sum(size for size, _ in self._entries.values())
+            return result
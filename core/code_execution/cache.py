@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from core.canonical import fingerprint
+
+# 代码中包含该标记时不使用缓存，适用于读取时间、随机数或网络的程序，例如：
+#     # codelab: no-cache
+NO_CACHE_MARKER = "codelab: no-cache"
+
+
+class ExecutionCache:
+    """
+    代码运行结果缓存，键为 (语言, 代码的规范化指纹, 标准输入)，只有空白、注释等格式不同的代码共用同一个结果（见 core.canonical）
+
+    内存中为LRU，可选持久化到SQLite；每个条目有独立的过期时间。
+    只缓存运行服务正常返回且没有错误的结果，带有 NO_CACHE_MARKER 标记的代码不缓存。
+
+    配置（构造参数优先，其次环境变量）：
+        AI_CODELAB_EXEC_CACHE_DB: SQLite文件路径，默认不持久化
+        AI_CODELAB_EXEC_CACHE_TTL: 默认有效期（秒），默认3600
+
+    在事件循环中应使用 aget/aput：持久化到SQLite时数据库操作在工作线程中执行，不阻塞事件循环
+    """
+
+    def __init__(self, max_entries: int = 512, db_path: Optional[str] = None, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl if ttl is not None else float(os.getenv("AI_CODELAB_EXEC_CACHE_TTL", 3600))
+        if db_path is None:
+            db_path = os.getenv("AI_CODELAB_EXEC_CACHE_DB", "")
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (result, expires)
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0}
+
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(language: str, code: str, stdin: str = "") -> Optional[str]:
+        """
+        计算缓存键
+        Returns:
+            Optional[str]: sha256十六进制摘要，代码带有 NO_CACHE_MARKER 时返回None
+        """
+        if NO_CACHE_MARKER in code:
+            return None
+        raw = json.dumps([language, fingerprint(language, code), stdin], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: Optional[str]) -> Optional[dict]:
+        """
+        查询缓存
+        Args:
+            key: make_key 的返回值，为None时表示不使用缓存
+        Returns:
+            Optional[dict]: 缓存的运行结果，未命中时返回None
+        """
+        now = time.time()
+        with self._lock:
+            if key is None:
+                self._stats["bypassed"] += 1
+                return None
+            item = self._memory.get(key)
+            if item is not None and item[1] > now:
+                self._memory.move_to_end(key)
+                self._stats["hits"] += 1
+                return dict(item[0])
+            if item is not None:
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, expires FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    result = json.loads(row[0])
+                    self._remember(key, result, row[1])
+                    self._stats["hits"] += 1
+                    return dict(result)
+                if row is not None:
+                    self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: Optional[str], result: dict, ttl: Optional[float] = None):
+        """
+        写入运行结果，key为None或结果中有错误时不写入
+        Args:
+            key: make_key 的返回值
+            result: 运行结果
+            ttl: 该条目的有效期（秒），默认使用self.ttl
+        """
+        if key is None or result.get("error"):
+            return
+        expires = time.time() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._remember(key, dict(result), expires)
+            self._stats["stores"] += 1
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO results (key, value, expires) VALUES (?, ?, ?)",
+                                 (key, json.dumps(result, ensure_ascii=False), expires))
+                self._db.execute("DELETE FROM results WHERE expires <= ?", (time.time(),))
+                self._db.commit()
+
+    async def aget(self, key: Optional[str]) -> Optional[dict]:
+        """get的异步版本"""
+        if self._db is None or key is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: Optional[str], result: dict, ttl: Optional[float] = None):
+        """put的异步版本"""
+        if self._db is None or key is None:
+            self.put(key, result, ttl)
+            return
+        await asyncio.to_thread(self.put, key, result, ttl)
+
+    def _remember(self, key: str, result: dict, expires: float):
+        self._memory[key] = (result, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        """获取命中统计：hits, misses, bypassed（带有不缓存标记）, stores, entries"""
+        with self._lock:
+            result = dict(self._stats)
+            result["entries"] = len(self._memory)
+            return result
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+
+# 进程内共享的默认缓存
+execution_cache = ExecutionCache()
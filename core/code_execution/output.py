@@ -0,0 +1,45 @@
+import os
+from collections import deque
+from typing import Optional
+
+TRUNCATED_NOTICE = "...（前面的输出已省略）\n"
+
+
+class TailBuffer:
+    """
+    只保留最后max_chars个字符的输出缓冲区，用于在界面上实时显示程序输出
+
+    输出很多的程序只会占用固定大小的内存，超出部分从头部丢弃，显示时加上省略提示。
+
+    配置（构造参数优先，其次环境变量）：
+        AI_CODELAB_OUTPUT_TAIL_CHARS: 保留的最大字符数，默认20000
+    """
+
+    def __init__(self, max_chars: Optional[int] = None):
+        self.max_chars = max_chars or int(os.getenv("AI_CODELAB_OUTPUT_TAIL_CHARS", 20000))
+        self.truncated = False
+        self._parts: deque = deque()
+        self._size = 0
+
+    def append(self, text: str):
+        if not text:
+            return
+        self._parts.append(text)
+        self._size += len(text)
+        # 丢弃整段超出的片段，剩余的多余部分在读取text时截掉
+        while self._size - len(self._parts[0]) >= self.max_chars:
+            self._size -= len(self._parts.popleft())
+            self.truncated = True
+
+    @property
+    def text(self) -> str:
+        joined = "".join(self._parts)
+        if len(joined) > self.max_chars:
+            joined = joined[-self.max_chars:]
+            self.truncated = True
+        self._parts = deque([joined]) if joined else deque()
+        self._size = len(joined)
+        return TRUNCATED_NOTICE + joined if self.truncated else joined
+
+    def __len__(self) -> int:
+        return self._size
@@ -1,23 +1,315 @@
-import sys
+import asyncio
+import json
 import os
-import requests
+import random
+import threading
+import time
 
-CODE_RUNNER_IP = os.environ.get("AI_CODELAB_CODE_RUNNER_IP")
-if CODE_RUNNER_IP is None:
-    raise ValueError("Environment variable AI_CODELAB_CODE_RUNNER_IP is not set")
+from core.canonical import normalization_stats
+from core.code_execution.backends import ExecutionBackend, ExecutionEvent, LocalBackend, RemoteBackend
+from core.code_execution.cache import execution_cache
+from core.metrics import RUN_CODE_SECONDS
 
-POST_URL = f"http://{CODE_RUNNER_IP}:8000/run_code/"
+# 可以重试的响应状态码（运行服务暂时不可用）
+RETRY_STATUS = {502, 503, 504}
+
+
+class CodeRunnerClient:
+    """
+    代码运行服务的客户端，复用长连接并带有超时和重试
+
+    同步接口基于 requests.Session，异步接口基于 httpx.AsyncClient，两者各自维护连接池。
+    运行服务地址在第一次请求时才读取，未设置 AI_CODELAB_CODE_RUNNER_IP 不影响模块导入。
+    只有连接失败和 502/503/504 会重试（带随机抖动的指数退避），读取超时不重试，避免同一段代码被重复执行。
+
+    流式运行（astream_code）使用 run_code/stream/ 接口，响应为SSE：
+        event: stdout 或 stderr，data: {"text": "..."}，程序运行期间逐步发送
+        event: result，data: 与 run_code 相同的结果，最后发送
+    运行服务不支持该接口（404/405）时退回到 arun_code。
+
+    配置（构造参数优先，其次环境变量）：
+        AI_CODELAB_CODE_RUNNER_IP: 运行服务的IP
+        AI_CODELAB_CODE_RUNNER_CONNECT_TIMEOUT: 连接超时（秒），默认3
+        AI_CODELAB_CODE_RUNNER_READ_TIMEOUT: 读取超时（秒），默认30
+        AI_CODELAB_CODE_RUNNER_RETRIES: 最大重试次数，默认2
+    """
+
+    def __init__(self, post_url=None, connect_timeout=None, read_timeout=None, max_retries=None,
+                 backoff=0.2, pool_maxsize=32):
+        self._post_url = post_url
+        self.connect_timeout = connect_timeout or float(os.getenv("AI_CODELAB_CODE_RUNNER_CONNECT_TIMEOUT", 3))
+        self.read_timeout = read_timeout or float(os.getenv("AI_CODELAB_CODE_RUNNER_READ_TIMEOUT", 30))
+        self.max_retries = max_retries if max_retries is not None else int(
+            os.getenv("AI_CODELAB_CODE_RUNNER_RETRIES", 2))
+        self.backoff = backoff
+        self.pool_maxsize = pool_maxsize
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._async_client = None
+
+    @property
+    def post_url(self):
+        if self._post_url is None:
+            code_runner_ip = os.environ.get("AI_CODELAB_CODE_RUNNER_IP")
+            if code_runner_ip is None:
+                raise ValueError("Environment variable AI_CODELAB_CODE_RUNNER_IP is not set")
+            self._post_url = f"http://{code_runner_ip}:8000/run_code/"
+        return self._post_url
+
+    @property
+    def stream_url(self):
+        return f"{self.post_url}stream/"
+
+    def _get_session(self):
+        # requests只有同步接口使用，在第一次创建会话时才导入
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                # 重试由run_code自己控制，这里关闭urllib3的重试
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def _get_async_client(self):
+        # httpx只有异步接口使用，在第一次创建客户端时才导入
+        import httpx
+
+        with self._lock:
+            if self._async_client is None:
+                self._async_client = httpx.AsyncClient(
+                    timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                    limits=httpx.Limits(max_connections=self.pool_maxsize,
+                                        max_keepalive_connections=self.pool_maxsize),
+                )
+            return self._async_client
+
+    def _backoff_delay(self, attempt):
+        # full jitter：在 [0, backoff * 2^attempt] 内随机等待，避免多个请求同时重试
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def run_code(self, language, code):
+        """
+        运行代码
+        Args:
+            language: 编程语言名称（与界面上的文本相同）
+            code: 代码
+        Returns:
+            dict: 运行服务返回的结果，包含 stdout 和 error
+        """
+        from requests.exceptions import ConnectionError as RequestsConnectionError
+
+        data = {"language": language, "code": code}
+        session = self._get_session()
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = session.post(self.post_url, json=data, timeout=(self.connect_timeout, self.read_timeout))
+            except RequestsConnectionError:
+                if last_attempt:
+                    raise
+                time.sleep(self._backoff_delay(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUS and not last_attempt:
+                time.sleep(self._backoff_delay(attempt))
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    async def arun_code(self, language, code):
+        """run_code的异步版本，不占用工作线程，参数和返回值同run_code"""
+        import httpx
+
+        data = {"language": language, "code": code}
+        client = self._get_async_client()
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await client.post(self.post_url, json=data)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if last_attempt:
+                    raise
+                await asyncio.sleep(self._backoff_delay(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUS and not last_attempt:
+                await asyncio.sleep(self._backoff_delay(attempt))
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    async def astream_code(self, language, code):
+        """
+        流式运行代码
+        Args:
+            language: 编程语言名称（与界面上的文本相同）
+            code: 代码
+        Yields:
+            ExecutionEvent: 输出片段，最后一个为 "result" 事件
+        """
+        import httpx
+
+        data = {"language": language, "code": code}
+        client = self._get_async_client()
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                # 读取超时限制的是两次输出之间的间隔
+                async with client.stream("POST", self.stream_url, json=data,
+                                         headers={"Accept": "text/event-stream"}) as response:
+                    if response.status_code in (404, 405):
+                        break
+                    if response.status_code in RETRY_STATUS and not last_attempt:
+                        await asyncio.sleep(self._backoff_delay(attempt))
+                        continue
+                    response.raise_for_status()
+                    async for event in self._parse_sse(response):
+                        yield event
+                    return
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if last_attempt:
+                    raise
+                await asyncio.sleep(self._backoff_delay(attempt))
+
+        result = await self.arun_code(language, code)
+        if result.get("stdout"):
+            yield ExecutionEvent("stdout", result["stdout"])
+        yield ExecutionEvent("result", result=result)
+
+    @staticmethod
+    async def _parse_sse(response):
+        import httpx
+
+        kind, data = None, []
+        async for line in response.aiter_lines():
+            if line.startswith("event:"):
+                kind = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data.append(line[len("data:"):].strip())
+            elif not line and data:
+                payload = json.loads("\n".join(data))
+                if kind == "result":
+                    yield ExecutionEvent("result", result=payload)
+                    return
+                yield ExecutionEvent(kind or "stdout", payload.get("text", ""))
+                kind, data = None, []
+        raise httpx.RemoteProtocolError("运行服务在返回结果前关闭了连接")
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    async def aclose(self):
+        with self._lock:
+            client, self._async_client = self._async_client, None
+        if client is not None:
+            await client.aclose()
+
+
+# 进程内共享的默认客户端
+code_runner_client = CodeRunnerClient()
+
+
+def create_backend() -> ExecutionBackend:
+    """
+    根据环境变量 AI_CODELAB_EXECUTION_BACKEND 创建执行后端：
+        remote（默认）: 远程运行服务
+        local: 本机子进程执行，见 LocalBackend
+    """
+    name = os.getenv("AI_CODELAB_EXECUTION_BACKEND", "remote")
+    if name == "remote":
+        return RemoteBackend(code_runner_client)
+    if name == "local":
+        return LocalBackend()
+    raise ValueError(f"Unknown execution backend: {name}")
+
+
+# 在第一次运行代码时创建（本地后端会扫描编译缓存目录），也可以直接赋值替换
+execution_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_execution_backend() -> ExecutionBackend:
+    global execution_backend
+    with _backend_lock:
+        if execution_backend is None:
+            execution_backend = create_backend()
+        return execution_backend
+
+
+def _cache_label(key, result):
+    """run_code延迟指标的cache标签：hit、miss，或bypass（代码带有不缓存标记）"""
+    if key is None:
+        return "bypass"
+    return "miss" if result is None else "hit"
+
+
+def _cache_lookup(language, code):
+    """
+    按代码的规范化指纹查询运行结果缓存，并统计规范化带来的额外命中
+    Returns:
+        tuple: (缓存键, 缓存的结果)，未命中时结果为None
+    """
+    key = execution_cache.make_key(language, code)
+    result = execution_cache.get(key)
+    if key is not None:
+        normalization_stats.record("execution", key, code, result is not None)
+    return key, result
+
+
+async def _acache_lookup(language, code):
+    """_cache_lookup的异步版本，缓存持久化到SQLite时查询不阻塞事件循环"""
+    key = execution_cache.make_key(language, code)
+    result = await execution_cache.aget(key)
+    if key is not None:
+        normalization_stats.record("execution", key, code, result is not None)
+    return key, result
 
 
 def run_code(language, code):
-    data = {"language": language, "code": code}
+    # 相同语言、相同代码（忽略空白、注释等格式差异）的运行结果直接从缓存返回
+    start = time.perf_counter()
+    key, result = _cache_lookup(language, code)
+    cache = _cache_label(key, result)
+    if result is None:
+        result = get_execution_backend().run(language, code)
+        execution_cache.put(key, result)
+    RUN_CODE_SECONDS.labels(language, cache).observe(time.perf_counter() - start)
+    return result
+
+
+async def arun_code(language, code):
+    start = time.perf_counter()
+    key, result = await _acache_lookup(language, code)
+    cache = _cache_label(key, result)
+    if result is None:
+        result = await get_execution_backend().arun(language, code)
+        await execution_cache.aput(key, result)
+    RUN_CODE_SECONDS.labels(language, cache).observe(time.perf_counter() - start)
+    return result
 
-    response = requests.post(POST_URL, json=data)
 
-    if response.status_code == 200:
-        return response.json()
-    else:
-        response.raise_for_status()
+async def astream_code(language, code):
+    """流式运行代码，产生 ExecutionEvent，缓存命中时一次性产生全部输出"""
+    start = time.perf_counter()
+    key, result = await _acache_lookup(language, code)
+    if result is not None:
+        RUN_CODE_SECONDS.labels(language, "hit").observe(time.perf_counter() - start)
+        if result.get("stdout"):
+            yield ExecutionEvent("stdout", result["stdout"])
+        yield ExecutionEvent("result", result=result)
+        return
 
-    # if language not in language_map:
-    #     raise ValueError(f"Language {language} is not supported")
+    async for event in get_execution_backend().astream(language, code):
+        if event.kind == "result":
+            await execution_cache.aput(key, event.result)
+            RUN_CODE_SECONDS.labels(language, _cache_label(key, None)).observe(time.perf_counter() - start)
+        yield event
@@ -0,0 +1,173 @@
+import ast
+import asyncio
+import contextlib
+import os
+import time
+from typing import AsyncContextManager, AsyncIterator, Callable, List, NamedTuple, Optional, Set
+
+from core.code_execution.backends import QueueFullError
+from core.code_execution.cache import NO_CACHE_MARKER
+from core.code_execution.run_code import arun_code
+
+DEFAULT_CONCURRENCY = int(os.getenv("AI_CODELAB_TEST_CONCURRENCY", 8))
+
+
+class TestCase(NamedTuple):
+    """
+    name: 测试名称（函数名，unittest的测试为 类名.方法名）
+    code: 可以独立运行的完整程序，只执行这一个测试
+    """
+    name: str
+    code: str
+
+
+class TestResult(NamedTuple):
+    name: str
+    passed: bool
+    duration: float  # 运行耗时（秒）
+    output: str  # 标准输出，失败时为错误信息
+
+
+def split_tests(code: str, language: str) -> List[TestCase]:
+    """
+    把导入的测试代码拆分为相互独立的测试，每个测试单独运行，一个测试卡住或崩溃不会影响其他测试
+
+    Python按AST拆分：顶层的 test_* 函数和 unittest.TestCase 子类中的 test_* 方法各自成为一个测试，
+    其余代码（被测代码、辅助函数、import等）作为公共部分，去掉原有的测试调用、__main__入口和提示信息。
+    其他语言或无法拆分时整个程序作为一个测试。
+    Args:
+        code: 测试代码
+        language: 编程语言名称
+    Returns:
+        List[TestCase]: 拆分后的测试，至少一个
+    """
+    whole = [TestCase("全部测试", code)]
+    if language != "Python":
+        return whole
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return whole
+
+    tests = [node.name for node in tree.body
+             if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith("test")]
+    unittest_tests = [
+        f"{node.name}.{item.name}"
+        for node in tree.body if isinstance(node, ast.ClassDef) and _is_test_case(node)
+        for item in node.body
+        if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) and item.name.startswith("test")
+    ]
+    if not tests and not unittest_tests:
+        return whole
+
+    prelude_code = _prelude(code, tree, _runners(tree, tests))
+    cases = []
+    for name in tests:
+        call = f"import asyncio\nasyncio.run({name}())" if _is_async(tree, name) else f"{name}()"
+        cases.append(TestCase(name, f"{prelude_code}\n\n{call}\n"))
+    for name in unittest_tests:
+        cases.append(TestCase(name, f"{prelude_code}\n\nimport unittest\n"
+                                    f"unittest.main(argv=['test', {name!r}], verbosity=0)\n"))
+    return cases
+
+
+def _prelude(code: str, tree: ast.Module, runners: Set[str]) -> str:
+    """
+    公共部分：把原始代码中测试调用等语句所在的行替换为空行，
+    保留注释（包括 NO_CACHE_MARKER）并且行号与导入的代码一致，报错时的行号可以直接对照
+    """
+    removed, kept = set(), set()
+    for node in tree.body:
+        first = min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", [])])
+        (removed if _is_runner_statement(node, runners) else kept).update(range(first, node.end_lineno + 1))
+    if removed & kept:
+        # 同一行上有多条语句（如用分号分隔）时不能按行删除，退回到由AST重新生成代码
+        prelude = ast.unparse(ast.Module(body=[node for node in tree.body if not _is_runner_statement(node, runners)],
+                                         type_ignores=[]))
+    else:
+        prelude = "\n".join(
+            "" if number in removed else line for number, line in enumerate(code.split("\n"), 1)).rstrip()
+    if NO_CACHE_MARKER in code and NO_CACHE_MARKER not in prelude:
+        prelude += f"\n# {NO_CACHE_MARKER}"
+    return prelude
+
+
+def _is_test_case(node: ast.ClassDef) -> bool:
+    return any(ast.unparse(base).endswith("TestCase") for base in node.bases)
+
+
+def _is_async(tree: ast.Module, name: str) -> bool:
+    return any(isinstance(node, ast.AsyncFunctionDef) and node.name == name for node in tree.body)
+
+
+def _runners(tree: ast.Module, tests: List[str]) -> Set[str]:
+    """测试函数以及调用了测试函数的顶层函数（例如 run_all_tests）"""
+    runners = set(tests)
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and any(
+                isinstance(child, ast.Name) and child.id in tests for child in ast.walk(node)):
+            runners.add(node.name)
+    return runners
+
+
+def _is_runner_statement(node: ast.stmt, runners: Set[str]) -> bool:
+    # if __name__ == "__main__": 入口
+    if isinstance(node, ast.If) and "__name__" in ast.unparse(node.test):
+        return True
+    if not isinstance(node, ast.Expr):
+        return False
+    value = node.value.args[0] if _called(node.value) == "asyncio.run" and node.value.args else node.value
+    name = _called(value)
+    # 测试调用、unittest.main() 以及只打印常量的提示信息（例如 "All tests passed!"）
+    if name in runners or name == "unittest.main":
+        return True
+    return name == "print" and all(isinstance(arg, ast.Constant) for arg in value.args)
+
+
+def _called(node: ast.AST) -> Optional[str]:
+    if isinstance(node, ast.Await):
+        node = node.value
+    return ast.unparse(node.func) if isinstance(node, ast.Call) else None
+
+
+async def arun_tests(language: str, cases: List[TestCase], concurrency: int = DEFAULT_CONCURRENCY,
+                     admit: Optional[Callable[[], AsyncContextManager]] = None) -> AsyncIterator[TestResult]:
+    """
+    并发运行测试，按完成顺序产生结果
+    Args:
+        language: 编程语言名称
+        cases: split_tests 的返回值
+        concurrency: 同时运行的最大测试数
+        admit: 每个测试运行期间进入的异步上下文（如准入控制），测试的耗时不包括在其中等待的时间
+    Raises:
+        进入admit时的异常（如 AdmissionRejected）和 QueueFullError 不记为测试失败，直接抛出并取消其余测试，
+        由调用方统一提示
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(case: TestCase) -> TestResult:
+        async with semaphore:
+            start = time.monotonic()
+            admitted = False
+            try:
+                async with admit() if admit is not None else contextlib.nullcontext():
+                    admitted = True
+                    start = time.monotonic()
+                    result = await arun_code(language, case.code)
+            except Exception as e:
+                if not admitted or isinstance(e, QueueFullError):
+                    raise
+                result = {"stdout": "", "error": f"运行失败: {e}"}
+            duration = time.monotonic() - start
+        error = result.get("error")
+        return TestResult(case.name, not error, duration, error or result.get("stdout") or "")
+
+    tasks = [asyncio.create_task(run_one(case)) for case in cases]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # 调用方提前结束或被取消时，取消尚未完成的测试并等待它们杀死进程、关闭连接
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
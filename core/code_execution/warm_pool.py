@@ -0,0 +1,179 @@
+import json
+import os
+import queue
+import select
+import signal
+import subprocess
+import sys
+import threading
+from typing import Callable, List, Optional
+
+_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_warm_worker.py")
+
+# 等待执行结果时检查取消的间隔（秒）
+CANCEL_POLL_INTERVAL = 0.1
+
+DEFAULT_PRELOAD = [
+    "math", "random", "re", "json", "string", "collections", "itertools", "functools", "heapq", "bisect",
+    "typing", "dataclasses", "datetime", "decimal", "fractions", "statistics", "unittest", "traceback",
+]
+
+
+class _WarmWorker:
+    """一个预热的工作进程，同一时间只被一个线程使用"""
+
+    def __init__(self, preload: List[str], env: dict):
+        self.runs = 0
+        self.process = subprocess.Popen(
+            [sys.executable, "-I", _WORKER_SCRIPT, *preload],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env,
+        )
+        # 标准输出不经过缓冲直接用os.read读取，才能在等待时用select检查取消
+        self._buffer = b""
+        if self._read_line(None) != b"ready":
+            self.close()
+            raise RuntimeError("预热Python工作进程启动失败")
+
+    def submit(self, request: dict, emit: Optional[Callable[[str, str], None]] = None,
+               cancel: Optional[threading.Event] = None) -> dict:
+        """
+        提交一次执行，等待执行结果
+        Args:
+            request: 执行请求，stream为真时工作进程会先发送输出片段，交给 emit(kind, text)
+            cancel: 被设置时通知工作进程杀死正在运行的子进程，之后仍然等待执行结果
+        """
+        self.runs += 1
+        self.process.stdin.write((json.dumps(request) + "\n").encode("utf-8"))
+        self.process.stdin.flush()
+        while True:
+            message = json.loads(self._read_line(cancel))
+            if "event" not in message:
+                return message
+            if emit is not None:
+                emit(message["event"], message["text"])
+
+    def _read_line(self, cancel: Optional[threading.Event]) -> bytes:
+        fd = self.process.stdout.fileno()
+        while b"\n" not in self._buffer:
+            if cancel is not None:
+                if cancel.is_set():
+                    self.process.send_signal(signal.SIGUSR1)
+                    cancel = None
+                elif not select.select([fd], [], [], CANCEL_POLL_INTERVAL)[0]:
+                    continue
+            data = os.read(fd, 65536)
+            if not data:
+                raise RuntimeError("预热Python工作进程意外退出")
+            self._buffer += data
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line.strip()
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class WarmPythonPool:
+    """
+    预热的Python解释器池（fork-server）
+
+    池中每个工作进程启动时预先导入常用模块，之后每次提交代码都由工作进程fork出一个全新的子进程执行，
+    子进程之间互不影响，但省去了解释器启动和标准库导入的开销。
+    工作进程执行max_runs次后会被回收并重新启动，避免长期运行积累的状态。
+    流式执行时工作进程通过管道读取子进程的输出并逐段转发；运行被取消时工作进程杀死子进程，工作进程本身继续复用。
+
+    配置（构造参数优先，其次环境变量）：
+        AI_CODELAB_WARM_POOL_SIZE: 工作进程数，默认2
+        AI_CODELAB_WARM_POOL_MAX_RUNS: 每个工作进程的最大执行次数，默认200
+        AI_CODELAB_WARM_POOL_PRELOAD: 逗号分隔的预导入模块列表，默认见DEFAULT_PRELOAD
+    """
+
+    def __init__(self, env: dict, size: Optional[int] = None, max_runs: Optional[int] = None,
+                 preload: Optional[List[str]] = None):
+        self.env = env
+        self.size = size or int(os.getenv("AI_CODELAB_WARM_POOL_SIZE", 2))
+        self.max_runs = max_runs or int(os.getenv("AI_CODELAB_WARM_POOL_MAX_RUNS", 200))
+        if preload is None:
+            configured = os.getenv("AI_CODELAB_WARM_POOL_PRELOAD")
+            preload = [name.strip() for name in configured.split(",") if name.strip()] \
+                if configured else DEFAULT_PRELOAD
+        self.preload = preload
+
+        self._lock = threading.Lock()
+        self._idle: "queue.Queue[Optional[_WarmWorker]]" = queue.Queue()
+        self._started = False
+        self._stats = {"runs": 0, "recycled": 0, "crashed": 0}
+
+    def _start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        # 工作进程在后台创建，创建失败的槽位会在下次取用时重试
+        for _ in range(self.size):
+            self._spawn_in_background()
+
+    def _spawn_in_background(self):
+        def spawn():
+            try:
+                worker = _WarmWorker(self.preload, self.env)
+            except Exception:
+                worker = None
+            self._idle.put(worker)
+        threading.Thread(target=spawn, daemon=True).start()
+
+    def run(self, code: str, cpu_seconds: int, memory_bytes: int, output_bytes: int, wall_seconds: float,
+            emit: Optional[Callable[[str, str], None]] = None, cancel: Optional[threading.Event] = None) -> tuple:
+        """
+        在预热的工作进程中执行代码
+        Args:
+            emit: 不为None时流式执行，输出片段在读到时交给 emit(kind, text)，输出总量超过上限时进程被杀死
+            cancel: 被设置时杀死正在运行的代码
+        Returns:
+            tuple: (退出码（被信号终止时为负数）, stdout, stderr, 是否超时)，与 LocalBackend._run_limited 相同
+        """
+        self._start()
+        worker = self._idle.get()
+        try:
+            if worker is None or not worker.alive():
+                worker = _WarmWorker(self.preload, self.env)
+            response = worker.submit({
+                "code": code, "cpu_seconds": cpu_seconds, "memory_bytes": memory_bytes,
+                "output_bytes": output_bytes, "wall_seconds": wall_seconds, "stream": emit is not None,
+            }, emit, cancel)
+        except Exception:
+            with self._lock:
+                self._stats["crashed"] += 1
+            if worker is not None:
+                worker.close()
+            self._idle.put(None)
+            raise
+
+        with self._lock:
+            self._stats["runs"] += 1
+            recycle = worker.runs >= self.max_runs
+            if recycle:
+                self._stats["recycled"] += 1
+        if recycle:
+            worker.close()
+            self._spawn_in_background()
+        else:
+            self._idle.put(worker)
+        return response["returncode"], response["stdout"], response["stderr"], response["timed_out"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not None:
+                worker.close()
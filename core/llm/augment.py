@@ -1,3 +1,7 @@
+import textwrap
+
+from core.llm.prompts import prompt_registry
+
 structured_guidelines = {
     "错误修复": {
         "header": "请严格按以下格式分析代码错误",
@@ -47,43 +51,64 @@ structured_guidelines = {
     }
 }
 
-def generate_prompt(task, language, code):
-    template = {
-        "错误修复": f"""
-            作为资深{language}开发工程师，{structured_guidelines['错误修复']['header']}：
 
-            代码分析要求：
-            {chr(10).join(structured_guidelines['错误修复']['requirements'])}
+def _example(task):
+    return textwrap.dedent(structured_guidelines[task]['example']).strip("\n")
 
-            原始代码：
-            ```{language}
-            {code}
-            ```
 
-            请按此模板响应：
-            {structured_guidelines['错误修复']['example']}
+# 说明、格式要求和示例都放在前缀中，编程语言和用户代码放在最后，使前缀对所有请求都相同
+prompt_registry.register(
+    "augment.错误修复", "augment",
+    prefix=f"""作为资深开发工程师，{structured_guidelines['错误修复']['header']}：
 
-            最后请给出：
-            ### 完整修复方案
-            包含所有修正的完整代码（用```标记）""",
+代码分析要求：
+{chr(10).join(structured_guidelines['错误修复']['requirements'])}
 
-        "代码优化": f"""
-            作为{language}性能优化专家，{structured_guidelines['代码优化']['header']}：
+请按此模板响应：
+{_example('错误修复')}
 
-            优化维度应包括：
-            {chr(10).join(structured_guidelines['代码优化']['categories'])}
+最后请给出：
+### 完整修复方案
+包含所有修正的完整代码（用```标记）
+""",
+    suffix="""
+编程语言: {language}
+原始代码{code_note}：
+```{language}
+{code}
+```""",
+)
+prompt_registry.register(
+    "augment.代码优化", "augment",
+    prefix=f"""作为性能优化专家，{structured_guidelines['代码优化']['header']}：
 
-            原始代码：
-            ```{language}
-            {code}
-            ```
+优化维度应包括：
+{chr(10).join(structured_guidelines['代码优化']['categories'])}
 
-            参考示例：
-            {structured_guidelines['代码优化']['example']}
+参考示例：
+{_example('代码优化')}
+
+最后请给出：
+### 完整优化的重构代码
+整合所有优化的最终代码（用```标记）
+""",
+    suffix="""
+编程语言: {language}
+原始代码{code_note}：
+```{language}
+{code}
+```""",
+)
 
-            最后请给出：
-            ### 完整优化的重构代码
-            整合所有优化的最终代码（用```标记）"""
-    }
 
-    return template[task]
\ No newline at end of file
+def generate_prompt(task, language, code, start_line=1, canonical=False):
+    # 代码是大文件中的一个分块时，提示模型按原文件行号标注位置
+    if start_line > 1:
+        code_note = f"（以下代码片段从原文件第{start_line}行开始，标注行号时请按原文件计算）"
+    else:
+        code_note = ""
+    if canonical:
+        # 计算缓存键用的提示词；模型的输出会标注行号，指纹保留代码的行结构
+        return prompt_registry.render_canonical(f"augment.{task}", keep_lines=True, language=language, code=code,
+                                                code_note=code_note)
+    return prompt_registry.render(f"augment.{task}", language=language, code=code, code_note=code_note)
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Generator, Optional
+
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ai_codelab", "llm_cache.sqlite3")
+
+
+class ResponseCache:
+    """
+    大模型响应的两级缓存：内存LRU + 磁盘SQLite
+
+    缓存键由提供商、模型、合并后的模型参数和消息列表计算得到（内容寻址），
+    相同请求的重复点击直接从缓存回放，不再请求提供商。
+
+    配置（构造参数优先，其次环境变量）：
+        AI_CODELAB_LLM_CACHE_DB: SQLite文件路径，设置为空字符串时只使用内存缓存
+        AI_CODELAB_LLM_CACHE_TTL: 磁盘缓存的有效期（秒），默认7天
+        AI_CODELAB_LLM_CACHE_MAX_BYTES: 磁盘缓存的总大小上限，默认64MB
+
+    在事件循环中应使用 aget/aput：启用磁盘缓存时SQLite的查询和提交在工作线程中执行，不阻塞同一循环上的其他流
+    """
+
+    def __init__(self, max_entries: int = 256, db_path: Optional[str] = None, ttl: Optional[float] = None,
+                 max_db_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl if ttl is not None else float(os.getenv("AI_CODELAB_LLM_CACHE_TTL", 7 * 24 * 3600))
+        self.max_db_bytes = max_db_bytes if max_db_bytes is not None else int(
+            os.getenv("AI_CODELAB_LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+        if db_path is None:
+            db_path = os.getenv("AI_CODELAB_LLM_CACHE_DB", DEFAULT_DB_PATH)
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, created)
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(provider: str, request: dict) -> str:
+        """
+        计算请求的缓存键
+        Args:
+            provider: 提供商名称
+            request: 传给chat.completions.create的参数，包含model、messages及合并后的模型参数
+        Returns:
+            str: sha256十六进制摘要
+        """
+        # stream和timeout不影响响应内容，不参与计算
+        payload = {k: v for k, v in request.items() if k not in ("stream", "timeout")}
+        payload["provider"] = provider
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        查询缓存，先查内存再查磁盘，磁盘命中的结果会提升到内存
+        Returns:
+            Optional[str]: 缓存的完整响应文本，未命中或已过期时返回None
+        """
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None and now - item[1] <= self.ttl:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return item[0]
+            if item is not None:
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[0], row[1])
+                    self._stats["disk_hits"] += 1
+                    return row[0]
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, value: str):
+        """写入缓存，同时写入内存和磁盘，写入后按总大小淘汰最久未访问的磁盘条目"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._stats["stores"] += 1
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self._evict_disk(now)
+            self._db.commit()
+
+    async def aget(self, key: str) -> Optional[str]:
+        """get的异步版本"""
+        if self._db is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, value: str):
+        """put的异步版本"""
+        if self._db is None:
+            self.put(key, value)
+            return
+        await asyncio.to_thread(self.put, key, value)
+
+    def _remember(self, key: str, value: str, created: float):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now: float):
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_db_bytes:
+            return
+        rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+        for key, size in rows:
+            if total <= self.max_db_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        """获取缓存命中统计"""
+        with self._lock:
+            result = dict(self._stats)
+            result["memory_entries"] = len(self._memory)
+            return result
+
+    def clear(self):
+        """清空内存和磁盘缓存"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    @staticmethod
+    def replay(value: str, chunk_size: int = 16) -> Generator[str, None, None]:
+        """
+        将缓存的完整响应切分为片段回放，使缓存命中时的界面表现与真实流式输出一致
+        """
+        for i in range(0, len(value), chunk_size):
+            yield value[i:i + chunk_size]
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> ResponseCache:
+    """获取进程内共享的默认缓存实例，首次调用时创建"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
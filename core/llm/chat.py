@@ -1,13 +1,83 @@
+import asyncio
 import os
 import time
-import gradio as gr
-from openai import OpenAI
-from typing import Generator, Optional
+from typing import TYPE_CHECKING, AsyncGenerator, Generator, List, Optional, Tuple
+from core.canonical import normalization_stats
+from core.llm.cache import ResponseCache, get_default_cache
+from core.llm.client_pool import ClientRegistry, client_registry
+from core.llm.fanout import FanOutEvent, ModelLatencyStats, model_latency_stats
+from core.llm.ratelimit import RateLimiter, RateLimitExceeded, rate_limiter, retry_after_seconds
+from core.llm.router import ProviderRouter, provider_router
+from core.llm.stream import StreamAccumulator, aframes, frame_policy, frames
+from core.metrics import LLM_CONNECT_SECONDS, StreamObserver
+
+if TYPE_CHECKING:
+    import gradio as gr
+    # openai在ClientRegistry第一次创建客户端时才导入，缩短启动时间
+    from openai import AsyncOpenAI, OpenAI
+
+class _OpenedStream:
+    """
+    已经建立的一次流式响应，stream_chat和astream_chat共用：
+    统计输出片段、拼接完整响应，结束时记录指标并释放限流名额
+    """
+
+    def __init__(self, opened: tuple, feature: Optional[str]):
+        self.response, self.iterator, self.first, ttft, self.permit, provider, model = opened
+        self.observer = StreamObserver(provider, model, feature, ttft)
+        self.pieces = []
+        self.completed = False
+
+    def add(self, content: Optional[str]) -> Optional[str]:
+        """记录一个文本增量，空片段返回None"""
+        if not content:
+            return None
+        self.observer.token()
+        self.pieces.append(content)
+        return content
+
+    def add_chunk(self, chunk) -> Optional[str]:
+        return self.add(ChatClient._chunk_content(chunk))
+
+    def finish(self, limiter: RateLimiter):
+        """响应关闭后调用，只有完整结束的响应才计为成功"""
+        self.observer.finish()
+        limiter.release(self.permit, self.observer.tokens, success=self.completed)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.pieces)
+
 
 class ChatClient:
     """聊天客户端类，用于管理不同提供商的API调用"""
     
-    def __init__(self):
+    def __init__(self, registry: Optional[ClientRegistry] = None, cache: Optional[ResponseCache] = None,
+                 cache_features: Optional[set] = None, cache_max_temperature: float = 0.7,
+                 router: Optional[ProviderRouter] = None, hedge: Optional[bool] = None,
+                 limiter: Optional[RateLimiter] = None):
+        # 默认使用进程内共享的客户端注册表，所有ChatClient实例复用同一组连接池
+        self.registry = registry or client_registry
+
+        # 路由器：在提供等价模型的提供商之间按健康程度选择，失败时自动切换
+        # hedge开启时（或设置环境变量 AI_CODELAB_LLM_HEDGE=1），异步接口在首字超过p95时限时向下一个提供商发起对冲请求
+        self.router = router or provider_router
+        self.hedge = hedge if hedge is not None else os.getenv("AI_CODELAB_LLM_HEDGE", "0") == "1"
+
+        # 限流器：按提供商和模型的RPM/TPM令牌桶与自适应并发控制请求，收到429时按Retry-After排队重试
+        self.rate_limiter = limiter or rate_limiter
+
+        # 多模型并发请求时记录的各模型TTFT和输出速度
+        self.latency_stats: ModelLatencyStats = model_latency_stats
+
+        # 响应缓存：只对cache_features中的功能生效，temperature高于cache_max_temperature的请求不走缓存
+        # 设置环境变量 AI_CODELAB_LLM_CACHE=0 可整体关闭
+        self._cache = cache
+        self.cache_enabled = os.getenv("AI_CODELAB_LLM_CACHE", "1") != "0"
+        self.cache_features = cache_features if cache_features is not None else {
+            "explain", "comment", "augment", "testcase"
+        }
+        self.cache_max_temperature = cache_max_temperature
         self.providers = {
             "gitee": {
                 "base_url": "https://ai.gitee.com/v1",
@@ -46,9 +116,9 @@ class ChatClient:
         }
 
 
-    def create_client(self, provider: str) -> OpenAI:
+    def create_client(self, provider: str) -> "OpenAI":
         """
-        根据提供商创建对应的API客户端
+        根据提供商获取对应的API客户端，同一提供商的客户端在进程内共享
         Args:
             provider: 提供商名称 ('gitee', 'aliyuncs')，见上方__init__
         Returns:
@@ -56,6 +126,32 @@ class ChatClient:
 
         注意：gitee 和 aliyuncs 的api_key 环境变量是不同的，需要分别设置
         """
+        provider_config, api_key = self._provider_credentials(provider)
+        return self.registry.get_client(
+            provider,
+            base_url=provider_config["base_url"],
+            api_key=api_key,
+            headers=provider_config["headers"]
+        )
+
+    def create_async_client(self, provider: str) -> "AsyncOpenAI":
+        """
+        根据提供商获取对应的异步API客户端，同一提供商的客户端在进程内共享
+        Args:
+            provider: 提供商名称 ('gitee', 'aliyuncs')，见上方__init__
+        Returns:
+            AsyncOpenAI: 配置好的异步API客户端实例
+        """
+        provider_config, api_key = self._provider_credentials(provider)
+        return self.registry.get_async_client(
+            provider,
+            base_url=provider_config["base_url"],
+            api_key=api_key,
+            headers=provider_config["headers"]
+        )
+
+    def _provider_credentials(self, provider: str) -> tuple:
+        """获取提供商的配置和api_key，create_client和create_async_client共用"""
         if provider not in self.providers:
             raise ValueError(f"不支持的提供商: {provider}")
             
@@ -75,28 +171,15 @@ class ChatClient:
         
         if api_key is None:
             raise ValueError(f"未设置{provider}的API密钥")
-        
-        return OpenAI(
-            base_url=provider_config["base_url"],
-            api_key=api_key,
-            default_headers=provider_config["headers"]
-        )
 
-    def stream_chat(self, provider: str, model: str, context: list, **kwargs) -> Generator[str, None, None]:
+        return provider_config, api_key
+
+    def _build_request(self, model: str, context: list, kwargs: dict) -> dict:
         """
-        生成聊天响应的流式输出
-        Args:
-            provider: 提供商名称
-            model: 模型名称
-            context: 完整的消息上下文列表，格式为 [{"role": "user", "content": "消息内容"}, ...]
-            **kwargs: 其他模型参数，会覆盖默认参数
-        Yields:
-            str: 响应片段
+        校验上下文并合并模型参数，返回传给chat.completions.create的参数，同步和异步接口共用
         """
         if model not in self.model_params:
             raise ValueError(f"不支持的模型: {model}")
-        
-        client = self.create_client(provider)
 
         # 检查用户的context是否合法
         for message in context:
@@ -110,36 +193,359 @@ class ChatClient:
         # 获取默认参数并更新自定义参数
         params = self.model_params.get(model, {}).copy()
         params.update(kwargs)
-        
-        response = client.chat.completions.create(
-            model=model,
-            messages=context,
-            stream=True,
-            timeout=60,
-            **params
-        )
-        for chunk in response:
-            data = chunk.model_dump() if hasattr(chunk, "model_dump") else chunk
-            if "choices" in data and len(data["choices"]) > 0:
-                delta = data["choices"][0].get("delta", {})
-                content = delta.get("content")
+
+        return dict(model=model, messages=context, stream=True, timeout=60, **params)
+
+    @property
+    def cache(self) -> ResponseCache:
+        if self._cache is None:
+            self._cache = get_default_cache()
+        return self._cache
+
+    def _cache_key(self, provider: str, request: dict, feature: Optional[str],
+                   cache_context: Optional[list] = None) -> Optional[str]:
+        """
+        判断请求是否走缓存，走缓存时返回缓存键，否则返回None
+        cache_context不为None时用它代替请求中的消息计算缓存键
+        """
+        if not self.cache_enabled or feature not in self.cache_features:
+            return None
+        if request.get("temperature", 0) > self.cache_max_temperature:
+            return None
+        if cache_context is not None:
+            request = dict(request, messages=cache_context)
+        return ResponseCache.make_key(provider, request)
+
+    def _prepare(self, provider: str, model: str, context: list, feature: Optional[str],
+                 cache_context: Optional[list], kwargs: dict) -> tuple:
+        """构造请求参数并计算缓存键，返回 (请求参数, 缓存键或None)"""
+        request = self._build_request(model, context, kwargs)
+        return request, self._cache_key(provider, request, feature, cache_context)
+
+    def _cache_get(self, cache_key: str, provider: str, request: dict, cache_context: Optional[list]) -> Optional[str]:
+        """查询响应缓存，使用规范化的缓存键时统计规范化带来的额外命中（见 core.canonical）"""
+        cached = self.cache.get(cache_key)
+        self._record_lookup(cache_key, provider, request, cache_context, cached is not None)
+        return cached
+
+    async def _acache_get(self, cache_key: str, provider: str, request: dict,
+                          cache_context: Optional[list]) -> Optional[str]:
+        """_cache_get的异步版本，SQLite查询不阻塞事件循环"""
+        cached = await self.cache.aget(cache_key)
+        self._record_lookup(cache_key, provider, request, cache_context, cached is not None)
+        return cached
+
+    @staticmethod
+    def _record_lookup(cache_key: str, provider: str, request: dict, cache_context: Optional[list], hit: bool):
+        if cache_context is not None:
+            normalization_stats.record("llm", cache_key, ResponseCache.make_key(provider, request), hit)
+
+    @staticmethod
+    def _chunk_content(chunk) -> Optional[str]:
+        """从流式响应的一个chunk中取出文本增量，没有内容时返回None"""
+        data = chunk.model_dump() if hasattr(chunk, "model_dump") else chunk
+        if "choices" in data and len(data["choices"]) > 0:
+            delta = data["choices"][0].get("delta", {})
+            return delta.get("content")
+        return None
+
+    def _open_failed(self, permit, error: BaseException):
+        """
+        发起请求失败时调用：提供商返回429则按Retry-After记录等待后返回，由调用方重试；
+        其他错误释放限流名额后重新抛出
+        """
+        retry_after = retry_after_seconds(error)
+        if retry_after is None:
+            self.rate_limiter.release(permit, 0, success=False)
+            raise error
+        self.rate_limiter.throttled(permit, retry_after)
+
+    def _route_failed(self, provider: str, model: str, error: Exception):
+        # 被限流不代表端点不健康，不计入路由器的失败统计，直接尝试下一个端点
+        if not isinstance(error, RateLimitExceeded):
+            self.router.record_failure(provider, model)
+
+    def _route_opened(self, provider: str, model: str, opened: tuple) -> tuple:
+        self.router.record_success(provider, model, opened[3])
+        return opened + (provider, model)
+
+    def _has_api_key(self, provider: str) -> bool:
+        try:
+            self._provider_credentials(provider)
+        except ValueError:
+            return False
+        return True
+
+    def _routable_candidates(self, provider: str, model: str) -> list:
+        """由路由器给出候选端点，跳过未配置API密钥的备选提供商"""
+        candidates = [
+            (endpoint_provider, endpoint_model)
+            for endpoint_provider, endpoint_model in self.router.candidates(provider, model)
+            if endpoint_provider == provider or self._has_api_key(endpoint_provider)
+        ]
+        return candidates or [(provider, model)]
+
+    def _open_stream(self, provider: str, request: dict) -> tuple:
+        """
+        占用限流名额后发起流式请求，读取到第一个非空片段为止；
+        提供商返回429时按Retry-After等待后重试，总等待时间不超过限流器的max_wait
+        Returns:
+            tuple: (响应对象, chunk迭代器, 第一个片段, TTFT秒数, 限流名额)
+        """
+        model = request["model"]
+        tokens = self.rate_limiter.request_tokens(provider, model, request)
+        deadline = time.monotonic() + self.rate_limiter.max_wait
+        while True:
+            permit = self.rate_limiter.acquire(provider, model, *tokens, deadline=deadline)
+            start = time.monotonic()
+            try:
+                response = self.create_client(provider).chat.completions.create(**request)
+            except BaseException as e:
+                self._open_failed(permit, e)
+                continue
+            LLM_CONNECT_SECONDS.labels(provider, model).observe(time.monotonic() - start)
+            iterator = iter(response)
+            try:
+                for chunk in iterator:
+                    content = self._chunk_content(chunk)
+                    if content:
+                        return response, iterator, content, time.monotonic() - start, permit
+            except BaseException:
+                response.close()
+                self.rate_limiter.release(permit, 0, success=False)
+                raise
+            return response, iterator, "", time.monotonic() - start, permit
+
+    async def _aopen_stream(self, provider: str, request: dict) -> tuple:
+        """_open_stream的异步版本"""
+        model = request["model"]
+        tokens = self.rate_limiter.request_tokens(provider, model, request)
+        deadline = time.monotonic() + self.rate_limiter.max_wait
+        while True:
+            permit = await self.rate_limiter.aacquire(provider, model, *tokens, deadline=deadline)
+            start = time.monotonic()
+            try:
+                response = await self.create_async_client(provider).chat.completions.create(**request)
+            except BaseException as e:
+                self._open_failed(permit, e)
+                continue
+            LLM_CONNECT_SECONDS.labels(provider, model).observe(time.monotonic() - start)
+            iterator = response.__aiter__()
+            try:
+                async for chunk in iterator:
+                    content = self._chunk_content(chunk)
+                    if content:
+                        return response, iterator, content, time.monotonic() - start, permit
+            except BaseException:
+                await response.close()
+                self.rate_limiter.release(permit, 0, success=False)
+                raise
+            return response, iterator, "", time.monotonic() - start, permit
+
+    def _open_routed(self, provider: str, model: str, request: dict) -> tuple:
+        """
+        按路由器给出的顺序依次尝试各端点，收到首个片段前失败则切换到下一个端点
+        Returns:
+            tuple: (响应对象, chunk迭代器, 第一个片段, TTFT秒数, 限流名额, 实际提供商, 实际模型)
+        """
+        last_error = None
+        for endpoint_provider, endpoint_model in self._routable_candidates(provider, model):
+            try:
+                opened = self._open_stream(endpoint_provider, dict(request, model=endpoint_model))
+            except Exception as e:
+                self._route_failed(endpoint_provider, endpoint_model, e)
+                last_error = e
+                continue
+            return self._route_opened(endpoint_provider, endpoint_model, opened)
+        raise last_error
+
+    async def _aopen_routed(self, provider: str, model: str, request: dict) -> tuple:
+        """
+        _open_routed的异步版本，额外支持对冲：开启hedge且首个端点在p95时限内没有返回首字时，
+        同时向下一个端点发起请求，先返回首字的一方胜出，另一方立即取消并关闭连接
+        Returns:
+            tuple: 同_open_routed
+        """
+        candidates = self._routable_candidates(provider, model)
+        deadline = None
+        if self.hedge and len(candidates) > 1:
+            deadline = self.router.hedge_deadline(*candidates[0])
+
+        running = {}
+        last_error = None
+
+        def launch():
+            endpoint_provider, endpoint_model = candidates.pop(0)
+            task = asyncio.ensure_future(self._aopen_stream(endpoint_provider, dict(request, model=endpoint_model)))
+            running[task] = (endpoint_provider, endpoint_model)
+
+        try:
+            while candidates or running:
+                if not running:
+                    launch()
+                hedging = deadline is not None and candidates and len(running) == 1
+                done, _ = await asyncio.wait(running, timeout=deadline if hedging else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()
+                    continue
+                for task in done:
+                    endpoint_provider, endpoint_model = running.pop(task)
+                    try:
+                        opened = task.result()
+                    except Exception as e:
+                        self._route_failed(endpoint_provider, endpoint_model, e)
+                        last_error = e
+                        continue
+                    return self._route_opened(endpoint_provider, endpoint_model, opened)
+            raise last_error
+        finally:
+            # 取消对冲中落败的请求，已经建立的流立即关闭
+            for task in running:
+                task.cancel()
+            for result in await asyncio.gather(*running, return_exceptions=True):
+                if isinstance(result, tuple):
+                    await result[0].close()
+                    self.rate_limiter.release(result[4], 0, success=False)
+
+    def stream_chat(self, provider: str, model: str, context: list, feature: Optional[str] = None,
+                    cache_context: Optional[list] = None, **kwargs) -> Generator[str, None, None]:
+        """
+        生成聊天响应的流式输出
+        Args:
+            provider: 提供商名称
+            model: 模型名称
+            context: 完整的消息上下文列表，格式为 [{"role": "user", "content": "消息内容"}, ...]
+            feature: 调用方的功能名称（如 "explain"），在cache_features中时启用响应缓存
+            cache_context: 计算缓存键时代替context的消息列表，通常是把代码替换为规范化指纹的提示词
+                （见 PromptRegistry.render_canonical），使只有格式不同的代码命中同一个缓存
+            **kwargs: 其他模型参数，会覆盖默认参数
+        Yields:
+            str: 响应片段
+
+        注意：provider只是首选提供商，实际请求由路由器在提供等价模型的提供商之间选择，
+        收到首个片段前失败会自动切换到下一个提供商
+        """
+        request, cache_key = self._prepare(provider, model, context, feature, cache_context, kwargs)
+        if cache_key is not None:
+            cached = self._cache_get(cache_key, provider, request, cache_context)
+            if cached is not None:
+                yield from ResponseCache.replay(cached)
+                return
+
+        stream = _OpenedStream(self._open_routed(provider, model, request), feature)
+        try:
+            if stream.add(stream.first):
+                yield stream.first
+            for chunk in stream.iterator:
+                content = stream.add_chunk(chunk)
                 if content:
                     # 流式输出
                     yield content
+            stream.completed = True
+        finally:
+            stream.response.close()
+            stream.finish(self.rate_limiter)
+
+        # 只缓存完整结束的响应
+        if cache_key is not None:
+            self.cache.put(cache_key, stream.text)
 
         # 模拟输出（测试用）
         # for i in range(10):
         #     yield f"Chunk {i}"
         #     time.sleep(0.1)
 
+    async def astream_chat(self, provider: str, model: str, context: list, feature: Optional[str] = None,
+                           cache_context: Optional[list] = None, **kwargs) -> AsyncGenerator[str, None]:
+        """
+        stream_chat的异步版本，基于AsyncOpenAI，适合在Gradio的事件循环中直接使用，
+        流式输出期间不占用工作线程。参数和输出与stream_chat相同
+        Yields:
+            str: 响应片段
+        """
+        request, cache_key = self._prepare(provider, model, context, feature, cache_context, kwargs)
+        if cache_key is not None:
+            cached = await self._acache_get(cache_key, provider, request, cache_context)
+            if cached is not None:
+                for piece in ResponseCache.replay(cached):
+                    yield piece
+                return
+
+        stream = _OpenedStream(await self._aopen_routed(provider, model, request), feature)
+        try:
+            if stream.add(stream.first):
+                yield stream.first
+            async for chunk in stream.iterator:
+                content = stream.add_chunk(chunk)
+                if content:
+                    yield content
+            stream.completed = True
+        finally:
+            await stream.response.close()
+            stream.finish(self.rate_limiter)
+
+        if cache_key is not None:
+            await self.cache.aput(cache_key, stream.text)
+
+    async def afan_out(self, targets: List[Tuple[str, str]], context: list, policy: str = "all",
+                       feature: Optional[str] = None, **kwargs) -> AsyncGenerator[FanOutEvent, None]:
+        """
+        把同一个上下文同时发送给多个模型，合并输出各模型的流式片段，便于并排比较
+        Args:
+            targets: [(提供商, 模型), ...]
+            context: 消息上下文，同stream_chat
+            policy: "all" 等待所有模型完成；"first" 第一个完成的模型胜出，其余请求立即取消
+            feature: 功能名称，用于缓存和按功能统计各模型的TTFT与tokens/s
+            **kwargs: 其他模型参数，同stream_chat
+        Yields:
+            FanOutEvent: 各模型的片段、结束或错误事件，按到达顺序输出
+        """
+        if policy not in ("all", "first"):
+            raise ValueError(f"不支持的策略: {policy}")
+        queue = asyncio.Queue()
+
+        async def pump(provider: str, model: str):
+            start = time.monotonic()
+            ttft = None
+            tokens = 0
+            try:
+                async for delta in self.astream_chat(provider, model, context, feature=feature, **kwargs):
+                    if ttft is None:
+                        ttft = time.monotonic() - start
+                    tokens += 1
+                    await queue.put(FanOutEvent(model, delta))
+            except Exception as e:
+                await queue.put(FanOutEvent(model, done=True, error=e))
+                return
+            if ttft is not None:
+                elapsed = time.monotonic() - start - ttft
+                self.latency_stats.record(feature, model, ttft, tokens / elapsed if elapsed > 0 else 0.0)
+            await queue.put(FanOutEvent(model, done=True))
+
+        tasks = [asyncio.ensure_future(pump(provider, model)) for provider, model in targets]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                event = await queue.get()
+                yield event
+                if event.done:
+                    remaining -= 1
+                    if policy == "first" and event.error is None:
+                        break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
 
 
 # 这个这是测试界面，方便各位查看使用案例
 class ChatUI:
     """聊天界面类，处理UI相关逻辑"""
     
-    def __init__(self):
-        self.chat_client = ChatClient()
+    def __init__(self, chat_client: Optional[ChatClient] = None):
+        self.chat_client = chat_client or ChatClient()
         # 添加模型到提供商的映射
         self.model_provider_map = {
             "DeepSeek-R1-Distill-Qwen-32B": "gitee",
@@ -148,15 +554,42 @@ class ChatUI:
             "qwen-turbo": "aliyuncs"
         }
 
-    def gradio_interface(self, model: str, user_input: str) -> Generator[str, None, None]:
+    def gradio_interface(self, model: str, user_input: str, feature: Optional[str] = None) -> Generator[str, None, None]:
         """
         Gradio接口函数，处理用户输入并返回流式响应
         Args:
             model: 选择的模型名称
             user_input: 用户输入的文本
+            feature: 调用方的功能名称，用于决定是否启用响应缓存
         Returns:
             Generator[str, None, None]: 生成器，用于流式输出响应
         """
+        provider, context = self._prepare(model, user_input)
+        accumulator = StreamAccumulator()
+        # 按帧合并增量，每帧才输出一次完整文本
+        stream = self.chat_client.stream_chat(provider, model, context, feature=feature)
+        for _ in accumulator.consume(frames(stream, frame_policy("text"))):
+            yield accumulator.text
+
+    async def agradio_interface(self, model: str, user_input: str,
+                                feature: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """
+        gradio_interface的异步版本，基于astream_chat，流式输出期间不占用工作线程
+        Args:
+            model: 选择的模型名称
+            user_input: 用户输入的文本
+            feature: 调用方的功能名称，用于决定是否启用响应缓存
+        Returns:
+            AsyncGenerator[str, None]: 异步生成器，用于流式输出响应
+        """
+        provider, context = self._prepare(model, user_input)
+        accumulator = StreamAccumulator()
+        stream = self.chat_client.astream_chat(provider, model, context, feature=feature)
+        async for _ in accumulator.aconsume(aframes(stream, frame_policy("text"))):
+            yield accumulator.text
+
+    def _prepare(self, model: str, user_input: str) -> tuple:
+        """校验输入，返回模型对应的提供商和消息上下文"""
         if not user_input.strip():
             raise ValueError("输入不能为空")
         
@@ -166,15 +599,15 @@ class ChatUI:
             raise ValueError(f"不支持的模型: {model}")
             
         context = [{"role": "user", "content": user_input}]
-        response = ""
-        for chunk in self.chat_client.stream_chat(provider, model, context):
-            response += chunk
-            yield response
+        return provider, context
 
-    def create_interface(self) -> gr.Blocks:
+    def create_interface(self) -> "gr.Blocks":
         """
         创建Gradio界面
         """
+        # 只有测试界面需要gradio，ChatClient本身不依赖界面框架
+        import gradio as gr
+
         with gr.Blocks() as demo:
             model = gr.Dropdown(
                 choices=list(self.model_provider_map.keys()),
@@ -189,7 +622,7 @@ class ChatUI:
             submit_btn = gr.Button("发送")
 
             submit_btn.click(
-                fn=self.gradio_interface,
+                fn=self.agradio_interface,
                 inputs=[model, user_input],
                 outputs=response
             )
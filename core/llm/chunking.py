@@ -0,0 +1,177 @@
+import ast
+import asyncio
+import os
+from typing import AsyncGenerator, List, NamedTuple, Optional, Tuple
+
+from core.llm.stream import StreamAccumulator
+
+# 单个分块的最大字符数，超过该长度的代码会被拆成多个分块分别请求
+DEFAULT_MAX_CHARS = int(os.getenv("AI_CODELAB_LLM_CHUNK_CHARS", 6000))
+# 分块请求的最大并发数
+DEFAULT_CONCURRENCY = int(os.getenv("AI_CODELAB_LLM_MAP_CONCURRENCY", 4))
+
+# 使用花括号划分代码块的语言（名称与Interface._lang_map的键相同）
+_BRACE_LANGUAGES = {"C", "C++", "Go", "Java", "Rust", "JavaScript", "TypeScript", "PHP", "CSS", "SCSS"}
+
+
+class CodeChunk(NamedTuple):
+    """代码分块，start_line和end_line为在原代码中的行号（从1开始，包含两端）"""
+    start_line: int
+    end_line: int
+    text: str
+
+
+def split_code(code: str, language: str, max_chars: int = DEFAULT_MAX_CHARS) -> List[CodeChunk]:
+    """
+    在函数/类边界处把代码切分为若干分块，每个分块不超过max_chars（单个超长的顶层定义会在空行或按行强制切开）
+    Args:
+        code: 完整代码
+        language: 编程语言名称（与界面上的文本相同）
+        max_chars: 单个分块的最大字符数
+    Returns:
+        List[CodeChunk]: 按原顺序排列的分块，代码不超过max_chars时只有一个分块
+    """
+    lines = code.splitlines(keepends=True)
+    if len(code) <= max_chars:
+        return [CodeChunk(1, max(len(lines), 1), code)]
+
+    if language == "Python":
+        boundaries = _python_boundaries(code, lines)
+    elif language in _BRACE_LANGUAGES:
+        boundaries = _brace_boundaries(lines)
+    else:
+        boundaries = _indent_boundaries(lines)
+
+    # 按边界切成顶层片段，再把相邻片段合并到不超过max_chars
+    starts = sorted({0, *boundaries})
+    pieces = []
+    for index, start in enumerate(starts):
+        end = starts[index + 1] if index + 1 < len(starts) else len(lines)
+        if start < end:
+            pieces.extend(_split_oversized(lines, start, end, max_chars))
+
+    chunks = []
+    chunk_start, chunk_end, size = None, None, 0
+    for start, end in pieces:
+        piece_size = sum(len(line) for line in lines[start:end])
+        if chunk_start is not None and size + piece_size > max_chars:
+            chunks.append(_make_chunk(lines, chunk_start, chunk_end))
+            chunk_start, size = None, 0
+        if chunk_start is None:
+            chunk_start = start
+        chunk_end = end
+        size += piece_size
+    if chunk_start is not None:
+        chunks.append(_make_chunk(lines, chunk_start, chunk_end))
+    return chunks
+
+
+def _make_chunk(lines: List[str], start: int, end: int) -> CodeChunk:
+    return CodeChunk(start + 1, end, "".join(lines[start:end]))
+
+
+def _python_boundaries(code: str, lines: List[str]) -> List[int]:
+    """Python使用AST，在每个顶层语句（含装饰器）的起始行切分，语法错误时退回缩进规则"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return _indent_boundaries(lines)
+    boundaries = []
+    for node in tree.body:
+        decorators = getattr(node, "decorator_list", [])
+        start = min([node.lineno] + [decorator.lineno for decorator in decorators])
+        boundaries.append(start - 1)
+    return boundaries
+
+
+def _brace_boundaries(lines: List[str]) -> List[int]:
+    """花括号语言：在括号深度回到0的行之后切分（忽略字符串和//注释中的括号）"""
+    boundaries = []
+    depth = 0
+    for index, line in enumerate(lines):
+        before = depth
+        quote = None
+        i = 0
+        while i < len(line):
+            char = line[i]
+            if quote:
+                if char == "\\":
+                    i += 1
+                elif char == quote:
+                    quote = None
+            elif char in "\"'`":
+                quote = char
+            elif line.startswith("//", i):
+                break
+            elif char == "{":
+                depth += 1
+            elif char == "}":
+                depth = max(depth - 1, 0)
+            i += 1
+        if depth == 0 and (before > 0 or not line.strip()):
+            boundaries.append(index + 1)
+    return boundaries
+
+
+def _indent_boundaries(lines: List[str]) -> List[int]:
+    """其他语言：在空行之后、没有缩进的行处切分"""
+    boundaries = []
+    for index in range(1, len(lines)):
+        line = lines[index]
+        if line.strip() and not line[0].isspace() and not lines[index - 1].strip():
+            boundaries.append(index)
+    return boundaries
+
+
+def _split_oversized(lines: List[str], start: int, end: int, max_chars: int) -> List[Tuple[int, int]]:
+    """把超过max_chars的片段在空行处切开，仍然超长时按行切开"""
+    pieces = []
+    piece_start, size = start, 0
+    last_blank = None
+    for index in range(start, end):
+        size += len(lines[index])
+        if not lines[index].strip():
+            last_blank = index
+        if size > max_chars and index > piece_start:
+            cut = last_blank + 1 if last_blank is not None and last_blank >= piece_start else index
+            pieces.append((piece_start, cut))
+            piece_start = cut
+            size = sum(len(line) for line in lines[piece_start:index + 1])
+            last_blank = None
+    pieces.append((piece_start, end))
+    return pieces
+
+
+async def amap_chunks(chat_client, provider: str, model: str, prompts: List[str], feature: Optional[str] = None,
+                      concurrency: int = DEFAULT_CONCURRENCY) -> AsyncGenerator[Tuple[int, str], None]:
+    """
+    并发请求每个分块的提示词，按完成顺序输出结果
+    Args:
+        chat_client: ChatClient实例
+        provider: 提供商名称
+        model: 模型名称
+        prompts: 每个分块的提示词
+        feature: 功能名称，传给astream_chat用于缓存
+        concurrency: 最大并发请求数
+    Yields:
+        Tuple[int, str]: (分块序号, 该分块的完整响应)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index: int, prompt: str) -> Tuple[int, str]:
+        async with semaphore:
+            accumulator = StreamAccumulator()
+            context = [{"role": "user", "content": prompt}]
+            async for _ in accumulator.aconsume(chat_client.astream_chat(provider, model, context, feature=feature)):
+                pass
+            return index, accumulator.text
+
+    tasks = [asyncio.ensure_future(run(index, prompt)) for index, prompt in enumerate(prompts)]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        # 调用方提前结束或出错时取消尚未完成的请求，并等待它们关闭各自的流式响应
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,235 @@
+import asyncio
+import importlib.util
+import os
+import threading
+import weakref
+from typing import TYPE_CHECKING, Dict, Optional
+
+if TYPE_CHECKING:
+    # httpx和openai导入较慢，只在第一次创建客户端时导入，见 get_client
+    import httpx
+    from openai import AsyncOpenAI, OpenAI
+
+
+# 正在关闭的旧异步连接池，保持引用直到关闭完成
+_closing_tasks: set = set()
+
+
+def _close_async_pool(loop: Optional[asyncio.AbstractEventLoop], http_client: "httpx.AsyncClient"):
+    """在异步连接池所属的事件循环中关闭它，事件循环已关闭时交给垃圾回收"""
+    if loop is None or loop.is_closed():
+        return
+
+    def close():
+        task = loop.create_task(http_client.aclose())
+        _closing_tasks.add(task)
+        task.add_done_callback(_closing_tasks.discard)
+
+    try:
+        loop.call_soon_threadsafe(close)
+    except RuntimeError:
+        pass  # 事件循环在检查之后关闭
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class ClientRegistry:
+    """
+    进程级的API客户端注册表，按提供商复用长连接的OpenAI客户端
+
+    每个提供商只创建一次客户端及其底层httpx连接池，之后所有请求（无论来自哪个线程）
+    都复用同一个连接池，避免每次调用都重新进行DNS解析和TLS握手。
+    安装了h2包时自动启用HTTP/2。
+
+    连接池参数可以通过构造参数或环境变量配置：
+        AI_CODELAB_LLM_MAX_CONNECTIONS: 每个提供商的最大连接数，默认100
+        AI_CODELAB_LLM_MAX_KEEPALIVE: 每个提供商保持的最大空闲连接数，默认20
+        AI_CODELAB_LLM_KEEPALIVE_EXPIRY: 空闲连接的保持时间（秒），默认60
+    """
+
+    def __init__(self, max_connections: Optional[int] = None, max_keepalive_connections: Optional[int] = None,
+                 keepalive_expiry: Optional[float] = None, http2: Optional[bool] = None):
+        self.max_connections = max_connections or _env_int("AI_CODELAB_LLM_MAX_CONNECTIONS", 100)
+        self.max_keepalive_connections = max_keepalive_connections or _env_int("AI_CODELAB_LLM_MAX_KEEPALIVE", 20)
+        self.keepalive_expiry = keepalive_expiry or _env_float("AI_CODELAB_LLM_KEEPALIVE_EXPIRY", 60.0)
+        if http2 is None:
+            http2 = importlib.util.find_spec("h2") is not None
+        self.http2 = http2
+
+        self._lock = threading.Lock()
+        self._clients: Dict[str, "OpenAI"] = {}
+        self._client_configs: Dict[str, tuple] = {}
+        self._async_clients: Dict[str, "AsyncOpenAI"] = {}
+        self._async_client_configs: Dict[str, tuple] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _limits(self) -> "httpx.Limits":
+        import httpx
+
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def _provider_stats(self, provider: str) -> Dict[str, int]:
+        if provider not in self._stats:
+            self._stats[provider] = {"clients_created": 0, "client_reuses": 0, "requests": 0}
+        return self._stats[provider]
+
+    def _request_hook(self, provider: str):
+        def hook(request: "httpx.Request"):
+            with self._lock:
+                self._provider_stats(provider)["requests"] += 1
+        return hook
+
+    def _async_request_hook(self, provider: str):
+        async def hook(request: "httpx.Request"):
+            with self._lock:
+                self._provider_stats(provider)["requests"] += 1
+        return hook
+
+    def get_client(self, provider: str, base_url: str, api_key: str, headers: dict) -> "OpenAI":
+        """
+        获取指定提供商的共享客户端，不存在时创建
+        Args:
+            provider: 提供商名称
+            base_url: API地址
+            api_key: API密钥
+            headers: 默认请求头
+        Returns:
+            OpenAI: 复用连接池的API客户端实例
+
+        注意：当同一提供商的base_url、api_key或headers发生变化时会创建新客户端，旧客户端见 _retire
+        """
+        config = (base_url, api_key, tuple(sorted(headers.items())))
+        with self._lock:
+            stats = self._provider_stats(provider)
+            client = self._clients.get(provider)
+            if client is not None and self._client_configs[provider] == config:
+                stats["client_reuses"] += 1
+                return client
+
+            import httpx
+            from openai import OpenAI
+            http_client = httpx.Client(
+                limits=self._limits(),
+                http2=self.http2,
+                event_hooks={"request": [self._request_hook(provider)]},
+            )
+            client = OpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                default_headers=headers,
+                http_client=http_client,
+            )
+            self._clients[provider] = client
+            self._client_configs[provider] = config
+            stats["clients_created"] += 1
+            self._retire(client, http_client.close)
+            return client
+
+    def get_async_client(self, provider: str, base_url: str, api_key: str, headers: dict) -> "AsyncOpenAI":
+        """
+        获取指定提供商的共享异步客户端，不存在时创建，参数同get_client
+        Returns:
+            AsyncOpenAI: 复用连接池的异步API客户端实例
+
+        注意：异步连接池绑定在创建它的事件循环上，应在同一个事件循环（如Gradio的事件循环）中使用
+        """
+        config = (base_url, api_key, tuple(sorted(headers.items())))
+        with self._lock:
+            stats = self._provider_stats(provider)
+            client = self._async_clients.get(provider)
+            if client is not None and self._async_client_configs[provider] == config:
+                stats["client_reuses"] += 1
+                return client
+
+            import httpx
+            from openai import AsyncOpenAI
+            http_client = httpx.AsyncClient(
+                limits=self._limits(),
+                http2=self.http2,
+                event_hooks={"request": [self._async_request_hook(provider)]},
+            )
+            client = AsyncOpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                default_headers=headers,
+                http_client=http_client,
+            )
+            self._async_clients[provider] = client
+            self._async_client_configs[provider] = config
+            stats["clients_created"] += 1
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            self._retire(client, _close_async_pool, loop, http_client)
+            return client
+
+    @staticmethod
+    def _retire(client, close, *args):
+        """
+        客户端被替换（提供商配置变化）后不立即关闭：流式响应持有客户端的引用，
+        其他线程或协程中还在进行的响应结束、客户端被垃圾回收时才关闭它的连接池
+        """
+        finalizer = weakref.finalize(client, close, *args)
+        # 进程退出时由close/aclose或操作系统回收连接
+        finalizer.atexit = False
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        获取各提供商连接池的统计信息
+        Returns:
+            dict: {provider: {"clients_created", "client_reuses", "requests", "open_connections", "idle_connections"}}
+        """
+        with self._lock:
+            result = {}
+            for provider, stats in self._stats.items():
+                item = dict(stats)
+                open_count, idle_count = self._connection_counts(self._clients.get(provider))
+                async_open, async_idle = self._connection_counts(self._async_clients.get(provider))
+                item["open_connections"] = open_count + async_open
+                item["idle_connections"] = idle_count + async_idle
+                result[provider] = item
+            return result
+
+    @staticmethod
+    def _connection_counts(client) -> tuple:
+        # httpx没有公开连接池状态，这里从底层httpcore连接池读取，读取失败时返回0
+        try:
+            connections = client._client._transport._pool.connections
+        except AttributeError:
+            return 0, 0
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return len(connections), idle
+
+    def close(self):
+        """关闭所有同步客户端及其连接池"""
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            self._client_configs.clear()
+
+    async def aclose(self):
+        """关闭所有异步客户端及其连接池，需在创建它们的事件循环中调用"""
+        with self._lock:
+            clients = list(self._async_clients.values())
+            self._async_clients.clear()
+            self._async_client_configs.clear()
+        for client in clients:
+            await client.close()
+
+
+# 进程内共享的默认注册表
+client_registry = ClientRegistry()
@@ -0,0 +1,57 @@
+import threading
+from collections import defaultdict, deque
+from typing import Dict, NamedTuple, Optional
+
+
+class FanOutEvent(NamedTuple):
+    """
+    多模型并发请求中的一个事件
+    model: 事件所属的模型
+    delta: 新增的文本片段，没有时为空字符串
+    done: 该模型的响应是否已结束
+    error: 该模型请求失败时的异常
+    """
+    model: str
+    delta: str = ""
+    done: bool = False
+    error: Optional[BaseException] = None
+
+
+class ModelLatencyStats:
+    """
+    按功能和模型记录首字延迟（TTFT）和输出速度（tokens/s），用于比较各模型的延迟和性价比
+
+    token数按流式响应的片段数估计（多数提供商每个片段对应一个token）。
+    """
+
+    def __init__(self, window_size: int = 100):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=window_size))  # (feature, model) -> deque[(ttft, tps)]
+
+    def record(self, feature: Optional[str], model: str, ttft: float, tokens_per_second: float):
+        with self._lock:
+            self._samples[(feature or "", model)].append((ttft, tokens_per_second))
+
+    def summary(self, feature: Optional[str] = None) -> Dict[str, dict]:
+        """
+        获取统计摘要
+        Args:
+            feature: 只返回该功能的统计，为None时返回全部
+        Returns:
+            dict: {"feature/model": {"samples", "ttft_avg", "tokens_per_second_avg"}}
+        """
+        result = {}
+        with self._lock:
+            for (item_feature, model), samples in self._samples.items():
+                if feature is not None and item_feature != feature:
+                    continue
+                result[f"{item_feature}/{model}"] = {
+                    "samples": len(samples),
+                    "ttft_avg": sum(ttft for ttft, _ in samples) / len(samples),
+                    "tokens_per_second_avg": sum(tps for _, tps in samples) / len(samples),
+                }
+        return result
+
+
+# 进程内共享的默认统计
+model_latency_stats = ModelLatencyStats()
@@ -0,0 +1,193 @@
+import re
+import string
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from core.canonical import fingerprint
+from core.metrics import PROMPT_BUILD_SECONDS
+
+try:
+    import tiktoken
+except ImportError:  # 没有安装tiktoken时按字符类型估算token数
+    tiktoken = None
+
+_CJK = re.compile(r"[　-〿㐀-鿿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数：安装了tiktoken时使用cl100k_base编码，
+    否则按中文字符约1个token、其他字符约4个字符1个token估算
+    """
+    if tiktoken is not None:
+        return len(_encoding().encode(text))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+_encoding_cache = []
+
+
+def _encoding():
+    if not _encoding_cache:
+        _encoding_cache.append(tiktoken.get_encoding("cl100k_base"))
+    return _encoding_cache[0]
+
+
+class PromptTemplate:
+    """
+    提示词模板：静态前缀 + 动态后缀
+
+    前缀只包含固定的说明，所有请求逐字节相同，支持上下文缓存的提供商（如dashscope的qwen系列）可以复用前缀的计算结果；
+    编程语言、用户代码等会变化的内容都放在后缀中。
+    后缀在注册时解析为 (字面量, 字段名) 列表，渲染时只需按顺序拼接，不再重复解析格式字符串。
+    """
+
+    def __init__(self, name: str, feature: str, prefix: str, suffix: str):
+        self.name = name
+        self.feature = feature
+        self.prefix = prefix
+        self.prefix_tokens = estimate_tokens(prefix)
+        self._parts: List[Tuple[str, Optional[str]]] = [
+            (literal, field) for literal, field, _, _ in string.Formatter().parse(suffix)
+        ]
+        self.fields = {field for _, field in self._parts if field}
+
+    def render(self, **fields) -> str:
+        missing = self.fields - fields.keys()
+        if missing:
+            raise KeyError(f"提示词模板 {self.name} 缺少字段: {', '.join(sorted(missing))}")
+        pieces = [self.prefix]
+        for literal, field in self._parts:
+            pieces.append(literal)
+            if field:
+                pieces.append(str(fields[field]))
+        return "".join(pieces)
+
+
+class PromptRegistry:
+    """
+    集中管理所有提示词模板，渲染时记录构建耗时（见 core.metrics），并统计各模板的token数
+    """
+
+    def __init__(self):
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def register(self, name: str, feature: str, prefix: str, suffix: str) -> PromptTemplate:
+        template = PromptTemplate(name, feature, prefix, suffix)
+        self._templates[name] = template
+        self._stats[name] = {"renders": 0, "dynamic_chars": 0}
+        return template
+
+    def get(self, name: str) -> PromptTemplate:
+        if name not in self._templates:
+            raise KeyError(f"未注册的提示词模板: {name}")
+        return self._templates[name]
+
+    def render(self, name: str, **fields) -> str:
+        """
+        渲染提示词
+        Args:
+            name: 模板名称
+            **fields: 后缀中的字段，必须包含 language
+        Returns:
+            str: 完整提示词，以模板的静态前缀开头
+        """
+        template = self.get(name)
+        start = time.perf_counter()
+        prompt = template.render(**fields)
+        PROMPT_BUILD_SECONDS.labels(template.feature, fields.get("language", "")).observe(time.perf_counter() - start)
+        with self._lock:
+            stats = self._stats[name]
+            stats["renders"] += 1
+            stats["dynamic_chars"] += len(prompt) - len(template.prefix)
+        return prompt
+
+    def render_canonical(self, name: str, keep_lines: bool = False, **fields) -> str:
+        """
+        渲染用于计算响应缓存键的提示词（见 ChatClient.stream_chat 的 cache_context），不发送给模型
+        Args:
+            name: 模板名称
+            keep_lines: 指纹是否包含代码的行结构，模型的输出会引用行号时使用
+            **fields: 与render相同，code字段会被替换为代码的规范化指纹（见 core.canonical）
+        Returns:
+            str: 只有空白、注释等格式不同的代码得到相同结果的提示词
+        """
+        code = fingerprint(fields["language"], fields["code"], keep_lines)
+        return self.get(name).render(**dict(fields, code=f"<code sha256={code}>"))
+
+    def token_counts(self) -> Dict[str, dict]:
+        """
+        各模板的token统计
+        Returns:
+            dict: {模板名称: {"prefix_tokens", "prefix_chars", "renders", "avg_dynamic_chars"}}
+        """
+        with self._lock:
+            return {
+                name: {
+                    "prefix_tokens": template.prefix_tokens,
+                    "prefix_chars": len(template.prefix),
+                    "renders": self._stats[name]["renders"],
+                    "avg_dynamic_chars": self._stats[name]["dynamic_chars"] / self._stats[name]["renders"]
+                    if self._stats[name]["renders"] else 0,
+                }
+                for name, template in self._templates.items()
+            }
+
+
+_CODE_BLOCK_MARKER = "请确保代码被标记为代码块，并且其外部标记如下:\n<code> ... </code>\n"
+
+prompt_registry = PromptRegistry()
+
+prompt_registry.register(
+    "generate.describe", "generate",
+    prefix="根据下面给出的自然语言描述，生成相应的代码，并且使用特定的标记包裹代码部分。\n" + _CODE_BLOCK_MARKER,
+    suffix="\n编程语言: {language}\n以下是自然语言描述:\n{description}",
+)
+prompt_registry.register(
+    "generate.complete", "generate",
+    prefix="根据下面给出的自然语言描述和待补全的代码，生成完整的代码，并且使用特定的标记包裹代码部分。\n" + _CODE_BLOCK_MARKER,
+    suffix="\n编程语言: {language}\n以下是自然语言描述:\n{description}\n以下是待补全的代码:\n{code}",
+)
+prompt_registry.register(
+    "explain", "explain",
+    prefix="请解释以下代码。\n",
+    suffix="\n编程语言: {language}\n\n{code}",
+)
+prompt_registry.register(
+    "explain.chunk", "explain",
+    prefix="以下是一个较大代码文件中的一部分，请解释这部分代码。\n",
+    suffix="\n编程语言: {language}\n位置: 第{start_line}-{end_line}行（共{total}部分中的第{index}部分）\n\n{code}",
+)
+prompt_registry.register(
+    "explain.summary", "explain",
+    prefix="以下是一个代码文件各部分代码的解释，请据此总结整个文件的整体功能、结构以及各部分之间的关系。\n",
+    suffix="\n编程语言: {language}\n\n{body}",
+)
+prompt_registry.register(
+    "comment", "comment",
+    prefix="以下是一段代码，请为其生成符合开发规范的注释，注释内容应包括：\n"
+           "1. 每个函数的说明文档，描述其功能及输入输出参数，以下是一个格式示例：\n"
+           "\"\"\"\n"
+           "Gradio接口函数，处理用户输入并返回流式响应\n"
+           "Args:\n"
+           "    model: 选择的模型名称\n"
+           "    user_input: 用户输入的文本\n"
+           "Returns:\n"
+           "    Generator[str, None, None]: 生成器，用于流式输出响应\n"
+           "\"\"\"\n"
+           "2. 对于代码中的关键逻辑或复杂部分，添加必要的行内注释\n"
+           "注意保持用户给定的代码不变，并且使用特定的标记包裹代码部分。\n" + _CODE_BLOCK_MARKER,
+    suffix="\n编程语言: {language}\n以下是用户给出的代码：\n{code}",
+)
+prompt_registry.register(
+    "testcase", "testcase",
+    prefix="你是一位专业的软件测试工程师。请根据下面给出的代码编写测试用例（函数），覆盖主要功能和可能的边界情况；"
+           "仅输出测试的函数，供用户调用，不要额外解释。如果需要可以使用assert等测试函数。\n"
+           "最后把一定要输出测试用例、目标代码、调用测试用例的命令和通过测试的提醒！确保让用户可以直接运行。"
+           "所有都要用中文注释，但是通过的提醒需要用英文。\n",
+    suffix="\n编程语言: {language}\n目标代码:\n{code}",
+)
@@ -0,0 +1,364 @@
+import asyncio
+import email.utils
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from core.llm.prompts import estimate_tokens
+from core.metrics import LLM_THROTTLE_EVENTS, LLM_THROTTLE_WAIT_SECONDS
+
+# 等待并发名额时的重试间隔（秒）
+CONCURRENCY_POLL_INTERVAL = 0.05
+
+# 429响应没有Retry-After时的暂停时间（秒）
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class RateLimitExceeded(Exception):
+    """请求在限流队列中等待超时，或排队的请求已满"""
+
+
+class TokenBucket:
+    """
+    令牌桶：每分钟补充per_minute个令牌，最多积累per_minute个
+    """
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """获取amount个令牌需要等待的秒数，单次请求超过容量时按容量计算"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.per_minute
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD并发上限：每个成功请求使上限增加 1/上限（约每轮增加1），
+    收到429时减半，decrease_interval秒内只减一次，避免同一批并发请求的429把上限连续减半
+    """
+
+    def __init__(self, initial: float, maximum: float, minimum: float = 1.0, decrease_interval: float = 1.0):
+        self.limit = initial
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease_interval = decrease_interval
+        self.inflight = 0
+        self._last_decrease = 0.0
+
+    def available(self) -> bool:
+        return self.inflight < int(self.limit)
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttle(self, now: float):
+        if now - self._last_decrease >= self.decrease_interval:
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = now
+
+
+class _EndpointState:
+    def __init__(self, concurrency: AdaptiveConcurrency, rpm: Optional[float], tpm: Optional[float]):
+        self.concurrency = concurrency
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.paused_until = 0.0
+        self.waiters = 0
+        self.throttled = 0
+        self.rejected = 0
+
+
+class RatePermit:
+    """一次请求占用的限流名额，流式响应结束后交还给 RateLimiter.release"""
+    __slots__ = ("provider", "model", "reserved_output_tokens", "released")
+
+    def __init__(self, provider: str, model: str, reserved_output_tokens: int):
+        self.provider = provider
+        self.model = model
+        self.reserved_output_tokens = reserved_output_tokens
+        self.released = False
+
+
+def _parse_limits(value: str) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """解析 "gitee=60/100000,aliyuncs/qwen-max=1200/" 形式的配置，返回 {键: (rpm, tpm)}"""
+    limits = {}
+    for item in value.split(","):
+        if item.strip():
+            key, _, quota = item.partition("=")
+            rpm, _, tpm = quota.partition("/")
+            limits[key.strip()] = (float(rpm) if rpm.strip() else None, float(tpm) if tpm.strip() else None)
+    return limits
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """
+    如果异常是提供商返回的429，返回应等待的秒数（Retry-After，没有时为DEFAULT_RETRY_AFTER），否则返回None
+    """
+    if getattr(error, "status_code", None) != 429:
+        return None
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return DEFAULT_RETRY_AFTER
+
+
+class RateLimiter:
+    """
+    按提供商和模型限流
+
+    - 令牌桶：按请求数（RPM）和估算的token数（TPM）限流，提供商级和 提供商/模型 级可以分别配置，
+      通过环境变量 AI_CODELAB_LLM_RATE_LIMITS 配置，例如 "gitee=60/100000,aliyuncs/qwen-max=1200/"（RPM/TPM，可以省略其一）
+    - Retry-After：收到429后该模型暂停到Retry-After指定的时间，期间的请求排队等待而不是直接失败
+    - AIMD自适应并发：每个 提供商/模型 的并发上限在成功时缓慢增加，收到429时减半，自动收敛到提供商能承受的并发
+
+    请求最多等待max_wait秒，每个模型最多max_waiters个请求排队，超出时抛出RateLimitExceeded。
+    同步和异步接口共用同一份状态，可以在多个线程和事件循环中使用。
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+                 max_wait: Optional[float] = None, max_waiters: Optional[int] = None,
+                 initial_concurrency: Optional[float] = None, max_concurrency: Optional[float] = None):
+        self.limits = limits if limits is not None else _parse_limits(os.getenv("AI_CODELAB_LLM_RATE_LIMITS", ""))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("AI_CODELAB_LLM_RATE_MAX_WAIT", "10"))
+        self.max_waiters = max_waiters if max_waiters is not None else int(os.getenv("AI_CODELAB_LLM_RATE_QUEUE", "32"))
+        self.initial_concurrency = initial_concurrency or float(os.getenv("AI_CODELAB_LLM_CONCURRENCY", "16"))
+        self.max_concurrency = max_concurrency or float(os.getenv("AI_CODELAB_LLM_MAX_CONCURRENCY", "64"))
+
+        self._lock = threading.Lock()
+        self._endpoints: Dict[Tuple[str, str], _EndpointState] = {}
+        self._providers: Dict[str, _EndpointState] = {}
+        self._events = deque(maxlen=100)
+
+    def _endpoint(self, provider: str, model: str) -> _EndpointState:
+        key = (provider, model)
+        if key not in self._endpoints:
+            rpm, tpm = self.limits.get(f"{provider}/{model}", (None, None))
+            self._endpoints[key] = _EndpointState(
+                AdaptiveConcurrency(self.initial_concurrency, self.max_concurrency), rpm, tpm)
+        return self._endpoints[key]
+
+    def _provider(self, provider: str) -> _EndpointState:
+        if provider not in self._providers:
+            rpm, tpm = self.limits.get(provider, (None, None))
+            # 提供商级只使用令牌桶，并发上限按模型自适应
+            self._providers[provider] = _EndpointState(AdaptiveConcurrency(float("inf"), float("inf")), rpm, tpm)
+        return self._providers[provider]
+
+    def _try_acquire(self, provider: str, model: str, tokens: int) -> Tuple[float, str]:
+        """
+        尝试占用名额
+        Returns:
+            tuple: (需要等待的秒数, 原因)，等待秒数为0时已经占用成功
+        """
+        now = time.monotonic()
+        with self._lock:
+            endpoint = self._endpoint(provider, model)
+            if endpoint.paused_until > now:
+                return endpoint.paused_until - now, "retry_after"
+            if not endpoint.concurrency.available():
+                return CONCURRENCY_POLL_INTERVAL, "concurrency"
+            buckets = []
+            for state in (self._provider(provider), endpoint):
+                if state.requests is not None:
+                    buckets.append((state.requests, 1))
+                if state.tokens is not None:
+                    buckets.append((state.tokens, tokens))
+            delay = max((bucket.delay(amount, now) for bucket, amount in buckets), default=0.0)
+            if delay > 0:
+                return delay, "rate"
+            for bucket, amount in buckets:
+                bucket.take(amount)
+            endpoint.concurrency.inflight += 1
+            return 0.0, ""
+
+    def _enter_queue(self, provider: str, model: str):
+        with self._lock:
+            endpoint = self._endpoint(provider, model)
+            if endpoint.waiters >= self.max_waiters:
+                endpoint.rejected += 1
+                self._record_event(provider, model, "rejected")
+                raise RateLimitExceeded(f"{provider}/{model} 请求过多，排队已满，请稍后再试")
+            endpoint.waiters += 1
+
+    def _leave_queue(self, provider: str, model: str):
+        with self._lock:
+            self._endpoint(provider, model).waiters -= 1
+
+    def _timeout(self, provider: str, model: str, reason: str, delay: float):
+        with self._lock:
+            self._endpoint(provider, model).rejected += 1
+            self._record_event(provider, model, "rejected", reason=reason)
+        return RateLimitExceeded(f"{provider}/{model} 请求过于频繁，还需等待约{delay:.1f}秒，"
+                                 f"超过最长等待时间{self.max_wait:g}秒，请稍后再试")
+
+    def request_tokens(self, provider: str, model: str, request: dict) -> Tuple[int, int]:
+        """
+        估算请求的token数，没有配置TPM限制时不做估算
+        Returns:
+            tuple: (提示词token数, 最大输出token数)
+        """
+        if not any(self.limits.get(key, (None, None))[1] for key in (provider, f"{provider}/{model}")):
+            return 0, 0
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in request["messages"])
+        return prompt_tokens, request.get("max_tokens", 0)
+
+    def acquire(self, provider: str, model: str, prompt_tokens: int = 0, max_output_tokens: int = 0,
+                deadline: Optional[float] = None) -> RatePermit:
+        """
+        占用一次请求的名额，需要等待时阻塞当前线程
+        Args:
+            provider: 提供商名称
+            model: 该提供商上的模型名
+            prompt_tokens: 估算的提示词token数
+            max_output_tokens: 最大输出token数，先按此预留，响应结束后按实际输出退还多余部分
+            deadline: time.monotonic() 下的最晚等待时间，默认 max_wait 秒后
+        Returns:
+            RatePermit: 名额，流式响应结束后调用release交还
+        Raises:
+            RateLimitExceeded: 排队已满或等待超时
+        """
+        tokens = prompt_tokens + max_output_tokens
+        delay, reason = self._try_acquire(provider, model, tokens)
+        if delay == 0:
+            return RatePermit(provider, model, max_output_tokens)
+        deadline = deadline if deadline is not None else time.monotonic() + self.max_wait
+        start = time.monotonic()
+        self._enter_queue(provider, model)
+        try:
+            while delay > 0:
+                if time.monotonic() + delay > deadline:
+                    raise self._timeout(provider, model, reason, delay)
+                time.sleep(delay)
+                delay, next_reason = self._try_acquire(provider, model, tokens)
+                reason = next_reason or reason
+        finally:
+            self._leave_queue(provider, model)
+        LLM_THROTTLE_WAIT_SECONDS.labels(provider, model, reason).observe(time.monotonic() - start)
+        return RatePermit(provider, model, max_output_tokens)
+
+    async def aacquire(self, provider: str, model: str, prompt_tokens: int = 0, max_output_tokens: int = 0,
+                       deadline: Optional[float] = None) -> RatePermit:
+        """acquire的异步版本，等待期间不阻塞事件循环"""
+        tokens = prompt_tokens + max_output_tokens
+        delay, reason = self._try_acquire(provider, model, tokens)
+        if delay == 0:
+            return RatePermit(provider, model, max_output_tokens)
+        deadline = deadline if deadline is not None else time.monotonic() + self.max_wait
+        start = time.monotonic()
+        self._enter_queue(provider, model)
+        try:
+            while delay > 0:
+                if time.monotonic() + delay > deadline:
+                    raise self._timeout(provider, model, reason, delay)
+                await asyncio.sleep(delay)
+                delay, next_reason = self._try_acquire(provider, model, tokens)
+                reason = next_reason or reason
+        finally:
+            self._leave_queue(provider, model)
+        LLM_THROTTLE_WAIT_SECONDS.labels(provider, model, reason).observe(time.monotonic() - start)
+        return RatePermit(provider, model, max_output_tokens)
+
+    def release(self, permit: RatePermit, output_tokens: Optional[int] = None, success: bool = True):
+        """
+        交还名额
+        Args:
+            permit: acquire返回的名额
+            output_tokens: 实际输出的token数，少于预留时退还差额；None表示不退还
+            success: 请求是否成功完成，成功时增加自适应并发上限
+        """
+        if permit.released:
+            return
+        permit.released = True
+        with self._lock:
+            endpoint = self._endpoint(permit.provider, permit.model)
+            endpoint.concurrency.inflight -= 1
+            if success:
+                endpoint.concurrency.on_success()
+            unused = permit.reserved_output_tokens - output_tokens if output_tokens is not None else 0
+            if unused > 0:
+                for state in (self._provider(permit.provider), endpoint):
+                    if state.tokens is not None:
+                        state.tokens.refund(unused)
+
+    def throttled(self, permit: RatePermit, retry_after: float):
+        """
+        提供商返回429：交还名额（预留的输出token全部退还），暂停该模型到Retry-After之后，并把自适应并发上限减半
+        """
+        now = time.monotonic()
+        with self._lock:
+            endpoint = self._endpoint(permit.provider, permit.model)
+            endpoint.paused_until = max(endpoint.paused_until, now + retry_after)
+            endpoint.concurrency.on_throttle(now)
+            endpoint.throttled += 1
+            self._record_event(permit.provider, permit.model, "429", retry_after=retry_after)
+        self.release(permit, output_tokens=0, success=False)
+
+    def _record_event(self, provider: str, model: str, event: str, **details):
+        LLM_THROTTLE_EVENTS.labels(provider, model, event).inc()
+        self._events.append(dict(time=time.time(), provider=provider, model=model, event=event, **details))
+
+    def events(self) -> List[dict]:
+        """
+        最近的限流事件（最多100条）
+        Returns:
+            list: [{"time", "provider", "model", "event": "429"或"rejected", ...}]
+        """
+        with self._lock:
+            return list(self._events)
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        各 提供商/模型 的当前状态
+        Returns:
+            dict: {"provider/model": {"concurrency_limit", "inflight", "waiters", "paused_seconds", "throttled", "rejected"}}
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                f"{provider}/{model}": {
+                    "concurrency_limit": state.concurrency.limit,
+                    "inflight": state.concurrency.inflight,
+                    "waiters": state.waiters,
+                    "paused_seconds": max(0.0, state.paused_until - now),
+                    "throttled": state.throttled,
+                    "rejected": state.rejected,
+                }
+                for (provider, model), state in self._endpoints.items()
+            }
+
+
+# 进程内共享的默认限流器
+rate_limiter = RateLimiter()
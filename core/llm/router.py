@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+
+class ProviderRouter:
+    """
+    按延迟和错误率选择提供商的路由器
+
+    为每个 (提供商, 模型) 端点记录滚动窗口内的首字延迟（TTFT）和成功/失败情况，
+    请求时把提供等价模型的端点按健康程度排序，ChatClient 依次尝试，前一个失败时自动切换到下一个。
+    窗口内样本足够时，还可以给出基于 p95 TTFT 的对冲（hedge）时限。
+
+    等价模型在 endpoints 中配置：{模型名: [(提供商, 该提供商上的模型名), ...]}，
+    列表顺序即没有统计数据时的默认优先级。
+    """
+
+    def __init__(self, endpoints: Optional[Dict[str, List[Tuple[str, str]]]] = None, window_size: int = 50,
+                 window_seconds: float = 300.0, min_samples: int = 5, default_ttft: float = 2.0,
+                 error_penalty: float = 30.0):
+        self.endpoints = endpoints if endpoints is not None else {
+            "DeepSeek-R1-Distill-Qwen-32B": [
+                ("gitee", "DeepSeek-R1-Distill-Qwen-32B"),
+                ("aliyuncs", "deepseek-r1-distill-qwen-32b"),
+            ],
+            "qwen-max": [("aliyuncs", "qwen-max")],
+            "qwen-plus": [("aliyuncs", "qwen-plus")],
+            "qwen-turbo": [("aliyuncs", "qwen-turbo")],
+        }
+        self.window_size = window_size
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.default_ttft = default_ttft  # 没有统计数据的端点按此TTFT估计，保证新端点有机会被探测
+        self.error_penalty = error_penalty  # 错误率折算成的秒数，错误率为1时相当于TTFT增加该值
+
+        self._lock = threading.Lock()
+        self._samples: Dict[Tuple[str, str], deque] = {}  # (provider, model) -> deque[(时间, ttft或None)]
+
+    def _window(self, provider: str, model: str) -> deque:
+        key = (provider, model)
+        if key not in self._samples:
+            self._samples[key] = deque(maxlen=self.window_size)
+        samples = self._samples[key]
+        expire = time.monotonic() - self.window_seconds
+        while samples and samples[0][0] < expire:
+            samples.popleft()
+        return samples
+
+    def record_success(self, provider: str, model: str, ttft: float):
+        """
+        记录一次成功请求
+        Args:
+            provider: 提供商名称
+            model: 该提供商上的模型名
+            ttft: 首字延迟（秒）
+        """
+        with self._lock:
+            self._window(provider, model).append((time.monotonic(), ttft))
+
+    def record_failure(self, provider: str, model: str):
+        """记录一次失败请求（连接失败、超时、返回错误等）"""
+        with self._lock:
+            self._window(provider, model).append((time.monotonic(), None))
+
+    def _score(self, provider: str, model: str) -> float:
+        samples = self._window(provider, model)
+        if not samples:
+            return self.default_ttft
+        ttfts = sorted(ttft for _, ttft in samples if ttft is not None)
+        error_rate = 1 - len(ttfts) / len(samples)
+        median = ttfts[len(ttfts) // 2] if ttfts else self.default_ttft
+        return median + error_rate * self.error_penalty
+
+    def candidates(self, provider: str, model: str) -> List[Tuple[str, str]]:
+        """
+        获取可以处理该请求的端点，按健康程度从好到坏排序
+        Args:
+            provider: 调用方指定的提供商，分数相同时优先
+            model: 模型名称
+        Returns:
+            list: [(提供商, 该提供商上的模型名), ...]
+        """
+        endpoints = self.endpoints.get(model, [(provider, model)])
+        with self._lock:
+            scored = [
+                (self._score(p, m), p != provider, index, (p, m))
+                for index, (p, m) in enumerate(endpoints)
+            ]
+        return [endpoint for *_, endpoint in sorted(scored)]
+
+    def hedge_deadline(self, provider: str, model: str) -> Optional[float]:
+        """
+        获取对冲时限：超过该时间仍未收到首字时，应向下一个端点发起第二个请求
+        Returns:
+            Optional[float]: 窗口内成功请求的 p95 TTFT（秒），样本不足时返回None
+        """
+        with self._lock:
+            ttfts = sorted(ttft for _, ttft in self._window(provider, model) if ttft is not None)
+        if len(ttfts) < self.min_samples:
+            return None
+        return ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.95))]
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        获取各端点滚动窗口内的统计
+        Returns:
+            dict: {"provider/model": {"requests", "error_rate", "ttft_p50", "ttft_p95"}}
+        """
+        result = {}
+        with self._lock:
+            for (provider, model) in list(self._samples):
+                samples = self._window(provider, model)
+                ttfts = sorted(ttft for _, ttft in samples if ttft is not None)
+                result[f"{provider}/{model}"] = {
+                    "requests": len(samples),
+                    "error_rate": 1 - len(ttfts) / len(samples) if samples else 0.0,
+                    "ttft_p50": ttfts[len(ttfts) // 2] if ttfts else None,
+                    "ttft_p95": ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.95))] if ttfts else None,
+                }
+        return result
+
+
+# 进程内共享的默认路由器
+provider_router = ProviderRouter()
@@ -0,0 +1,350 @@
+import asyncio
+import os
+import time
+from typing import AsyncGenerator, AsyncIterable, Dict, Generator, Iterable, List, NamedTuple, Optional
+
+
+class StreamAccumulator:
+    """
+    流式响应累加器，逐个接收stream_chat输出的增量片段
+
+    片段保存在列表中，追加为均摊O(1)；完整文本只在访问text时拼接一次并缓存，
+    避免对每个片段都执行 response += chunk 或重叠合并带来的平方级开销。
+
+    使用示例：
+        acc = StreamAccumulator()
+        for delta in acc.consume(chat_client.stream_chat(provider, model, context)):
+            ...  # delta 为本次新增的文本，acc.text 为目前为止的完整文本
+    """
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._length = 0
+        self._delta = ""
+
+    def append(self, delta: str) -> str:
+        """
+        追加一个增量片段
+        Args:
+            delta: 新增的文本片段
+        Returns:
+            str: 传入的片段本身，方便链式使用
+        """
+        if delta:
+            self._parts.append(delta)
+            self._length += len(delta)
+        self._delta = delta
+        return delta
+
+    @property
+    def delta(self) -> str:
+        """最近一次追加的片段"""
+        return self._delta
+
+    @property
+    def text(self) -> str:
+        """目前为止的完整文本，按需拼接"""
+        if len(self._parts) > 1:
+            # 拼接后只保留一个片段，下次访问只需拼接新增部分
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __str__(self) -> str:
+        return self.text
+
+    def consume(self, stream: Iterable[str]) -> Generator[str, None, None]:
+        """
+        消费一个同步增量流，逐个追加并原样输出每个片段
+        """
+        for delta in stream:
+            yield self.append(delta)
+
+    async def aconsume(self, stream: AsyncIterable[str]) -> AsyncGenerator[str, None]:
+        """
+        消费一个异步增量流，逐个追加并原样输出每个片段
+        """
+        async for delta in stream:
+            yield self.append(delta)
+
+
+class CodeBlockExtractor:
+    """
+    增量代码块提取器，从流式响应中实时提取 <code> ... </code> 或 ``` ... ``` 包裹的代码
+
+    一旦收到开始标记就立即输出其后的代码内容，收到结束标记后停止。
+    标记被拆分在相邻片段之间时也能正确识别：可能是标记前缀的末尾字符会暂存到下一个片段再判断。
+    ``` 开始标记后的语言名（如 ```python）会被跳过。
+
+    使用示例：
+        extractor = CodeBlockExtractor()
+        for delta in chat_client.stream_chat(provider, model, context):
+            if extractor.feed(delta):
+                yield extractor.code
+        extractor.finish()
+    """
+
+    _OPEN_MARKERS = {"<code>": "</code>", "```": "```"}
+
+    def __init__(self):
+        self._pending = ""  # 尚未确定归属的文本
+        self._close_marker = None
+        self._in_fence_header = False  # 处于 ``` 之后、换行之前的语言名部分
+        self._code = StreamAccumulator()
+        self.opened = False
+        self.closed = False
+
+    @property
+    def code(self) -> str:
+        """目前为止提取到的代码"""
+        return self._code.text
+
+    def feed(self, delta: str) -> str:
+        """
+        输入一个响应片段
+        Args:
+            delta: 新增的响应文本
+        Returns:
+            str: 本次新增的代码内容，没有新增时返回空字符串
+        """
+        if self.closed or not delta:
+            return ""
+        self._pending += delta
+        code = ""
+
+        if not self.opened:
+            self._find_open_marker()
+        if self._in_fence_header:
+            self._skip_fence_header()
+        if self.opened and not self._in_fence_header:
+            code = self._take_code()
+
+        return self._code.append(code)
+
+    def finish(self) -> str:
+        """
+        响应结束时调用：代码块没有结束标记时输出暂存的剩余内容
+        Returns:
+            str: 本次新增的代码内容
+        """
+        if self.opened and not self.closed and not self._in_fence_header:
+            rest, self._pending = self._pending, ""
+            self.closed = True
+            return self._code.append(rest)
+        return ""
+
+    def _find_open_marker(self):
+        best_index, best_marker = -1, None
+        for marker in self._OPEN_MARKERS:
+            index = self._pending.find(marker)
+            if index != -1 and (best_index == -1 or index < best_index):
+                best_index, best_marker = index, marker
+        if best_marker is None:
+            # 只保留可能是开始标记前缀的末尾部分
+            keep = max(len(marker) for marker in self._OPEN_MARKERS) - 1
+            self._pending = self._pending[-keep:]
+            return
+        self.opened = True
+        self._close_marker = self._OPEN_MARKERS[best_marker]
+        self._in_fence_header = best_marker == "```"
+        self._pending = self._pending[best_index + len(best_marker):]
+
+    def _skip_fence_header(self):
+        newline = self._pending.find("\n")
+        if newline == -1:
+            return
+        self._in_fence_header = False
+        self._pending = self._pending[newline + 1:]
+
+    def _take_code(self) -> str:
+        index = self._pending.find(self._close_marker)
+        if index != -1:
+            code, self._pending = self._pending[:index], ""
+            self.closed = True
+            return code
+        # 末尾可能是被拆开的结束标记，暂不输出
+        hold = self._partial_suffix(self._pending, self._close_marker)
+        code = self._pending[:len(self._pending) - hold]
+        self._pending = self._pending[len(self._pending) - hold:]
+        return code
+
+    @staticmethod
+    def _partial_suffix(text: str, marker: str) -> int:
+        """返回text末尾与marker前缀重合的最大长度（不含完整marker）"""
+        for length in range(min(len(marker) - 1, len(text)), 0, -1):
+            if text.endswith(marker[:length]):
+                return length
+        return 0
+
+
+class FramePolicy(NamedTuple):
+    """
+    流式输出的分帧策略
+    interval: 两帧之间的最小间隔（秒）
+    max_chars: 积累到这么多字符时不等间隔直接输出一帧
+    growth: 每帧至少包含目前总长度的这个比例，输出越长帧越大，
+            重新发送和渲染完整文本的总开销与输出长度成线性关系，而不是平方关系
+    max_delay: 模型停顿时，暂存的内容最多等待这么久就输出，不受growth限制
+    """
+    interval: float = 0.05
+    max_chars: int = 256
+    growth: float = 0.01
+    max_delay: float = 1.0
+
+
+# 各类输出组件的默认策略：Markdown每次更新都要重新解析渲染整个文本，帧更大更稀疏
+DEFAULT_FRAME_POLICIES = {
+    "markdown": FramePolicy(interval=0.1, max_chars=1024),
+    "code": FramePolicy(interval=0.05, max_chars=256),
+    "text": FramePolicy(interval=0.05, max_chars=256),
+}
+
+
+def _parse_frame_policies(value: str) -> Dict[str, FramePolicy]:
+    """解析 "markdown=100/1024,code=50/256" 形式的配置（间隔毫秒/字符数）"""
+    policies = {}
+    for item in value.split(","):
+        if item.strip():
+            kind, _, spec = item.partition("=")
+            interval_ms, _, max_chars = spec.partition("/")
+            base = DEFAULT_FRAME_POLICIES.get(kind.strip(), FramePolicy())
+            policies[kind.strip()] = base._replace(
+                interval=float(interval_ms) / 1000 if interval_ms.strip() else base.interval,
+                max_chars=int(max_chars) if max_chars.strip() else base.max_chars)
+    return policies
+
+
+def frame_policy(kind: str) -> FramePolicy:
+    """
+    获取某类输出组件（"markdown"、"code"、"text"）的分帧策略，
+    可以通过环境变量 AI_CODELAB_STREAM_FRAMES 覆盖，例如 "markdown=100/1024,code=50/256"（间隔毫秒/字符数）
+    """
+    return _frame_policies.get(kind) or DEFAULT_FRAME_POLICIES.get(kind) or FramePolicy()
+
+
+_frame_policies = _parse_frame_policies(os.getenv("AI_CODELAB_STREAM_FRAMES", ""))
+
+
+class FrameScheduler:
+    """
+    把逐token的增量合并成按时间或大小切分的帧，只在帧边界刷新界面
+
+    第一个片段立即输出，保证首字延迟不受影响。
+
+    使用示例：
+        scheduler = FrameScheduler(frame_policy("markdown"))
+        for delta in stream:
+            acc.append(delta)
+            if scheduler.add(len(delta)):
+                yield acc.text
+        yield acc.text
+    """
+
+    def __init__(self, policy: FramePolicy):
+        self.policy = policy
+        self.pending = 0  # 上一帧之后积累的字符数
+        self.total = 0  # 已经输出的字符数
+        self._last = float("-inf")
+        self.frames = 0
+
+    def add(self, chars: int) -> bool:
+        """
+        记录新增的字符数
+        Returns:
+            bool: 是否应该输出一帧，返回True时视为已经输出
+        """
+        self.pending += chars
+        if self.due():
+            self.flushed()
+            return True
+        return False
+
+    def due(self, now: Optional[float] = None) -> bool:
+        """暂存的内容现在是否应该输出"""
+        if not self.pending:
+            return False
+        policy = self.policy
+        minimum = self.total * policy.growth
+        if self.pending >= max(policy.max_chars, minimum):
+            return True
+        elapsed = (now if now is not None else time.monotonic()) - self._last
+        return elapsed >= policy.max_delay or (elapsed >= policy.interval and self.pending >= minimum)
+
+    def deadline(self) -> float:
+        """暂存的内容最晚应该输出的时间（time.monotonic()），用于在模型停顿时定时刷新"""
+        policy = self.policy
+        if self.pending >= self.total * policy.growth:
+            return self._last + policy.interval
+        return self._last + policy.max_delay
+
+    def flushed(self):
+        self.total += self.pending
+        self.pending = 0
+        self._last = time.monotonic()
+        self.frames += 1
+
+
+def frames(stream: Iterable[str], policy: FramePolicy) -> Generator[str, None, None]:
+    """
+    把同步增量流合并成帧，每帧输出该帧内所有增量拼接后的文本
+    同步流无法定时刷新，模型停顿时暂存的内容在下一个片段到达或流结束时输出
+    """
+    scheduler = FrameScheduler(policy)
+    parts = []
+    for delta in stream:
+        parts.append(delta)
+        if scheduler.add(len(delta)):
+            yield "".join(parts)
+            parts = []
+    if parts:
+        yield "".join(parts)
+
+
+async def aframes(stream: AsyncIterable[str], policy: FramePolicy) -> AsyncGenerator[str, None]:
+    """
+    frames的异步版本：模型停顿时按策略定时输出暂存的内容
+    提前结束（如用户取消）时关闭上游流，释放连接
+    """
+    scheduler = FrameScheduler(policy)
+    iterator = stream.__aiter__()
+    parts = []
+    next_item = None
+    try:
+        while True:
+            if not parts and next_item is None:
+                # 没有暂存内容时不需要定时器，直接等待下一个片段
+                try:
+                    delta = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+            else:
+                # 有暂存内容时在单独的任务中读取下一个片段，到期未到达就先输出暂存的内容
+                if next_item is None:
+                    next_item = asyncio.ensure_future(iterator.__anext__())
+                timeout = max(0.0, scheduler.deadline() - time.monotonic()) if parts else None
+                done, _ = await asyncio.wait({next_item}, timeout=timeout)
+                if not done:
+                    scheduler.flushed()
+                    yield "".join(parts)
+                    parts = []
+                    continue
+                try:
+                    delta = next_item.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_item = None
+            parts.append(delta)
+            if scheduler.add(len(delta)):
+                yield "".join(parts)
+                parts = []
+        if parts:
+            yield "".join(parts)
+    finally:
+        if next_item is not None:
+            next_item.cancel()
+            await asyncio.gather(next_item, return_exceptions=True)
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
@@ -0,0 +1,183 @@
+"""
+Prometheus指标
+
+prometheus_client 是可选依赖，未安装时所有指标都是空操作，业务代码不需要判断。
+指标通过 app.create_app 挂载的 /metrics 路由暴露；直接运行 app.py 时可以设置 AI_CODELAB_METRICS_PORT 单独启动指标服务。
+多进程部署时设置 PROMETHEUS_MULTIPROC_DIR，/metrics 会汇总所有工作进程的指标。
+
+LLM相关指标中的 tokens 按流式响应的片段数统计，各提供商基本是一个token一个片段。
+"""
+import functools
+import inspect
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+INTER_TOKEN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+TOKEN_BUCKETS = (8, 32, 128, 512, 1024, 2048, 4096, 8192, 16384)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320, 640)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+def _histogram(name: str, documentation: str, labelnames: list, buckets: tuple):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Histogram(name, documentation, labelnames, buckets=buckets)
+
+
+def _counter(name: str, documentation: str, labelnames: list):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Counter(name, documentation, labelnames)
+
+
+PROMPT_BUILD_SECONDS = _histogram(
+    "codelab_prompt_build_seconds", "Time spent building prompts", ["feature", "language"], LATENCY_BUCKETS)
+LLM_CONNECT_SECONDS = _histogram(
+    "codelab_llm_connect_seconds", "Time from sending a chat request to receiving response headers "
+    "(connection acquire included)", ["provider", "model"], LATENCY_BUCKETS)
+LLM_TTFT_SECONDS = _histogram(
+    "codelab_llm_ttft_seconds", "Time to first token", ["provider", "model", "feature"], LATENCY_BUCKETS)
+LLM_INTER_TOKEN_SECONDS = _histogram(
+    "codelab_llm_inter_token_seconds", "Latency between consecutive stream chunks", ["provider", "model", "feature"],
+    INTER_TOKEN_BUCKETS)
+LLM_TOKENS = _histogram(
+    "codelab_llm_tokens", "Stream chunks per response", ["provider", "model", "feature"], TOKEN_BUCKETS)
+LLM_TOKENS_PER_SECOND = _histogram(
+    "codelab_llm_tokens_per_second", "Output speed after the first token", ["provider", "model", "feature"],
+    TOKENS_PER_SECOND_BUCKETS)
+POSTPROCESS_SECONDS = _histogram(
+    "codelab_postprocess_seconds", "Time spent post-processing model output (code extraction, merging)",
+    ["feature", "language"], LATENCY_BUCKETS)
+RUN_CODE_SECONDS = _histogram(
+    "codelab_run_code_seconds", "run_code latency", ["language", "cache"], LATENCY_BUCKETS)
+HANDLER_SECONDS = _histogram(
+    "codelab_handler_seconds", "Interface handler duration", ["handler"], LATENCY_BUCKETS)
+ADMISSION_WAIT_SECONDS = _histogram(
+    "codelab_admission_wait_seconds", "Time spent queued for an admission lane", ["kind", "name"], LATENCY_BUCKETS)
+LLM_THROTTLE_WAIT_SECONDS = _histogram(
+    "codelab_llm_throttle_wait_seconds", "Time a chat request waited for rate limits (reason: rate, concurrency, "
+    "retry_after)", ["provider", "model", "reason"], LATENCY_BUCKETS)
+LLM_THROTTLE_EVENTS = _counter(
+    "codelab_llm_throttle_events", "Throttle events: 429 responses from providers and requests rejected locally",
+    ["provider", "model", "event"])
+HANDLER_CANCELLED = _counter(
+    "codelab_handler_cancelled", "Streaming handler runs cancelled before completion (reason: superseded, "
+    "navigation, unload, event)", ["slot", "reason"])
+CACHE_LOOKUPS = _counter(
+    "codelab_cache_lookups", "Lookups of caches keyed by normalized code (result: hit, normalized_hit, miss); "
+    "normalized_hit only hits because formatting differences were normalized away", ["cache", "result"])
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """记录with块的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+class StreamObserver:
+    """
+    记录一次流式响应的TTFT、片段间隔、片段数和输出速度
+    标签只在创建时解析一次，每个片段只有一次observe
+    """
+
+    def __init__(self, provider: str, model: str, feature: Optional[str], ttft: float):
+        labels = (provider, model, feature or "")
+        LLM_TTFT_SECONDS.labels(*labels).observe(ttft)
+        self._inter_token = LLM_INTER_TOKEN_SECONDS.labels(*labels)
+        self._labels = labels
+        self._first = self._last = time.perf_counter()
+        self.tokens = 0
+
+    def token(self):
+        now = time.perf_counter()
+        if self.tokens:
+            self._inter_token.observe(now - self._last)
+        self._last = now
+        self.tokens += 1
+
+    def finish(self):
+        LLM_TOKENS.labels(*self._labels).observe(self.tokens)
+        elapsed = self._last - self._first
+        if self.tokens > 1 and elapsed > 0:
+            LLM_TOKENS_PER_SECOND.labels(*self._labels).observe((self.tokens - 1) / elapsed)
+
+
+def instrument_handler(fn):
+    """
+    记录Interface handler的耗时（生成器handler统计到输出结束或被取消为止）
+    包装后的函数与原函数类型相同（同步/异步/异步生成器），Gradio据此决定调用方式
+    """
+    histogram = HANDLER_SECONDS.labels(fn.__name__)
+
+    if inspect.isasyncgenfunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                async for value in fn(*args, **kwargs):
+                    yield value
+            finally:
+                histogram.observe(time.perf_counter() - start)
+    elif inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+
+def render_latest() -> Optional[Tuple[bytes, str]]:
+    """
+    生成 /metrics 的响应内容
+    Returns:
+        Optional[tuple]: (响应体, Content-Type)，未安装prometheus_client时返回None
+    """
+    if prometheus_client is None:
+        return None
+    registry = prometheus_client.REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int) -> bool:
+    """在单独的端口上启动指标服务，未安装prometheus_client时返回False"""
+    if prometheus_client is None:
+        return False
+    prometheus_client.start_http_server(port)
+    return True
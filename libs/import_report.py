@@ -0,0 +1,83 @@
+"""
+启动导入耗时报告，基于 python -X importtime：
+
+    python -m libs.import_report                      # 统计 import app 的耗时
+    python -m libs.import_report blocks.Interface --top 30 --json report.json
+
+在新的解释器中导入目标模块，按顶层包汇总累计耗时，并列出自身耗时最多的模块。
+保存修改前后的JSON即可对比启动时间的变化。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module: str) -> List[dict]:
+    """
+    在子进程中导入模块并解析 -X importtime 的输出
+    Returns:
+        List[dict]: 每个被导入的模块 {"module", "self_us", "cumulative_us", "depth"}，按导入完成顺序
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=PROJECT_ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} 失败:\n{completed.stderr[-2000:]}")
+
+    entries = []
+    for line in completed.stderr.splitlines():
+        # 格式：import time:       self [us] |  cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        entries.append({
+            "module": name.strip(),
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            # 模块名前的缩进表示嵌套深度，每层两个空格
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+        })
+    return entries
+
+
+def summarize(entries: List[dict], top: int) -> dict:
+    packages: Dict[str, int] = defaultdict(int)
+    for entry in entries:
+        packages[entry["module"].split(".")[0]] += entry["self_us"]
+    return {
+        "total_ms": sum(entry["self_us"] for entry in entries) / 1000,
+        "modules": len(entries),
+        "packages_ms": {name: us / 1000 for name, us in sorted(packages.items(), key=lambda item: -item[1])[:top]},
+        "slowest_modules_ms": {entry["module"]: entry["self_us"] / 1000
+                               for entry in sorted(entries, key=lambda item: -item["self_us"])[:top]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动导入耗时报告")
+    parser.add_argument("module", nargs="?", default="app", help="要导入的模块，默认app")
+    parser.add_argument("--top", type=int, default=20, help="列出的包和模块数量")
+    parser.add_argument("--json", default="", help="把报告写入JSON文件")
+    args = parser.parse_args()
+
+    report = summarize(measure(args.module), args.top)
+    report["module"] = args.module
+    print(f"import {args.module}: {report['total_ms']:.1f} ms, {report['modules']} modules")
+    print("\n按顶层包（自身耗时之和）:")
+    for name, ms in report["packages_ms"].items():
+        print(f"  {ms:9.1f} ms  {name}")
+    print("\n自身耗时最多的模块:")
+    for name, ms in report["slowest_modules_ms"].items():
+        print(f"  {ms:9.1f} ms  {name}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
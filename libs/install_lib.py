@@ -1,11 +1,19 @@
-import importlib
+import hashlib
+import importlib.util
+import json
+import os
 import subprocess
 import sys
 from typing import Optional
 
+# 安装标记的保存目录，按解释器环境（sys.prefix）区分，不同虚拟环境互不影响
+MARKER_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ai_codelab",
+                          "installed-" + hashlib.sha256(sys.prefix.encode("utf-8")).hexdigest()[:12])
+
+
 def is_package_installed(package_name: str) -> bool:
     """
-    检查指定包是否已安装
+    检查指定包是否已安装（只查找模块，不导入，不会执行包的初始化代码）
 
     Args:
         package_name (str): 要检查的包名
@@ -13,21 +21,74 @@ def is_package_installed(package_name: str) -> bool:
     Returns:
         bool: 如果包已安装返回 True，否则返回 False
     """
+    if importlib.util.find_spec(package_name) is not None:
+        return True
+    print(f"package {package_name} not installed")
+    return False
+
+
+def _wheel_fingerprint(wheel_path: str, marker: dict) -> str:
+    """wheel文件的sha256，文件大小和修改时间与标记一致时直接使用标记中的值，避免每次启动都读取整个文件"""
+    stat = os.stat(wheel_path)
+    if marker.get("size") == stat.st_size and marker.get("mtime") == stat.st_mtime:
+        return marker.get("sha256", "")
+    with open(wheel_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def ensure_wheel_installed(package_name: str, wheel_path: str) -> bool:
+    """
+    确保本地wheel已安装，安装结果以wheel的哈希记录在标记文件中
+
+    标记与wheel一致且包能被找到时直接返回；wheel更新（哈希变化）或包缺失时重新安装并更新标记。
+    还没有标记但包已安装时（升级前部署的环境）只写入标记，不重新安装。
+
+    Args:
+        package_name (str): wheel提供的包名
+        wheel_path (str): wheel文件路径
+
+    Returns:
+        bool: 包已可用返回 True，安装失败返回 False
+    """
+    marker_path = os.path.join(MARKER_DIR, f"{package_name}.json")
     try:
-        importlib.import_module(package_name)
+        with open(marker_path, "r", encoding="utf-8") as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        marker = {}
+
+    sha256 = _wheel_fingerprint(wheel_path, marker)
+    installed = importlib.util.find_spec(package_name) is not None
+    if installed and (not marker or marker.get("sha256") == sha256):
+        if not marker:
+            _write_marker(marker_path, wheel_path, sha256)
         return True
-    except ImportError:
-        print(f"package {package_name} not installed")
+
+    # 已安装的包来自旧版本的wheel时需要强制重新安装
+    reinstall = bool(marker) and marker.get("sha256") != sha256
+    if not install_package(wheel_path, force_reinstall=reinstall):
         return False
 
+    _write_marker(marker_path, wheel_path, sha256)
+    importlib.invalidate_caches()
+    return True
+
+
+def _write_marker(marker_path: str, wheel_path: str, sha256: str):
+    stat = os.stat(wheel_path)
+    os.makedirs(MARKER_DIR, exist_ok=True)
+    with open(marker_path, "w", encoding="utf-8") as f:
+        json.dump({"sha256": sha256, "size": stat.st_size, "mtime": stat.st_mtime, "wheel": wheel_path}, f)
+
 
-def install_package(package_name: str, version: Optional[str] = None) -> bool:
+def install_package(package_name: str, version: Optional[str] = None, force_reinstall: bool = False) -> bool:
     """
     安装指定的 Python 包
 
     Args:
         package_name (str): 要安装的包名
         version (Optional[str]): 指定版本号，默认为最新版
+        force_reinstall (bool): 是否强制重新安装（同版本号的wheel内容更新时需要）
 
     Returns:
         bool: 安装成功返回 True，失败返回 False
@@ -35,6 +96,8 @@ def install_package(package_name: str, version: Optional[str] = None) -> bool:
     print(f"installing package {package_name}")
 
     install_cmd = [sys.executable, "-m", "pip", "install"]
+    if force_reinstall:
+        install_cmd += ["--force-reinstall", "--no-deps"]
     if version:
         package_spec = f"{package_name}=={version}"
     else: